@@ -0,0 +1,111 @@
+"""Measures /login latency and throughput at several bcrypt costs and worker counts.
+
+Each run logs one employee in over and over from a pool of worker threads
+against a throwaway SQLite database, like a shift change where everyone signs
+in at once, and reports p50/p99 latency and logins per second.
+
+    python benchmarks/bench_login.py --costs 10,11,12,13 --workers 1,2,4,8 --logins 64
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EMAIL = 'bench@bloodbank.test'
+PASSWORD = 'benchmark-password'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def create_bench_app(db_path):
+    from bloodapp import create_app
+    from bloodapp.config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+        WTF_CSRF_ENABLED = False
+
+    return create_app(BenchConfig)
+
+
+def setup(app):
+    from bloodapp import db, migrations
+    from bloodapp.models import Staff
+    with app.app_context():
+        migrations.upgrade()
+        db.session.add(Staff(first_name='bench', last_name='mark', password='x', email=EMAIL,
+                             role='Nurse', location='Denton'))
+        db.session.commit()
+
+
+def set_cost(app, cost):
+    """Stores the benchmark password at this cost so logins do not rehash it"""
+    from bloodapp import db, passwords
+    from bloodapp.models import Staff
+    app.config['BCRYPT_LOG_ROUNDS'] = cost
+    with app.app_context():
+        staff = Staff.query.filter_by(email=EMAIL).first()
+        staff.password = passwords.hash_password(PASSWORD)
+        db.session.commit()
+
+
+def login_once(app):
+    client = app.test_client()
+    start = time.perf_counter()
+    response = client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+    elapsed = time.perf_counter() - start
+    if response.status_code != 302:
+        raise RuntimeError(f'login failed with status {response.status_code}')
+    return elapsed
+
+
+def run(app, cost, workers, logins):
+    set_cost(app, cost)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        samples = list(pool.map(lambda _: login_once(app), range(logins)))
+    wall = time.perf_counter() - start
+    return {
+        "cost": cost,
+        "workers": workers,
+        "logins": logins,
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "logins_per_sec": round(logins / wall, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--costs', default='10,11,12,13', help='comma separated bcrypt log rounds')
+    parser.add_argument('--workers', default='1,2,4,8', help='comma separated worker thread counts')
+    parser.add_argument('--logins', type=int, default=64, help='logins per run')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_bench_app(os.path.join(tmp, 'bench.db'))
+        setup(app)
+        print(f'{"cost":>4} {"workers":>7} {"p50 ms":>9} {"p99 ms":>9} {"logins/s":>9}')
+        for cost in [int(c) for c in args.costs.split(',')]:
+            for workers in [int(w) for w in args.workers.split(',')]:
+                result = run(app, cost, workers, args.logins)
+                results.append(result)
+                print(f'{cost:>4} {workers:>7} {result["p50_ms"]:>9} {result["p99_ms"]:>9} {result["logins_per_sec"]:>9}')
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
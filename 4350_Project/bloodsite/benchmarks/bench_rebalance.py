@@ -0,0 +1,109 @@
+"""Times the rebalancing planner over made up bank networks and checks its plans.
+
+Each network has --banks branches with a target and a stock level for all
+eight blood types as blood and as plasma. Stock is spread unevenly, with a
+few large branches holding most of it, so some branches are short and some
+have plenty to give. Every plan is checked: no branch gives more than it has
+spare, no branch receives more than it is short, as much as possible is
+moved, and there are fewer transfers than branches involved.
+
+    python benchmarks/bench_rebalance.py --banks 500 --budget-ms 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import BLOOD_TYPES, bank_locations, bank_weights
+
+
+def network(rng, banks):
+    """Returns:
+        tuple: counts and targets for plan()"""
+    locations = bank_locations(banks)
+    weights = bank_weights(banks)
+    counts = {}
+    targets = {}
+    for blood_type, share in BLOOD_TYPES.items():
+        for blood in (True, False):
+            total = int(share * banks * (3 if blood else 1))
+            for location, weight in zip(locations, weights):
+                key = (location, blood_type, blood, not blood)
+                targets[key] = rng.randint(0, int(share) + 2)
+                counts[key] = int(total * weight / sum(weights) * rng.uniform(0.5, 1.5))
+    return counts, targets
+
+
+def check(counts, targets, result):
+    """Returns:
+        list: What is wrong with the plan, empty when it is right"""
+    problems = []
+    moved = {}
+    for transfer in result["transfers"]:
+        blood = transfer["kind"] == 'blood'
+        giver = (transfer["from"], transfer["blood_type"], blood, not blood)
+        taker = (transfer["to"], transfer["blood_type"], blood, not blood)
+        moved[giver] = moved.get(giver, 0) - transfer["units"]
+        moved[taker] = moved.get(taker, 0) + transfer["units"]
+    groups = {}
+    for key, target in targets.items():
+        after = counts.get(key, 0) + moved.get(key, 0)
+        before = counts.get(key, 0)
+        if moved.get(key, 0) < 0 and after < target:
+            problems.append(f'{key} gave away units it needed')
+        if moved.get(key, 0) > 0 and after > target:
+            problems.append(f'{key} was sent more than it was short')
+        spare, short, banks = groups.get(key[1:], (0, 0, 0))
+        groups[key[1:]] = (spare + max(0, before - target), short + max(0, target - before),
+                           banks + (before != target))
+    unmet = {}
+    for short in result["unmet"]:
+        group = (short["blood_type"], short["kind"] == 'blood', short["kind"] == 'plasma')
+        unmet[group] = unmet.get(group, 0) + short["units"]
+    transfers = {}
+    for transfer in result["transfers"]:
+        group = (transfer["blood_type"], transfer["kind"] == 'blood', transfer["kind"] == 'plasma')
+        transfers[group] = transfers.get(group, 0) + 1
+    for group, (spare, short, banks) in groups.items():
+        if unmet.get(group, 0) != max(0, short - spare):
+            problems.append(f'{group} left {unmet.get(group, 0)} short, expected {max(0, short - spare)}')
+        if banks and transfers.get(group, 0) >= banks:
+            problems.append(f'{group} used {transfers.get(group, 0)} transfers for {banks} branches')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--banks', type=int, default=500, help='branches in each network')
+    parser.add_argument('--networks', type=int, default=20, help='networks to plan')
+    parser.add_argument('--budget-ms', type=float, default=1000, help='fail when the slowest plan takes longer')
+    parser.add_argument('--seed', type=int, default=4350)
+    args = parser.parse_args()
+
+    from bloodapp.rebalance import plan
+
+    rng = random.Random(args.seed)
+    timings = []
+    transfers = 0
+    for _ in range(args.networks):
+        counts, targets = network(rng, args.banks)
+        start = time.perf_counter()
+        result = plan(counts, targets)
+        timings.append(time.perf_counter() - start)
+        problems = check(counts, targets, result)
+        if problems:
+            sys.exit('\n'.join(problems[:20]))
+        transfers += len(result["transfers"])
+
+    slowest = max(timings) * 1000
+    print(f'{args.networks} networks of {args.banks} banks, {transfers / args.networks:.0f} transfers each')
+    print(f'mean {sum(timings) / len(timings) * 1000:.2f} ms, slowest {slowest:.2f} ms')
+    if slowest > args.budget_ms:
+        sys.exit(f'slowest plan took over the {args.budget_ms:.0f} ms budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Times donor searches against a seeded database and fails over the budget.
+
+Queries are built from random donors in the database: a last name prefix,
+the first two letters of a last name, a full name, part of an email, and a
+name with two letters swapped to exercise the typo matching. Build a large
+database first:
+
+    python benchmarks/seed.py /tmp/search.db --donors 1000000 --donations 0
+    python benchmarks/bench_search.py /tmp/search.db --budget-ms 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def swap_letters(rng, word):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def queries_for(rng, donor):
+    """Returns:
+        dict: One query of each kind for this donor"""
+    local_part = donor.email.split('@')[0]
+    return {
+        "prefix": donor.last_name[:4],
+        "short": donor.last_name[:2],
+        "full name": f'{donor.first_name} {donor.last_name}',
+        "email": local_part[-8:],
+        "typo": f'{donor.first_name} {swap_letters(rng, donor.last_name)}',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='a database built by seed.py')
+    parser.add_argument('--samples', type=int, default=50, help='donors to build queries from')
+    parser.add_argument('--budget-ms', type=float, default=20, help='fail when any kind has a p99 above this')
+    parser.add_argument('--seed', type=int, default=4350)
+    args = parser.parse_args()
+
+    from bloodapp import create_app, db
+    from bloodapp.config import Config
+    from bloodapp.models import Donor
+    from bloodapp.search import has_index, search_donors
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.abspath(args.path)}'
+
+    rng = random.Random(args.seed)
+    with create_app(BenchConfig).app_context():
+        if not has_index():
+            sys.exit('no donor_search index, run "flask db upgrade" against this database first')
+        highest = db.session.query(db.func.max(Donor.id)).scalar()
+        donors = [Donor.query.get(rng.randint(1, highest)) for _ in range(args.samples)]
+        timings = {}
+        for donor in donors:
+            if donor is None:
+                continue
+            for kind, query in queries_for(rng, donor).items():
+                db.session.remove()
+                start = time.perf_counter()
+                search_donors(query)
+                timings.setdefault(kind, []).append(time.perf_counter() - start)
+
+    print(f'{highest} donors')
+    print(f'{"kind":<10} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    over = []
+    for kind, samples in timings.items():
+        p99 = percentile(samples, 99) * 1000
+        print(f'{kind:<10} {percentile(samples, 50) * 1000:>8.2f} {p99:>8.2f} {max(samples) * 1000:>8.2f}')
+        if p99 > args.budget_ms:
+            over.append(kind)
+    if over:
+        sys.exit(f'{", ".join(over)} over the {args.budget_ms:.0f} ms budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Runs parallel writers against DonorPage and fails on "database is locked".
+
+Several processes, like several waitress/gunicorn workers, each log in as a
+different employee and record donations for their own donors at the same time
+against one throwaway SQLite file using the production database settings.
+
+    python benchmarks/concurrent_donations.py --writers 8 --donations 50
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup(writers, donations):
+    from bloodapp import create_app, db, migrations
+    from bloodapp.models import Staff, Donor
+    with create_app().app_context():
+        migrations.upgrade()
+        for writer in range(writers):
+            db.session.add(Staff(first_name='writer', last_name=str(writer), password='x',
+                                 email=f'writer{writer}@bloodbank.test', role='Nurse', location=f'Bank {writer}'))
+        db.session.flush()
+        db.session.execute(Donor.__table__.insert(), [
+            {"first_name": "donor", "last_name": str(i), "email": f"donor{i}@bloodbank.test",
+             "age": 30, "blood_type": "O-"} for i in range(writers * donations)])
+        db.session.commit()
+        db.engine.dispose()
+
+
+def writer(args):
+    """Donates blood for this writer's slice of donors through the DonorPage route"""
+    index, donations = args
+    from bloodapp import create_app
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(index + 1)
+        session['_fresh'] = True
+    errors = []
+    start = time.perf_counter()
+    for donor_id in range(index * donations + 1, (index + 1) * donations + 1):
+        try:
+            response = client.post(f'/DonorPage/{donor_id}', data={'donate_blood': '1'})
+            if response.status_code != 200:
+                errors.append(f'donor {donor_id}: status {response.status_code}')
+        except Exception as e:
+            errors.append(f'donor {donor_id}: {e}')
+    return time.perf_counter() - start, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8, help='parallel writer processes')
+    parser.add_argument('--donations', type=int, default=50, help='donations per writer')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "concurrency.db")}'
+        setup(args.writers, args.donations)
+        start = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(args.writers) as pool:
+            results = pool.map(writer, [(i, args.donations) for i in range(args.writers)])
+        wall = time.perf_counter() - start
+
+        from bloodapp import create_app, inventory
+        from bloodapp.models import Donation
+        with create_app().app_context():
+            stored = Donation.query.count()
+            drift = inventory.verify()
+
+    errors = [error for _, result_errors in results for error in result_errors]
+    expected = args.writers * args.donations
+    print(f'{args.writers} writers, {expected} donations in {wall:.2f}s ({expected / wall:.1f}/s)')
+    print(f'{stored} donations stored, {len(errors)} errors, {len(drift)} inventory rows out of date')
+    for error in errors[:10]:
+        print(error)
+    if errors or stored != expected or drift:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Checks how long it takes to import bloodapp and build an app against a budget.
+
+Times `from bloodapp import create_app` plus create_app() with the in-memory
+TestingConfig in a fresh interpreter, exits with an error when that is over
+budget, and uses `python -X importtime` to list the packages that cost the most.
+
+    python benchmarks/importtime.py --budget-ms 600
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SITE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time
+start = time.perf_counter()
+from bloodapp import create_app
+from bloodapp.config import TestingConfig
+imported = time.perf_counter()
+create_app(TestingConfig)
+done = time.perf_counter()
+print(f'{(imported - start) * 1000:.1f} {(done - imported) * 1000:.1f}')
+"""
+
+
+def parse_importtime(stderr):
+    """Reads the -X importtime report
+    Returns:
+        list: (cumulative microseconds, depth, module) for every import"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        module = module[1:]
+        depth = (len(module) - len(module.lstrip())) // 2
+        rows.append((int(cumulative), depth, module.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=600, help='fail above this total')
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest imports to list')
+    args = parser.parse_args()
+
+    timed = subprocess.run([sys.executable, '-c', PROBE], cwd=SITE, capture_output=True, text=True)
+    if timed.returncode != 0:
+        sys.exit(timed.stderr)
+    import_ms, create_app_ms = (float(value) for value in timed.stdout.split())
+    total_ms = import_ms + create_app_ms
+    print(f'import {import_ms:.1f} ms, create_app {create_app_ms:.1f} ms, '
+          f'total {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)')
+
+    traced = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=SITE,
+                            capture_output=True, text=True)
+    packages = [row for row in parse_importtime(traced.stderr) if '.' not in row[2] and row[2] != 'bloodapp']
+    print('slowest packages (under -X importtime):')
+    for cumulative, depth, module in sorted(packages, reverse=True)[:args.top]:
+        print(f'  {cumulative / 1000:8.1f} ms  {module}')
+    if total_ms > args.budget_ms:
+        sys.exit(f'startup took {total_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget')
+
+
+if __name__ == '__main__':
+    main()
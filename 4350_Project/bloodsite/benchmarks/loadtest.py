@@ -0,0 +1,219 @@
+"""Drives the main staff workflow against a running site and reports per route latency.
+
+Each virtual user logs in as its own seeded employee and then loops over
+LoadDonor -> DonorPage (donate blood) -> withdraw -> CreateBank until the time
+is up. Build the database with benchmarks/seed.py first. With --launch the
+script starts waitress on that database itself, otherwise point --url at a
+site that is already running.
+
+    python benchmarks/seed.py /tmp/load.db
+    python benchmarks/loadtest.py --launch /tmp/load.db --users 8 --duration 60 --json results.json
+    python benchmarks/loadtest.py --launch /tmp/load.db --compare results.json
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+SITE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from seed import PASSWORD, BLOOD_TYPES, staff_email
+
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Results:
+    """Latency samples and error counts per route, shared by every user thread"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, route, elapsed, ok):
+        with self.lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, wall):
+        """Returns:
+            dict: requests, errors, requests per second and latency percentiles in ms for each route"""
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors.get(route, 0),
+                "rps": round(len(samples) / wall, 2),
+                "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p90_ms": round(percentile(samples, 90) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            }
+        return routes
+
+
+class User:
+    """One employee's browser: a cookie jar, plus the path and CSRF token of the last page"""
+
+    def __init__(self, url, results, timeout):
+        self.url = url.rstrip('/')
+        self.results = results
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.csrf = None
+        self.page = None
+
+    def request(self, route, path, data=None):
+        """Fetches a page, following redirects, and records how long it took under route
+        Returns:
+            str: The final page's HTML, empty if the request failed"""
+        if data is not None:
+            data = urllib.parse.urlencode(dict(data, csrf_token=self.csrf or '')).encode()
+        start = time.perf_counter()
+        try:
+            with self.opener.open(self.url + path, data, timeout=self.timeout) as response:
+                body = response.read().decode()
+                ok = response.status == 200
+                self.page = urllib.parse.urlparse(response.geturl()).path
+        except (urllib.error.URLError, OSError):
+            body, ok = '', False
+            self.page = None
+        self.results.add(route, time.perf_counter() - start, ok)
+        match = CSRF.search(body)
+        if match:
+            self.csrf = match.group(1)
+        return body
+
+    def login(self, email):
+        self.request('GET /login', '/login')
+        body = self.request('POST /login', '/login', {"email": email, "password": PASSWORD})
+        return 'Login successful' in body
+
+    def scenario(self, rng, donors, banks):
+        self.request('GET /LoadDonor', '/LoadDonor')
+        self.request('POST /LoadDonor', '/LoadDonor', {"donor_id": rng.randint(1, donors)})
+        if self.page and self.page.startswith('/DonorPage/'):
+            self.request('POST /DonorPage', self.page, {"donate_blood": 'Donate Blood'})
+        self.request('GET /withdraw', '/withdraw')
+        self.request('POST /withdraw', '/withdraw', {
+            "blood_type": rng.choices(list(BLOOD_TYPES), list(BLOOD_TYPES.values()))[0],
+            "blood_or_plasma": rng.choice(['Blood', 'Plasma']), "units": rng.randint(1, 3)})
+        self.request('GET /CreateBank', f'/CreateBank?page={rng.randint(1, max(1, (banks + 4) // 5))}')
+
+
+def run_user(index, args, results, deadline):
+    rng = random.Random(args.seed + index)
+    user = User(args.url, results, args.timeout)
+    if not user.login(staff_email(index % args.staff)):
+        print(f'user {index} could not log in as {staff_email(index % args.staff)}', file=sys.stderr)
+        return
+    while time.perf_counter() < deadline:
+        user.scenario(rng, args.donors, args.banks)
+
+
+def launch(db_path, port, threads):
+    """Starts waitress on the seeded database and waits until it answers"""
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.abspath(db_path)}')
+    server = subprocess.Popen([sys.executable, '-m', 'waitress', f'--port={port}', f'--threads={threads}', 'wsgi:app'],
+                              cwd=SITE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + '/login', timeout=1).close()
+            return server, url
+        except OSError:
+            if server.poll() is not None:
+                sys.exit('the server exited, is waitress installed?')
+            time.sleep(0.1)
+    server.terminate()
+    sys.exit('the server did not start')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SITE, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(routes, previous=None):
+    print(f'{"route":<16} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8}')
+    for route, row in routes.items():
+        line = (f'{route:<16} {row["requests"]:>8} {row["errors"]:>6} {row["rps"]:>8} '
+                f'{row["p50_ms"]:>8} {row["p90_ms"]:>8} {row["p99_ms"]:>8}')
+        old = (previous or {}).get(route)
+        if old:
+            line += f'  p50 {row["p50_ms"] - old["p50_ms"]:+.2f} p99 {row["p99_ms"] - old["p99_ms"]:+.2f}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='a site that is already running')
+    parser.add_argument('--launch', metavar='DB', help='start waitress on this seeded database instead')
+    parser.add_argument('--port', type=int, default=5050, help='port for --launch')
+    parser.add_argument('--threads', type=int, default=8, help='waitress threads for --launch')
+    parser.add_argument('--users', type=int, default=8, help='virtual users running at once')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run for')
+    parser.add_argument('--staff', type=int, default=50, help='how many staff were seeded')
+    parser.add_argument('--banks', type=int, default=10, help='how many banks were seeded')
+    parser.add_argument('--donors', type=int, default=200000, help='how many donors were seeded')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request counts as failed')
+    parser.add_argument('--seed', type=int, default=4350)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='show the change from an earlier --json file')
+    args = parser.parse_args()
+
+    server = None
+    if args.launch:
+        server, args.url = launch(args.launch, args.port, args.threads)
+    try:
+        results = Results()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        users = [threading.Thread(target=run_user, args=(i, args, results, deadline)) for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        wall = time.perf_counter() - start
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    routes = results.summary(wall)
+    previous = None
+    if args.compare:
+        with open(args.compare) as old:
+            previous = json.load(old)['routes']
+    print_table(routes, previous)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({"commit": git_commit(), "date": datetime.datetime.utcnow().isoformat(),
+                       "users": args.users, "duration": round(wall, 2), "routes": routes}, out, indent=2)
+    if any(row["errors"] for row in routes.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
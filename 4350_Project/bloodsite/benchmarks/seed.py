@@ -0,0 +1,161 @@
+"""Fills a new SQLite database with made up staff, banks, donors and donations.
+
+The numbers follow rough real world shapes: blood types at US population
+frequencies, a few large banks and many small ones, more donations in recent
+months, about a third of donors still inside their waiting period, and older
+units already marked expired. The same --seed always builds the same database,
+so load test runs can be compared.
+
+    python benchmarks/seed.py /tmp/load.db --staff 50 --banks 10 --donors 200000 --donations 2000000
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'load-test-password'
+BLOOD_TYPES = {'O+': 37.4, 'A+': 35.7, 'B+': 8.5, 'O-': 6.6, 'A-': 6.3, 'AB+': 3.4, 'B-': 1.5, 'AB-': 0.6}
+CITIES = ['Denton', 'Dallas', 'Fort Worth', 'Arlington', 'Plano', 'Frisco', 'McKinney', 'Irving',
+          'Garland', 'Lewisville', 'Flower Mound', 'Carrollton', 'Grapevine', 'Keller', 'Mansfield']
+FIRST_NAMES = ['james', 'mary', 'robert', 'patricia', 'john', 'jennifer', 'michael', 'linda', 'david',
+               'elizabeth', 'william', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah',
+               'maria', 'jose', 'juan', 'ana', 'luis', 'carmen', 'wei', 'mei', 'anh', 'minh', 'priya', 'raj']
+LAST_NAMES = ['smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez',
+              'martinez', 'hernandez', 'lopez', 'gonzalez', 'wilson', 'anderson', 'thomas', 'taylor', 'moore',
+              'nguyen', 'tran', 'patel', 'kim', 'lee', 'chen', 'wright', 'walker', 'young', 'allen']
+ROLES = {'Nurse': 70, 'Doctor': 20, 'Admin': 10}
+
+
+def staff_email(index):
+    return f'staff{index}@bloodbank.test'
+
+
+def bank_locations(count):
+    """The first banks are named after cities, the rest are numbered branches"""
+    return [CITIES[i] if i < len(CITIES) else f'Branch {i + 1}' for i in range(count)]
+
+
+def bank_weights(count):
+    """Zipf like weights so the first banks see most of the donations"""
+    return [1 / (rank + 1) for rank in range(count)]
+
+
+def _when(rng, now, days):
+    """A time in the last `days` days, weighted toward the recent end"""
+    return now - datetime.timedelta(days=days * rng.random() ** 2, seconds=rng.randrange(86400))
+
+
+def generate_staff(rng, count, locations, password):
+    for i in range(count):
+        yield {"first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES), "password": password,
+               "email": staff_email(i), "role": 'Admin' if i == 0 else rng.choices(list(ROLES), list(ROLES.values()))[0],
+               "location": locations[i % len(locations)]}
+
+
+def generate_donors(rng, count, locations, now):
+    from bloodapp.eligibility import WAIT
+    types = rng.choices(list(BLOOD_TYPES), list(BLOOD_TYPES.values()), k=count)
+    homes = rng.choices(locations, bank_weights(len(locations)), k=count)
+    for i in range(count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        roll = rng.random()
+        last_blood = _when(rng, now, 365) if roll < 0.6 else None
+        last_plasma = _when(rng, now, 365) if roll > 0.8 else None
+        yield {"first_name": first_name, "last_name": last_name, "email": f'{first_name}.{last_name}{i}@donor.test',
+               "age": min(80, max(17, int(rng.gauss(40, 14)))), "blood_type": types[i], "location": homes[i],
+               "last_blood_donation_date": last_blood, "last_plasma_donation_date": last_plasma,
+               "next_blood_eligible": last_blood + WAIT['blood'] if last_blood else now,
+               "next_plasma_eligible": last_plasma + WAIT['plasma'] if last_plasma else now}
+
+
+def generate_donations(rng, count, locations, now):
+    from bloodapp.expiry import expires_at
+    weights = bank_weights(len(locations))
+    types = list(BLOOD_TYPES)
+    type_weights = list(BLOOD_TYPES.values())
+    for _ in range(count):
+        blood = rng.random() < 0.7
+        date = _when(rng, now, 730)
+        expires = expires_at(date, blood)
+        yield {"blood_type": rng.choices(types, type_weights)[0], "blood": blood, "plasma": not blood,
+               "date": date, "location": rng.choices(locations, weights)[0], "expires": expires,
+               "expired": expires <= now}
+
+
+def insert(table, rows, chunk_size):
+    """Writes the rows with one executemany per chunk
+    Returns:
+        int: The number of rows written"""
+    from bloodapp import db
+    from bloodapp.bulk_donors import _chunks
+    written = 0
+    for chunk in _chunks(rows, chunk_size):
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        written += len(chunk)
+    return written
+
+
+def seed(path, staff, banks, donors, donations, seed_value=4350, chunk_size=20000):
+    """Builds the database at path and prints how long each table took"""
+    from bloodapp import analytics, create_app, inventory, ledger, migrations, passwords
+    from bloodapp.config import Config
+    from bloodapp.models import Staff, Bank, Donor, Donation
+
+    class SeedConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.abspath(path)}'
+
+    rng = random.Random(seed_value)
+    now = datetime.datetime.utcnow()
+    locations = bank_locations(banks)
+    with create_app(SeedConfig).app_context():
+        # Built at the latest schema version, with the donor search index and
+        # its triggers, so the file can be copied with "flask db copy-from"
+        migrations.upgrade()
+        steps = [
+            ('staff', lambda: insert(Staff.__table__, generate_staff(rng, staff, locations,
+                                                                     passwords.hash_password(PASSWORD)), chunk_size)),
+            ('banks', lambda: insert(Bank.__table__, ({"location": location, "manager_id": i + 1}
+                                                      for i, location in enumerate(locations)), chunk_size)),
+            ('donors', lambda: insert(Donor.__table__, generate_donors(rng, donors, locations, now), chunk_size)),
+            ('donations', lambda: insert(Donation.__table__, generate_donations(rng, donations, locations, now),
+                                         chunk_size)),
+            ('inventory', inventory.rebuild),
+            # The made up donations have no ledger events, so the ledger opens
+            # from the inventory they add up to, as "flask db upgrade" does
+            ('ledger', lambda: ledger.open_from_inventory() and 1),
+            ('rollups', lambda: analytics.backfill(force=True)),
+        ]
+        for name, step in steps:
+            start = time.perf_counter()
+            written = step()
+            print(f'{name:>10}: {written} rows in {time.perf_counter() - start:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='the SQLite file to create')
+    parser.add_argument('--staff', type=int, default=50)
+    parser.add_argument('--banks', type=int, default=10)
+    parser.add_argument('--donors', type=int, default=200000)
+    parser.add_argument('--donations', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=4350, help='random seed, the same seed builds the same data')
+    parser.add_argument('--force', action='store_true', help='replace the file if it exists')
+    args = parser.parse_args()
+
+    if args.banks > args.staff:
+        parser.error('every bank needs a manager, so --staff must be at least --banks')
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f'{args.path} already exists, pass --force to replace it')
+        os.remove(args.path)
+    seed(args.path, args.staff, args.banks, args.donors, args.donations, args.seed)
+    print(f'staff log in as {staff_email(0)} (Admin) to {staff_email(args.staff - 1)} with password {PASSWORD}')
+
+
+if __name__ == '__main__':
+    main()
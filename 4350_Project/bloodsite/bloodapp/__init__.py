@@ -1,24 +1,57 @@
-import os
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
+from werkzeug.middleware.proxy_fix import ProxyFix
+from bloodapp.config import Config
+from bloodapp.database import TunedSQLAlchemy
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = '5791628bb0b13ce0c676dfde280ba245'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-loginManager = LoginManager(app)
-loginManager.login_view = 'login'
+db = TunedSQLAlchemy()
+bcrypt = Bcrypt()
+loginManager = LoginManager()
+loginManager.login_view = 'staff.login'
 loginManager.login_message_category = "info"
-app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER')
-app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASSWORD')
-mail = Mail(app)
+mail = Mail()
 
-from bloodapp import routes
 
+def create_app(config=Config):
+    """Builds the site. Nothing touches the database until the first request
+    or command needs it, so tests and workers can each build their own app
+    Args:
+        config (class): The settings, Config by default or TestingConfig for tests
+    Returns:
+        Flask: The app"""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    if app.config['PROXY_COUNT']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    loginManager.init_app(app)
+    mail.init_app(app)
+
+    from bloodapp.metrics import metrics
+    metrics.init_app(app)
+    from bloodapp.cache import page_cache
+    page_cache.init_app(app)
+    from bloodapp.reporting import reporting
+    reporting.init_app(app)
+    from bloodapp.ratelimit import rate_limiter
+    rate_limiter.init_app(app)
+
+    from bloodapp.main.routes import main
+    from bloodapp.donors.routes import donors
+    from bloodapp.staff.routes import staff
+    from bloodapp.banks.routes import banks
+    from bloodapp.inventory.routes import inventory
+    app.register_blueprint(main)
+    app.register_blueprint(donors)
+    app.register_blueprint(staff)
+    app.register_blueprint(banks)
+    app.register_blueprint(inventory)
+
+    from bloodapp.commands import register_commands
+    register_commands(app)
+
+    return app
@@ -0,0 +1,190 @@
+import datetime
+from sqlalchemy import func
+from bloodapp import db
+from bloodapp.database import increment
+from bloodapp.models import Donation, DonationRollup, Shipment
+
+BUCKETS = ['day', 'week', 'month']
+GROUPS = ['blood_type', 'location', 'kind']
+# Enough for two years by day or twenty by week, and keeps the JSON small
+MAX_BUCKETS = 1000
+# Shipments made before the rollups existed do not say which branches the
+# units came from, so the backfill counts them under this location
+UNASSIGNED = ''
+
+
+def _kind(blood):
+    return 'blood' if blood else 'plasma'
+
+
+def _today():
+    return datetime.datetime.utcnow().date()
+
+
+def record(day, location, blood_type, kind, donated=0, withdrawn=0):
+    """Adds to one day's rollup row, creating it if needed.
+    This only adds to the session, the caller commits with the rest of its work
+    Args:
+        day (date): The day the units came in or went out
+        location (str): The branch
+        blood_type (str): The blood type of the units
+        kind (str): "blood" or "plasma"
+        donated (int): Units donated
+        withdrawn (int): Units shipped out"""
+    increment(db.session, DonationRollup.__table__,
+              {"day": day, "location": location, "blood_type": blood_type, "kind": kind},
+              {"donated": donated, "withdrawn": withdrawn})
+
+
+def record_donation(donation):
+    """Counts a new donation into today's rollup
+    Args:
+        donation (obj): This is a donation from the DONATION table"""
+    day = donation.date.date() if donation.date else _today()
+    record(day, donation.location, donation.blood_type, _kind(donation.blood), donated=1)
+
+
+def record_donations(donations):
+    """Counts a batch of new donations into their days' rollups, with one
+    upsert for each rollup row they touch
+    Args:
+        donations (list): Donations from the DONATION table"""
+    counts = {}
+    for donation in donations:
+        key = (donation.date.date() if donation.date else _today(), donation.location,
+               donation.blood_type, _kind(donation.blood))
+        counts[key] = counts.get(key, 0) + 1
+    for (day, location, blood_type, kind), donated in sorted(counts.items()):
+        record(day, location, blood_type, kind, donated=donated)
+
+
+def record_withdrawal(blood_type, blood, plasma, shipped):
+    """Counts shipped units into today's rollup
+    Args:
+        blood_type (str): The blood type that was shipped
+        blood (bool): if the units were blood
+        plasma (bool): if the units were plasma
+        shipped (dict): The number of units shipped from each location"""
+    day = _today()
+    for location, units in shipped.items():
+        record(day, location, blood_type, _kind(blood), withdrawn=units)
+
+
+def _day(column):
+    return func.date(column).label('day')
+
+
+def backfill(force=False):
+    """Fills the rollups from history: donations still on the shelf by the
+    day they came in, and past shipments by the day they went out. Shipped
+    donations were deleted, so their intake cannot be counted, which is why
+    this only runs on empty rollups unless forced
+    Args:
+        force (bool): Throw away the rollups that are there first
+    Returns:
+        int: The number of rollup rows written, None if there were rollups already"""
+    table = DonationRollup.__table__
+    if db.session.query(DonationRollup.id).first() is not None:
+        if not force:
+            return None
+        db.session.execute(table.delete())
+    rows = {}
+    donated = db.session.query(_day(Donation.date), Donation.location, Donation.blood_type, Donation.blood,
+                               func.count(Donation.id)) \
+        .group_by('day', Donation.location, Donation.blood_type, Donation.blood)
+    for day, location, blood_type, blood, count in donated:
+        rows[day, location, blood_type, _kind(blood)] = [count, 0]
+    withdrawn = db.session.query(_day(Shipment.date), Shipment.blood_type, Shipment.blood,
+                                 func.sum(Shipment.units)) \
+        .group_by('day', Shipment.blood_type, Shipment.blood)
+    for day, blood_type, blood, units in withdrawn:
+        rows.setdefault((day, UNASSIGNED, blood_type, _kind(blood)), [0, 0])[1] += units
+    if rows:
+        db.session.execute(table.insert(), [
+            {"day": datetime.date.fromisoformat(str(key[0])), "location": key[1], "blood_type": key[2],
+             "kind": key[3], "donated": counts[0], "withdrawn": counts[1]}
+            for key, counts in rows.items()])
+    db.session.commit()
+    return len(rows)
+
+
+def bucket_start(day, bucket):
+    """Returns:
+        date: The first day of the day, week (starting Monday) or month that day is in"""
+    if bucket == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(start, bucket):
+    if bucket == 'week':
+        return start + datetime.timedelta(weeks=1)
+    if bucket == 'month':
+        return (start + datetime.timedelta(days=32)).replace(day=1)
+    return start + datetime.timedelta(days=1)
+
+
+def bucket_starts(start, end, bucket):
+    """Returns:
+        list: The first day of every bucket from start to end
+    Raises:
+        ValueError: If the range is backwards or has more than MAX_BUCKETS buckets"""
+    if end < start:
+        raise ValueError('the end date is before the start date')
+    starts = []
+    current = bucket_start(start, bucket)
+    while current <= end:
+        starts.append(current)
+        if len(starts) > MAX_BUCKETS:
+            raise ValueError(f'more than {MAX_BUCKETS} {bucket}s, pick a shorter range or a longer bucket')
+        current = _next_bucket(current, bucket)
+    return starts
+
+
+def intake(start, end, bucket='day', group_by='blood_type', location=None, blood_type=None, kind=None,
+           session=None):
+    """Donated and withdrawn units per bucket from the rollups, shaped for a
+    chart: one list of bucket labels and a series per group with a value for
+    every bucket, zero where nothing happened. This reads at most one row
+    per day, branch, blood type and kind, however many donations there were
+    Args:
+        start (date): The first day, inclusive
+        end (date): The last day, inclusive
+        bucket (str): "day", "week" or "month"
+        group_by (str): One series per "blood_type", "location" or "kind"
+        location (str): Only this branch
+        blood_type (str): Only this blood type
+        kind (str): Only "blood" or "plasma"
+        session (obj): The session to read with, db.session by default
+    Returns:
+        dict: {"bucket", "start", "end", "labels", "series": [{"name", "donated", "withdrawn"}],
+        "totals": {"donated", "withdrawn"}}"""
+    starts = bucket_starts(start, end, bucket)
+    index = {day: i for i, day in enumerate(starts)}
+    group = getattr(DonationRollup, group_by)
+    # Summed here rather than with GROUP BY, which SQLite would sort for
+    query = (session or db.session).query(DonationRollup.day, group, DonationRollup.donated,
+                                          DonationRollup.withdrawn) \
+        .filter(DonationRollup.day >= start, DonationRollup.day <= end)
+    for column, value in ((DonationRollup.location, location), (DonationRollup.blood_type, blood_type),
+                          (DonationRollup.kind, kind)):
+        if value is not None:
+            query = query.filter(column == value)
+    series = {}
+    for day, name, donated, withdrawn in query:
+        values = series.setdefault(name, ([0] * len(starts), [0] * len(starts)))
+        i = index[bucket_start(day, bucket)]
+        values[0][i] += donated
+        values[1][i] += withdrawn
+    return {
+        "bucket": bucket,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "labels": [day.isoformat() for day in starts],
+        "series": [{"name": name or 'Unassigned', "donated": values[0], "withdrawn": values[1]}
+                   for name, values in sorted(series.items())],
+        "totals": {"donated": sum(sum(values[0]) for values in series.values()),
+                   "withdrawn": sum(sum(values[1]) for values in series.values())},
+    }
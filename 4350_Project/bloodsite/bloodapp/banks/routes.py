@@ -0,0 +1,55 @@
+from flask import render_template, url_for, flash, redirect, request, json, Blueprint
+from markupsafe import Markup
+from flask_login import login_required
+from sqlalchemy.orm import joinedload
+from bloodapp.forms import BankForm
+from bloodapp.models import Bank
+from bloodapp import db, rebalance
+from bloodapp.choices import invalidate_bank_choices
+from bloodapp.cache import page_cache
+from bloodapp.reporting import reporting
+
+banks = Blueprint('banks', __name__)
+
+
+def _bank_table(page_num):
+    """Renders one page of the bank listing"""
+    banks = db.reporting_session.query(Bank).options(joinedload(Bank.manager)).paginate(per_page=5, page=page_num)
+    table = {}
+    for bank in banks.items:
+        manager = bank.manager
+        table.update({bank.location: {
+            "id": bank.id,
+            "location": bank.location,
+            "manager": f"{manager.first_name.capitalize()} {manager.last_name.capitalize()}"
+        }})
+    return render_template('bank_table.html', table=table, banks=banks)
+
+
+@banks.route('/CreateBank', methods=["GET", "POST"])
+@login_required
+def CreateBank():
+    """This page displays and creates new bank locations"""
+    page_num = request.args.get('page', 1, type=int)
+    form = BankForm()
+    if form.validate_on_submit():
+        new_bank = Bank(location=form.location.data, manager_id=form.manager_id.data)
+        db.session.add(new_bank)
+        db.session.commit()
+        invalidate_bank_choices()
+        flash(f'New Bank Created')
+        return redirect(url_for('banks.CreateBank'))
+    # Manager names come from the staff table, so a rename shows up too
+    table = page_cache.fragment('bank_table', ('bank', 'staff'), lambda: _bank_table(page_num),
+                                variant=f'{page_num}:{reporting.source()}')
+    return render_template('bank.html', title="Bank Page", form=form, bank_table=Markup(table))
+
+
+@banks.route('/rebalance')
+@login_required
+def RebalancePlan():
+    """The transfers between branches that would bring each one up to its
+    stock targets, as JSON"""
+    return page_cache.conditional('rebalance', ('inventory', 'bank_target'),
+                                  lambda: json.dumps(rebalance.plan_transfers(db.reporting_session)),
+                                  variant=reporting.source(), mimetype='application/json')
@@ -0,0 +1,139 @@
+import csv
+import json
+from itertools import islice
+from werkzeug.datastructures import MultiDict
+from bloodapp import db, outbox
+from bloodapp.forms import ImportDonorForm
+from bloodapp.models import Donor
+from bloodapp.donors.utils import donor_email
+
+IMPORT_FIELDS = ['first_name', 'last_name', 'email', 'age', 'blood_type']
+EXPORT_FIELDS = ['id', 'first_name', 'last_name', 'email', 'age', 'blood_type', 'location',
+                 'last_blood_donation_date', 'last_plasma_donation_date',
+                 'next_blood_eligible', 'next_plasma_eligible']
+
+
+def read_rows(stream, fmt):
+    """Reads donor rows one at a time from a CSV file with a header or a JSONL file
+    Args:
+        stream (file): The open file
+        fmt (str): "csv" or "jsonl"
+    Yields:
+        dict: One donor row"""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _validate(chunk, on_error):
+    """Runs each row through ImportDonorForm, the same rules as CreateDonorForm
+    Returns:
+        list: The cleaned rows, ready to insert"""
+    valid = []
+    for line, row in chunk:
+        formdata = MultiDict({field: str(row.get(field) or '') for field in IMPORT_FIELDS})
+        form = ImportDonorForm(formdata=formdata)
+        if not form.validate():
+            on_error(line, '; '.join(f'{field}: {", ".join(errors)}' for field, errors in form.errors.items()))
+            continue
+        valid.append({"first_name": form.first_name.data.lower(), "last_name": form.last_name.data.lower(),
+                      "email": form.email.data.lower(), "age": form.age.data, "blood_type": form.blood_type.data})
+    return valid
+
+
+def import_donors(rows, chunk_size=1000, send_emails=True, on_error=None):
+    """Adds donors in chunks. Each chunk is validated, checked for existing emails
+    with one IN query, inserted with one executemany and committed, so memory
+    stays the same however long the file is
+    Args:
+        rows (iterable): Donor rows, as from read_rows
+        chunk_size (int): How many rows are handled per transaction
+        send_emails (bool): Queue the new donor email for every donor added
+        on_error (function): Called with (line number, message) for every rejected row
+    Returns:
+        dict: The number of rows inserted, skipped as duplicates and rejected"""
+    stats = {"inserted": 0, "duplicates": 0, "invalid": 0}
+
+    def reject(line, message):
+        stats["invalid"] += 1
+        if on_error:
+            on_error(line, message)
+
+    for chunk in _chunks(enumerate(rows, start=1), chunk_size):
+        valid = _validate(chunk, reject)
+        emails = {row["email"] for row in valid}
+        taken = {email for (email,) in db.session.query(Donor.email).filter(Donor.email.in_(emails))} if emails else set()
+        new_rows = []
+        for row in valid:
+            if row["email"] in taken:
+                stats["duplicates"] += 1
+                continue
+            taken.add(row["email"])
+            new_rows.append(row)
+        if new_rows:
+            db.session.execute(Donor.__table__.insert(), new_rows)
+            if send_emails:
+                added = db.session.query(Donor.id, Donor.email, Donor.first_name) \
+                    .filter(Donor.email.in_([row["email"] for row in new_rows]))
+                outbox.enqueue_many(donor_email(donor) for donor in added)
+        db.session.commit()
+        stats["inserted"] += len(new_rows)
+    return stats
+
+
+def write_donors(stream, fmt, chunks, fields=EXPORT_FIELDS):
+    """Writes donor rows to a CSV or JSONL file as they are read
+    Args:
+        stream (file): The open file
+        fmt (str): "csv" or "jsonl"
+        chunks (iterable): Lists of rows with the fields in order
+        fields (list): The column names
+    Returns:
+        int: The number of donors written"""
+    writer = csv.writer(stream) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(fields)
+    written = 0
+    for chunk in chunks:
+        for row in chunk:
+            if writer:
+                writer.writerow(['' if value is None else value for value in row])
+            else:
+                stream.write(json.dumps(dict(zip(fields, row)), default=str) + '\n')
+        written += len(chunk)
+    return written
+
+
+def _donors_by_id(chunk_size):
+    columns = [getattr(Donor, field) for field in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        chunk = db.session.query(*columns).filter(Donor.id > last_id).order_by(Donor.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def export_donors(stream, fmt, chunk_size=1000):
+    """Writes every donor to a CSV or JSONL file, reading them in id order one chunk at a time
+    Args:
+        stream (file): The open file
+        fmt (str): "csv" or "jsonl"
+        chunk_size (int): How many donors are read per query
+    Returns:
+        int: The number of donors written"""
+    return write_donors(stream, fmt, _donors_by_id(chunk_size))
@@ -0,0 +1,249 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app, has_app_context, make_response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Tables written by a transaction that is committing on this thread
+_committing = threading.local()
+
+
+class LRUBackend:
+    """Keeps rendered fragments in this process, dropping the least recently
+    used once there are more than size of them
+    Args:
+        size (int): The most fragments to keep"""
+
+    def __init__(self, size):
+        self.size = size
+        # In every key, like the Redis backend, where the versions can be
+        # lost while old copies are still there
+        self.epoch = uuid.uuid4().hex
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def versions(self, tables):
+        with self._lock:
+            return [self._versions.get(table, 0) for table in tables]
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Keeps fragments in Redis, or anything that speaks its protocol, so every
+    worker process shares them and a write in one invalidates them for all
+    Args:
+        url (str): Like redis://localhost:6379/0
+        prefix (str): Put in front of every key"""
+
+    def __init__(self, url, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND is "redis" but the redis package is not installed, '
+                               'run "pip install redis" or use the "lru" backend')
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        # Shared by every worker, and new if Redis loses the versions
+        self._client.set(f'{prefix}epoch', uuid.uuid4().hex, nx=True)
+        self.epoch = self._client.get(f'{prefix}epoch').decode('utf-8')
+
+    def get(self, key):
+        value = self._client.get(self._prefix + key)
+        return None if value is None else value.decode('utf-8')
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, value.encode('utf-8'), ex=ttl)
+
+    def versions(self, tables):
+        if not tables:
+            return []
+        values = self._client.mget([f'{self._prefix}version:{table}' for table in tables])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tables):
+        pipe = self._client.pipeline()
+        for table in tables:
+            pipe.incr(f'{self._prefix}version:{table}')
+        pipe.execute()
+
+    def __len__(self):
+        return 0
+
+
+class NullBackend:
+    """Caches nothing, for debugging a page without the cache"""
+    epoch = 'none'
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def versions(self, tables):
+        return [0 for table in tables]
+
+    def bump(self, tables):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class PageCache:
+    """Caches rendered pieces of pages that are read far more often than they
+    change. Each fragment names the tables it was built from, and its key
+    includes a version number for each of them. Any INSERT, UPDATE or DELETE
+    on one of those tables through the session, whether from the ORM or a
+    bulk statement, bumps the version once it has committed, so the next read
+    builds a fresh copy and the stale one simply ages out. Writes the
+    versions never see, like a flask command run from the shell, show up once
+    the copy is CACHE_TTL old. Whole pages send a hash of what they hold as
+    their ETag, so a browser revalidating an unchanged page gets a 304"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._listening = False
+
+    def init_app(self, app):
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'redis':
+            app.extensions['page_cache'] = RedisBackend(app.config['CACHE_REDIS_URL'], app.config['CACHE_KEY_PREFIX'])
+        elif backend == 'lru':
+            app.extensions['page_cache'] = LRUBackend(app.config['CACHE_SIZE'])
+        else:
+            app.extensions['page_cache'] = NullBackend()
+        if not self._listening:
+            event.listen(Engine, 'after_execute', _after_execute)
+            event.listen(Engine, 'commit', _commit)
+            event.listen(Engine, 'rollback', _rollback)
+            event.listen(Session, 'after_commit', _after_commit)
+            self._listening = True
+
+    @property
+    def backend(self):
+        return current_app.extensions['page_cache']
+
+    def _key(self, name, tables, variant):
+        backend = self.backend
+        versions = '.'.join(str(version) for version in backend.versions(tables))
+        return f'{name}:{variant}:{backend.epoch}:{versions}'
+
+    def fragment(self, name, tables, build, variant=''):
+        """Returns a cached fragment, building and storing it if there is no
+        fresh copy
+        Args:
+            name (str): What the fragment is, like "bank_table"
+            tables (tuple): The tables it is built from
+            build (function): Makes the fragment as a string
+            variant (str): Tells apart copies of the same fragment, like the page number
+        Returns:
+            str: The fragment"""
+        key = self._key(name, tables, variant)
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = build()
+            self.backend.set(key, value, current_app.config['CACHE_TTL'])
+        return value
+
+    def conditional(self, name, tables, build, variant='', mimetype='text/html'):
+        """Serves a whole cached page with an ETag. When the browser already
+        has this version it gets an empty 304. The ETag is a hash of the page
+        itself rather than of the table versions, which only writes through
+        this site's sessions bump, so it changes as soon as the cached copy
+        does, even after a change from the shell or another server
+        Args:
+            name, tables, build, variant: As for fragment()
+            mimetype (str): The content type of the page
+        Returns:
+            obj: The response"""
+        page = self.fragment(name, tables, build, variant)
+        etag = hashlib.sha1(page.encode('utf-8')).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(page)
+            response.mimetype = mimetype
+        response.set_etag(etag)
+        # The browser may keep it but must ask whether it changed before using it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def invalidate(self, *tables):
+        """Makes every fragment built from these tables stale"""
+        self.backend.bump(tables)
+
+    def stats(self):
+        """Returns:
+            dict: hits, misses and the number of cached fragments in this process"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
+
+
+def _after_execute(conn, clauseelement, multiparams, params, result):
+    """Notes which tables this transaction wrote to"""
+    if isinstance(clauseelement, UpdateBase):
+        name = getattr(clauseelement.table, 'name', None)
+        if name:
+            conn.info.setdefault('cache_tables', set()).add(name)
+
+
+def _commit(conn):
+    """The connection is about to commit, the versions are bumped once it has"""
+    tables = conn.info.pop('cache_tables', None)
+    if tables:
+        _committing.tables = getattr(_committing, 'tables', set()) | tables
+
+
+def _rollback(conn):
+    conn.info.pop('cache_tables', None)
+
+
+def _after_commit(session):
+    """Bumping before the commit could let another request cache the old
+    rows under the new version"""
+    tables = getattr(_committing, 'tables', None)
+    _committing.tables = set()
+    if tables and has_app_context() and 'page_cache' in current_app.extensions:
+        page_cache.invalidate(*sorted(tables))
+
+
+page_cache = PageCache()
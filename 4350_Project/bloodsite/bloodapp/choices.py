@@ -0,0 +1,34 @@
+import threading
+import time
+from flask import current_app
+from bloodapp import db
+from bloodapp.models import Bank
+
+_lock = threading.Lock()
+_bank_names = None
+_loaded_at = 0.0
+
+
+def bank_choices():
+    """The bank locations for the branch SelectFields.
+    The list is read on first use and shared by every request in the process
+    until BANK_CHOICES_TTL seconds pass or a bank is created
+    Returns:
+        list: The bank locations, oldest bank first"""
+    global _bank_names, _loaded_at
+    ttl = current_app.config.get('BANK_CHOICES_TTL', 300)
+    with _lock:
+        if _bank_names is not None and time.monotonic() - _loaded_at < ttl:
+            return list(_bank_names)
+    names = [location for (location,) in db.session.query(Bank.location).order_by(Bank.id)]
+    with _lock:
+        _bank_names = names
+        _loaded_at = time.monotonic()
+    return list(names)
+
+
+def invalidate_bank_choices():
+    """Drops the cached bank locations so the next form reads them again"""
+    global _bank_names
+    with _lock:
+        _bank_names = None
@@ -0,0 +1,255 @@
+import datetime
+import json
+import sys
+import click
+from flask.cli import AppGroup
+from bloodapp import db, analytics, bulk_donors, dbcopy, eligibility, expiry, intake, inventory, ledger, \
+    migrations, outbox, queryplans, rebalance, search
+from bloodapp.compatibility import BLOOD_TYPES
+from bloodapp.models import Bank, Donor
+from bloodapp.reporting import reporting
+
+db_cli = AppGroup('db', help='Manage the database schema.')
+inventory_cli = AppGroup('inventory', help='Maintain the per-location inventory counts.')
+outbox_cli = AppGroup('outbox', help='Send the queued emails.')
+donors_cli = AppGroup('donors', help='Import and export donors in bulk.')
+analytics_cli = AppGroup('analytics', help='Maintain the daily donation rollups.')
+banks_cli = AppGroup('banks', help='Set stock targets and plan transfers between branches.')
+ledger_cli = AppGroup('ledger', help='Snapshot and query the stock history.')
+
+
+@db_cli.command('upgrade')
+def upgrade_db():
+    """Creates any missing tables and indexes and makes any new schema steps, on SQLite or PostgreSQL"""
+    created = migrations.upgrade()
+    for name in created:
+        click.echo(f'Created {name}')
+    click.echo('Database is up to date')
+
+
+@db_cli.command('check-plans')
+def check_plans():
+    """Fails if a hot query would scan a table instead of using an index"""
+    failed = queryplans.regressions()
+    for name, plan in failed:
+        click.echo(f'{name}: ' + ' / '.join(plan))
+    if failed:
+        raise click.ClickException(f'{len(failed)} queries no longer use an index, run "flask db upgrade"')
+    click.echo('All hot queries use an index')
+
+
+@db_cli.command('copy-from')
+@click.argument('source_url')
+@click.option('--chunk-size', default=dbcopy.CHUNK_SIZE, show_default=True, help='Rows read and written at a time.')
+def copy_db(source_url, chunk_size):
+    """Copies every row of another database, like sqlite:///site.db, into this one (DATABASE_URL).
+    Run "flask db upgrade" against both first, this one must have no rows yet"""
+    try:
+        copied = dbcopy.copy_database(source_url, chunk_size=chunk_size,
+                                      on_table=lambda name, rows: click.echo(f'{name}: {rows} rows'))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Copied {sum(copied.values())} rows')
+
+
+@db_cli.command('snapshot')
+def snapshot_db():
+    """Copies the database for reports now, run it from cron so reports seldom fall back to the main database"""
+    if not reporting.refresh():
+        raise click.ClickException('Reports are not read from a snapshot, set REPORTING_MAX_STALENESS '
+                                   'and use a SQLite database')
+    click.echo('Reporting snapshot taken')
+
+
+@inventory_cli.command('rebuild')
+def rebuild_inventory():
+    """Recounts the inventory table from the Donation table"""
+    rows = inventory.rebuild()
+    click.echo(f'Inventory rebuilt, {rows} rows')
+
+
+@inventory_cli.command('verify')
+def verify_inventory():
+    """Checks the inventory table against the Donation table"""
+    mismatches = inventory.verify()
+    for key, counted, actual in mismatches:
+        location, blood_type, blood, plasma = key
+        kind = "Blood" if blood else "Plasma"
+        click.echo(f'{location} {kind} {blood_type}: inventory has {counted}, donations have {actual}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} rows out of date, run "flask inventory rebuild"')
+    click.echo('Inventory matches donations')
+
+
+@inventory_cli.command('sweep')
+@click.option('--batch-size', default=1000, show_default=True, help='Units marked per transaction.')
+def sweep_inventory(batch_size):
+    """Takes units past their expiry off the shelf, run it from cron"""
+    swept = expiry.sweep(batch_size=batch_size)
+    click.echo(f'{swept} expired units removed from the inventory')
+
+
+@outbox_cli.command('work')
+@click.option('--once', is_flag=True, help='Exit when nothing is due instead of waiting for more.')
+def work_outbox(once):
+    """Sends queued emails in batches until stopped"""
+    outbox.work(once=once)
+
+
+@outbox_cli.command('status')
+def outbox_status():
+    """Shows how many emails are waiting and how many were given up on"""
+    click.echo(f'{outbox.queue_depth()} waiting, {outbox.failed_count()} failed')
+
+
+def _file_format(path, fmt):
+    """Uses the --format option, or guesses it from the file extension"""
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+@donors_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows validated and inserted per transaction.')
+@click.option('--no-email', is_flag=True, help='Do not queue the new donor emails.')
+def import_donors(path, fmt, chunk_size, no_email):
+    """Adds the donors in a CSV or JSONL file, skipping emails already registered"""
+    def report(line, message):
+        click.echo(f'Row {line}: {message}', err=True)
+
+    with open(path, newline='') as stream:
+        rows = bulk_donors.read_rows(stream, _file_format(path, fmt))
+        stats = bulk_donors.import_donors(rows, chunk_size=chunk_size, send_emails=not no_email, on_error=report)
+    click.echo(f'{stats["inserted"]} donors added, {stats["duplicates"]} already registered, {stats["invalid"]} rejected')
+
+
+@donors_cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Donors read per query.')
+def export_donors(path, fmt, chunk_size):
+    """Writes every donor to a CSV or JSONL file"""
+    with open(path, 'w', newline='') as stream:
+        written = bulk_donors.export_donors(stream, _file_format(path, fmt), chunk_size=chunk_size)
+    click.echo(f'{written} donors exported')
+
+
+@donors_cli.command('eligible')
+@click.argument('blood_type', type=click.Choice(BLOOD_TYPES))
+@click.option('--kind', type=click.Choice(eligibility.KINDS), default='blood', show_default=True)
+@click.option('--location', help='Only donors from this branch.')
+@click.option('--output', 'path', type=click.Path(dir_okay=False, writable=True), help='Defaults to the terminal.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Donors read at a time.')
+def export_eligible(blood_type, kind, location, path, fmt, chunk_size):
+    """Lists the donors of a blood type who can donate today, for recall campaigns"""
+    columns = [getattr(Donor, field) for field in bulk_donors.EXPORT_FIELDS]
+    chunks = eligibility.stream(blood_type, kind, location, batch_size=chunk_size, columns=columns)
+    if path:
+        with open(path, 'w', newline='') as stream:
+            written = bulk_donors.write_donors(stream, _file_format(path, fmt), chunks)
+    else:
+        written = bulk_donors.write_donors(sys.stdout, fmt or 'csv', chunks)
+    click.echo(f'{written} eligible donors', err=True)
+
+
+@donors_cli.command('reindex')
+def reindex_donors():
+    """Creates the donor search index if it is missing and refills it"""
+    if not search.install():
+        search.rebuild()
+    click.echo('Donor search index rebuilt')
+
+
+@donors_cli.command('prune-intake')
+@click.option('--days', default=90, show_default=True, help='Keep the keys of batches newer than this.')
+def prune_intake(days):
+    """Forgets old batch intake keys, after which resending those donations adds them again"""
+    removed = intake.prune(datetime.datetime.utcnow() - datetime.timedelta(days=days))
+    click.echo(f'{removed} intake keys removed')
+
+
+@analytics_cli.command('backfill')
+@click.option('--force', is_flag=True, help='Replace the rollups that are there, losing the intake of shipped units.')
+def backfill_analytics(force):
+    """Fills the daily rollups from the Donation and Shipment tables"""
+    rows = analytics.backfill(force=force)
+    if rows is None:
+        raise click.ClickException('The rollups are already filled, pass --force to rebuild them from history')
+    click.echo(f'{rows} rollup rows written')
+
+
+@banks_cli.command('set-target')
+@click.argument('location')
+@click.argument('blood_type', type=click.Choice(BLOOD_TYPES))
+@click.argument('units', type=click.IntRange(min=0), required=False)
+@click.option('--kind', type=click.Choice(eligibility.KINDS), default='blood', show_default=True)
+def set_bank_target(location, blood_type, units, kind):
+    """Sets how many units of a type a branch wants on hand, or clears it when UNITS is left out"""
+    if Bank.query.filter_by(location=location).first() is None:
+        raise click.ClickException(f'There is no bank at {location}')
+    rebalance.set_target(location, blood_type, kind == 'blood', kind == 'plasma', units)
+    db.session.commit()
+    click.echo(f'{location} {kind} {blood_type}: ' + ('no target' if units is None else f'target {units} units'))
+
+
+@banks_cli.command('plan')
+@click.option('--json', 'as_json', is_flag=True, help='Print the plan as JSON.')
+def plan_transfers(as_json):
+    """Lists the transfers that bring every branch up to its targets"""
+    result = rebalance.plan_transfers()
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    for transfer in result["transfers"]:
+        click.echo(f'{transfer["units"]} {transfer["kind"]} {transfer["blood_type"]}: '
+                   f'{transfer["from"]} -> {transfer["to"]}')
+    for short in result["unmet"]:
+        click.echo(f'{short["location"]} is still {short["units"]} {short["kind"]} {short["blood_type"]} short',
+                   err=True)
+    click.echo(f'{len(result["transfers"])} transfers', err=True)
+
+
+@ledger_cli.command('snapshot')
+def snapshot_ledger():
+    """Saves the current stock so later lookups start from here, run it from cron"""
+    row = ledger.snapshot()
+    click.echo(f'Snapshot taken at ledger event {row.last_event_id}')
+
+
+@ledger_cli.command('stock')
+@click.option('--at', 'when', help='YYYY-MM-DDTHH:MM:SS, or YYYY-MM-DD for the end of that day. Defaults to now.')
+@click.option('--location', help='Only this branch.')
+def ledger_stock(when, location):
+    """Shows the stock at every branch, or one, at a point in time"""
+    try:
+        counts = ledger.stock_at(ledger.parse_when(when) if when else None, location)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for (branch, blood_type, blood), units in sorted(counts.items()):
+        click.echo(f'{branch} {"Blood" if blood else "Plasma"} {blood_type}: {units}')
+
+
+@ledger_cli.command('verify')
+def verify_ledger():
+    """Checks that the ledger adds up to the inventory table"""
+    mismatches = ledger.verify()
+    for (location, blood_type, blood), counted, replayed in mismatches:
+        click.echo(f'{location} {"Blood" if blood else "Plasma"} {blood_type}: '
+                   f'inventory has {counted}, the ledger has {replayed}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} rows disagree')
+    click.echo('Ledger matches the inventory')
+
+
+def register_commands(app):
+    """Adds the command groups to the flask command line"""
+    app.cli.add_command(db_cli)
+    app.cli.add_command(inventory_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(donors_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(banks_cli)
+    app.cli.add_command(ledger_cli)
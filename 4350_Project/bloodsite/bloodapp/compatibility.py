@@ -0,0 +1,68 @@
+BLOOD_TYPES = ['O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+']
+# How common each type is in the US, to break ties between substitutes
+FREQUENCY = {'O+': 37.4, 'A+': 35.7, 'B+': 8.5, 'O-': 6.6, 'A-': 6.3, 'AB+': 3.4, 'B-': 1.5, 'AB-': 0.6}
+
+
+def _antigens(blood_type):
+    """The ABO antigens and whether it is Rh positive, so "AB+" is ({"A", "B"}, True)"""
+    abo = blood_type.rstrip('+-')
+    return set() if abo == 'O' else set(abo), blood_type.endswith('+')
+
+
+def red_cells_compatible(donor, recipient):
+    """Red cells can go to anyone whose blood already has all their antigens"""
+    donor_abo, donor_rh = _antigens(donor)
+    recipient_abo, recipient_rh = _antigens(recipient)
+    return donor_abo <= recipient_abo and (recipient_rh or not donor_rh)
+
+
+def plasma_compatible(donor, recipient):
+    """Plasma carries the antibodies instead, so it can go to anyone without
+    an antigen the donor lacks. Rh does not matter for plasma"""
+    return _antigens(recipient)[0] <= _antigens(donor)[0]
+
+
+def _substitutes(compatible):
+    """For every recipient type, the donor types it can take, its own type
+    first and then the ones fewest other recipients can use, so the
+    universal types (O- red cells, AB plasma) are used last
+    Returns:
+        dict: {recipient type: [donor types]}"""
+    serves = {donor: sum(compatible(donor, recipient) for recipient in BLOOD_TYPES) for donor in BLOOD_TYPES}
+    table = {}
+    for recipient in BLOOD_TYPES:
+        donors = [donor for donor in BLOOD_TYPES if donor != recipient and compatible(donor, recipient)]
+        donors.sort(key=lambda donor: (serves[donor], -FREQUENCY[donor]))
+        table[recipient] = [recipient] + donors
+    return table
+
+
+# Worked out once when the module loads, each withdrawal only looks them up
+RED_CELL_DONORS = _substitutes(red_cells_compatible)
+PLASMA_DONORS = _substitutes(plasma_compatible)
+
+
+def donor_types(blood_type, blood):
+    """Returns:
+        list: The types that can fill a request for blood_type, in the order to use them"""
+    return (RED_CELL_DONORS if blood else PLASMA_DONORS)[blood_type]
+
+
+def allocate(blood_type, blood, units, stock):
+    """Splits a request across the requested type and its substitutes
+    Args:
+        blood_type (str): The type requested
+        blood (bool): True for blood, False for plasma
+        units (int): The number of units requested
+        stock (dict): {blood type: units on hand}
+    Returns:
+        list: (blood type, units) to ship, in the order they were chosen"""
+    chosen = []
+    for donor in donor_types(blood_type, blood):
+        if units <= 0:
+            break
+        take = min(units, stock.get(donor, 0))
+        if take > 0:
+            chosen.append((donor, take))
+            units -= take
+    return chosen
@@ -0,0 +1,100 @@
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_rate(name, default):
+    """Reads a rate like 5/300, five attempts every 300 seconds"""
+    attempts, seconds = os.environ.get(name, default).split('/')
+    return int(attempts), int(seconds)
+
+
+class Config:
+    """The site settings. Anything that differs between a laptop and the
+    production server can be overridden with an environment variable"""
+    SECRET_KEY = os.environ.get('SECRET_KEY', '5791628bb0b13ce0c676dfde280ba245')
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connections are kept open and shared between threads so the pragmas
+    # below only run once per connection instead of once per request
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    }
+
+    # Reports and the busy listings read a replica so they do not hold up
+    # donation intake. REPORTING_DATABASE_URL names one kept up to date
+    # elsewhere, otherwise the SQLite file is copied to REPORTING_SNAPSHOT_PATH
+    # (site-snapshot.db by default) whenever the copy is older than
+    # REPORTING_MAX_STALENESS seconds. 0 keeps every read on the main database
+    REPORTING_DATABASE_URI = os.environ.get('REPORTING_DATABASE_URL')
+    REPORTING_SNAPSHOT_PATH = os.environ.get('REPORTING_SNAPSHOT_PATH')
+    REPORTING_MAX_STALENESS = _env_int('REPORTING_MAX_STALENESS', 0)
+
+    BANK_CHOICES_TTL = 300
+    # Rendered page fragments: "lru" keeps them in each worker process, "redis"
+    # shares them between workers through CACHE_REDIS_URL (needs the redis
+    # package, any Redis compatible server works), "none" turns caching off.
+    # Writes invalidate the lru cache only in the process that made them, the
+    # others catch up within CACHE_TTL seconds
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_KEY_PREFIX = 'bloodsite:'
+    CACHE_TTL = _env_int('CACHE_TTL', 30)
+    CACHE_SIZE = 512
+    STAFF_CACHE_TTL = 60
+    STAFF_CACHE_SIZE = 1024
+    BCRYPT_LOG_ROUNDS = _env_int('BCRYPT_LOG_ROUNDS', 12)
+
+    # Login and password reset attempts, as attempts/seconds per IP address
+    # and per email. A failed login spends from the email's bucket, every
+    # login from the address's, and every reset request from both. "memory"
+    # keeps the buckets in each worker process, "redis" shares them between
+    # workers through RATELIMIT_REDIS_URL, "none" turns the limits off.
+    # Behind a reverse proxy set PROXY_COUNT to the number of proxies, so the
+    # address is read from X-Forwarded-For rather than being the proxy's
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_REDIS_URL = os.environ.get('RATELIMIT_REDIS_URL', CACHE_REDIS_URL)
+    RATELIMIT_SIZE = 10000
+    RATELIMIT_LOGIN_PER_IP = _env_rate('RATELIMIT_LOGIN_PER_IP', '20/60')
+    RATELIMIT_LOGIN_PER_EMAIL = _env_rate('RATELIMIT_LOGIN_PER_EMAIL', '5/300')
+    RATELIMIT_RESET_PER_IP = _env_rate('RATELIMIT_RESET_PER_IP', '5/600')
+    RATELIMIT_RESET_PER_EMAIL = _env_rate('RATELIMIT_RESET_PER_EMAIL', '3/3600')
+    PROXY_COUNT = _env_int('PROXY_COUNT', 0)
+
+    MAIL_SERVER = 'smtp.googlemail.com'
+    MAIL_PORT = 587
+    MAIL_USE_TLS = True
+    MAIL_USERNAME = os.environ.get('EMAIL_USER')
+    MAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_MAX_ATTEMPTS = 6
+    OUTBOX_RETRY_SECONDS = 30
+    OUTBOX_POLL_SECONDS = 5
+
+    # Requests slower than this are logged with their slowest SQL statement.
+    # /metrics is open to logged in Admins, or to a scraper sending
+    # "Authorization: Bearer <METRICS_TOKEN>" when the token is set
+    METRICS_SLOW_REQUEST_MS = _env_int('METRICS_SLOW_REQUEST_MS', 500)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+class TestingConfig(Config):
+    """A private in-memory database per app, so every test process or
+    pytest-xdist worker gets its own isolated site in milliseconds"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    RATELIMIT_BACKEND = 'none'
+    MAIL_SUPPRESS_SEND = True
@@ -0,0 +1,87 @@
+from flask import _app_ctx_stack
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import and_, event, orm
+from sqlalchemy.pool import QueuePool
+from bloodapp.reporting import reporting
+
+
+class ReportingSession(SignallingSession):
+    """A read only session for reports, which reads the replica when there is
+    one fresh enough for this user and the main database otherwise"""
+
+    def get_bind(self, mapper=None, clause=None):
+        engine = reporting.engine()
+        return engine if engine is not None else super().get_bind(mapper, clause)
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            raise RuntimeError('db.reporting_session is read only, write through db.session')
+        super().flush(objects)
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with the settings a busy SQLite file needs.
+    File databases get a real connection pool instead of a new connection per
+    request, and every new connection runs the SQLITE_PRAGMAS from the config
+    (WAL journaling, synchronous=NORMAL, a busy timeout and mmap) so concurrent
+    writers wait their turn instead of failing with "database is locked".
+    db.reporting_session is a second session for reports, see reporting.py"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reporting_session = orm.scoped_session(
+            orm.sessionmaker(class_=ReportingSession, db=self, query_cls=self.Query),
+            scopefunc=_app_ctx_stack.__ident_func__)
+
+    def init_app(self, app):
+        super().init_app(app)
+
+        @app.teardown_appcontext
+        def shutdown_reporting_session(response_or_exc):
+            self.reporting_session.remove()
+            return response_or_exc
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername.startswith('sqlite'):
+            options['sqlite_pragmas'] = app.config.get('SQLITE_PRAGMAS', {})
+            in_memory = sa_url.database in (None, '', ':memory:')
+            if not in_memory and app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('pool_size'):
+                options['poolclass'] = QueuePool
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas:
+            @event.listens_for(engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas.items():
+                    cursor.execute(f'PRAGMA {name}={value}')
+                cursor.close()
+        return engine
+
+
+def increment(session, table, key, amounts):
+    """Adds to the counters of the row with key, creating the row if there is
+    none. PostgreSQL does it with one INSERT ... ON CONFLICT, which stays
+    right when two transactions create the row at once. Elsewhere it tries
+    an UPDATE and only inserts when that found nothing, which is safe on
+    SQLite because writers take turns
+    Args:
+        session (obj): The session to write with, the caller commits
+        table (obj): The table, with a unique constraint on the key columns
+        key (dict): The key columns and their values
+        amounts (dict): The counter columns and how much to add to them"""
+    if session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(**key, **amounts)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=list(key), set_={name: table.c[name] + statement.excluded[name] for name in amounts}))
+        return
+    condition = and_(*(table.c[name] == value for name, value in key.items()))
+    result = session.execute(table.update().where(condition).values(
+        {name: table.c[name] + value for name, value in amounts.items()}))
+    if result.rowcount == 0:
+        session.execute(table.insert().values(**key, **amounts))
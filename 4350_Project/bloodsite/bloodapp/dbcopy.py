@@ -0,0 +1,124 @@
+import os
+from flask import current_app
+from sqlalchemy import String, create_engine, func, select, text
+from sqlalchemy.engine.url import make_url
+from bloodapp import db, migrations
+from bloodapp.models import SchemaVersion
+
+CHUNK_SIZE = 1000
+
+
+def _tables():
+    """Every table to copy, parents before the tables that point at them"""
+    return [table for table in db.metadata.sorted_tables if table.name != SchemaVersion.__tablename__]
+
+
+def problems(source):
+    """Finds rows the database being copied into would refuse. SQLite does
+    not check string lengths or foreign keys, so a database that has only
+    ever run on it can have values too long for their column and rows that
+    point at rows since deleted
+    Args:
+        source (obj): The engine of the database being copied
+    Returns:
+        list: What is wrong, empty when the copy can go ahead"""
+    found = []
+    for table in _tables():
+        strings = [column for column in table.columns if isinstance(column.type, String) and column.type.length]
+        if strings:
+            longest = source.execute(select([func.max(func.length(column)) for column in strings])).first()
+            for column, length in zip(strings, longest):
+                if length and length > column.type.length:
+                    found.append(f'{table.name}.{column.name} has values of {length} characters, '
+                                 f'it holds {column.type.length}')
+        for key in table.foreign_keys:
+            parent = key.column
+            missing = source.execute(
+                select([func.count()]).select_from(table.outerjoin(parent.table, key.parent == parent))
+                .where(key.parent != None).where(parent == None)).scalar()
+            if missing:
+                found.append(f'{missing} {table.name} rows have a {key.parent.name} that is not in {parent.table.name}')
+    return found
+
+
+def _source(source_url):
+    """Returns:
+        obj: An engine for the database to copy, with a relative SQLite path
+        read from the app folder the way Flask-SQLAlchemy reads it
+    Raises:
+        ValueError: If it is a SQLite file that is not there"""
+    url = make_url(source_url)
+    if url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:'):
+        url.database = os.path.join(current_app.root_path, url.database)
+        if not os.path.exists(url.database):
+            raise ValueError(f'there is no database at {url.database}')
+    return create_engine(url)
+
+
+def _reader(connection):
+    """Starts one read transaction, so every table is copied as it was at the
+    same moment even if the site is still running
+    Returns:
+        obj: The connection to read with"""
+    if connection.dialect.name == 'sqlite':
+        # pysqlite only opens a transaction before a write, so ask for one
+        connection.execute('BEGIN')
+        return connection
+    connection = connection.execution_options(isolation_level='REPEATABLE READ')
+    connection.begin()
+    return connection
+
+
+def copy_database(source_url, chunk_size=CHUNK_SIZE, on_table=None):
+    """Copies every row of another database into this one, like site.db into
+    PostgreSQL. Each table is read in primary key order chunk_size rows at a
+    time and written with one executemany per chunk, so memory stays the
+    same however big the tables are. It is all one transaction on this side,
+    so a copy that fails leaves nothing behind to clear up
+    Args:
+        source_url (str): The database to copy from, like sqlite:///site.db
+        chunk_size (int): Rows read and written at a time
+        on_table (function): Called with (table name, rows copied) as each table finishes
+    Returns:
+        dict: {table name: rows copied}
+    Raises:
+        ValueError: If the two databases are not at the same schema version,
+            this one has rows already, or some rows would not fit"""
+    source = _source(source_url)
+    source_version, target_version = migrations.version(source), migrations.version()
+    if source_version is None or source_version != target_version:
+        raise ValueError(f'{source_url} is at schema version {source_version} and this database at '
+                         f'{target_version}, run "flask db upgrade" against both first')
+    found = problems(source)
+    if found:
+        raise ValueError('; '.join(found))
+    copied = {}
+    with source.connect() as connection, db.engine.begin() as writer:
+        for table in _tables():
+            if writer.execute(select([func.count()]).select_from(table)).scalar():
+                raise ValueError(f'{table.name} already has rows, copy into a newly upgraded database')
+        reader = _reader(connection)
+        for table in _tables():
+            key = table.primary_key.columns.values()[0]
+            last = None
+            copied[table.name] = 0
+            while True:
+                query = select([table]).order_by(key).limit(chunk_size)
+                if last is not None:
+                    query = query.where(key > last)
+                rows = reader.execute(query).fetchall()
+                if not rows:
+                    break
+                writer.execute(table.insert(), [dict(row) for row in rows])
+                copied[table.name] += len(rows)
+                last = rows[-1][key]
+            if on_table:
+                on_table(table.name, copied[table.name])
+        if writer.dialect.name == 'postgresql':
+            # The ids were copied as they were, so each sequence has to be
+            # moved past them before the site adds a row of its own
+            for table in _tables():
+                key = table.primary_key.columns.values()[0].name
+                writer.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key}'), "
+                                    f"COALESCE(MAX({key}), 0) + 1, false) FROM {table.name}"))
+    return copied
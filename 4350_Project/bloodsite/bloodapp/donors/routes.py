@@ -0,0 +1,169 @@
+from flask import render_template, url_for, flash, redirect, request, jsonify, Blueprint
+from flask_login import current_user, login_required
+from bloodapp.forms import CreateDonorForm, UpdateDonorForm, DonorForm, DonationForm, DonorSearchForm
+from bloodapp.models import Bank, Donor, Donation
+from bloodapp import db
+from bloodapp import inventory, eligibility, expiry, intake
+from bloodapp.search import search_donors
+from bloodapp.donors.utils import send_donor_email
+
+donors = Blueprint('donors', __name__)
+
+
+@donors.route('/createDonor', methods=["GET", "POST"])
+@login_required
+def createDonor():
+    """This routes to the page where you create the donor
+    Args (all taken in on valid submit of the CreateDonorForm):
+       first_name (str): The first name of the donor
+       last_name (str): the last name
+       blood_type(str): Their blood type
+       age (int): their age
+       email (str): Their email address"""
+
+    form = CreateDonorForm()
+    if form.validate_on_submit():
+        donor = Donor(first_name=form.first_name.data.lower(), last_name=form.last_name.data.lower(), email=form.email.data.lower(),
+                    age=form.age.data, blood_type=form.blood_type.data, location=current_user.location)
+        db.session.add(donor)
+        db.session.flush()
+        send_donor_email(donor)
+        db.session.commit()
+        flash(f'Donor Added To Database', category='Success')
+        return redirect(url_for('donors.DonorPage', donor_id=donor.id))
+    return render_template('new_donor.html', title="Register", form=form)
+
+@donors.route('/UpdateDonor/<int:donor_id>', methods=["GET", "POST"])
+@login_required
+def UpdateDonor(donor_id):
+    """"This routes to the page where you update the donor
+    Args (all taken in on valid submit of the UpdateDonorForm):
+       donor_id (int): the donors id, this loads their entry in the database
+    The rest are optional:
+       first_name (str): The first name of the donor
+       last_name (str): the last name
+       blood_type(str): Their blood type
+       age (int): their age
+       email (str): Their email address"""
+    donor = Donor.query.get_or_404(donor_id)
+    form = UpdateDonorForm()
+    if form.validate_on_submit():
+        donor.first_name=form.first_name.data.lower()
+        donor.last_name=form.last_name.data.lower()
+        donor.email=form.email.data.lower()
+        donor.age=form.age.data
+        donor.blood_type=form.blood_type.data
+        db.session.commit()
+        flash(f'Donor Updated', category='Success')
+    elif request.method == 'GET':
+        form.first_name.data=donor.first_name.capitalize()
+        form.last_name.data=donor.last_name.capitalize()
+        form.email.data=donor.email.capitalize()
+        form.age.data=donor.age
+        form.blood_type.choices=[donor.blood_type]
+    return render_template('update_donor.html', title="Update Donor", form=form)
+
+
+@donors.route('/LoadDonor', methods=["GET", "POST"])
+@login_required
+def LoadDonor():
+    """"This routes to the page where you load a donor
+    Args (all taken in on valid submit of the DonorForm):
+        donor_id (int): the id of the donor
+        OR:
+            first_name (str): The first name of the donor
+            last_name (str): the last name
+            email (str): Their email address"""
+    form = DonorForm()
+    donor = None
+    if form.validate_on_submit():
+        if form.donor_id.data:
+            donor = Donor.query.filter_by(id=form.donor_id.data).first()
+        elif form.first_name.data and form.email.data:
+            donor = Donor.query.filter_by(first_name=form.first_name.data.lower(), last_name=form.last_name.data.lower(), email=form.email.data.lower()).first()
+        if donor:
+            return redirect(url_for('donors.DonorPage', donor_id=donor.id))
+        elif request.method == 'POST':
+            flash(f'No Donor was detected')
+    return render_template('load_donor.html', title="Load Donor", form=form)
+
+
+@donors.route('/SearchDonor', methods=["GET"])
+@login_required
+def SearchDonor():
+    """"This routes to the page where you search for a donor by any part of
+    their names or email, with typos allowed
+    Args (taken from the query string):
+        q (str): The search words
+        page (int): The page of results"""
+    form = DonorSearchForm(request.args)
+    results = None
+    found = None
+    if form.validate():
+        page_num = request.args.get('page', 1, type=int)
+        results, found = search_donors(form.q.data, page=max(page_num, 1))
+    return render_template('search_donor.html', title="Search Donors", form=form, results=results, found=found)
+
+
+@donors.route('/DonorPage/<int:donor_id>', methods=["GET", "POST"])
+@login_required
+def DonorPage(donor_id):
+    """This is the page that LoadDonor leads to, where the
+    Donor can choose to donate or the donor can be updated
+    Args:
+        donor_id (int): this is the donors id"""
+    donor = Donor.query.get_or_404(donor_id)
+    form=DonationForm()
+    if form.validate_on_submit():
+        if form.donate_blood.data:
+            if eligibility.is_eligible(donor, 'blood'):
+                donation = Donation(blood_type=donor.blood_type, blood=True, plasma=False, location=current_user.location)
+                expiry.set_expiry(donation)
+                db.session.add(donation)
+                inventory.record_donation(donation)
+                eligibility.record_donation(donor, 'blood', current_user.location)
+                db.session.add(donor)
+                db.session.commit()
+                flash(f'Blood Donated!', category='Success')
+            else:
+                flash(f'Donor not yet eligible to donate')
+                flash(f'{donor.first_name} will be eligible on {donor.next_blood_eligible}')
+        elif form.donate_plasma.data:
+            if eligibility.is_eligible(donor, 'plasma'):
+                donation = Donation(blood_type=donor.blood_type, blood=False, plasma=True, location=current_user.location)
+                expiry.set_expiry(donation)
+                db.session.add(donation)
+                inventory.record_donation(donation)
+                eligibility.record_donation(donor, 'plasma', current_user.location)
+                db.session.add(donor)
+                db.session.commit()
+                flash(f'Plasma Donated!', category='Success')
+            else:
+                flash(f'Donor not yet eligible to donate')
+                flash(f'{donor.first_name} will be eligible on {donor.next_plasma_eligible}')
+        elif form.update_donor:
+            return redirect(url_for('donors.UpdateDonor', donor_id=donor.id))
+    return render_template('donor.html', title="Donor", form=form, donor=donor)
+
+
+@donors.route('/donations/batch', methods=["POST"])
+@login_required
+def BatchIntake():
+    """Takes the donations a mobile drive collected while offline as JSON:
+    {"location": optional branch, the employee's by default,
+    "donations": [{"key", "donor_id", "kind", "timestamp"}]}, and returns a
+    result for each. Sending a batch again is safe, see intake.intake()"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='send a JSON object with a list of donations'), 400
+    location = body.get('location') or current_user.location
+    if Bank.query.filter_by(location=location).first() is None:
+        return jsonify(error=f'there is no bank at {location}'), 400
+    try:
+        results = intake.intake(body.get('donations'), location, current_user.id)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    # Replays are counted apart, so accepted is only the donations added now
+    counts = {status: sum(result["status"] == status and not result.get("replayed") for result in results)
+              for status in ('accepted', 'ineligible', 'invalid', 'conflict')}
+    return jsonify(results=results, replayed=sum(bool(result.get("replayed")) for result in results), **counts)
@@ -0,0 +1,25 @@
+from flask_mail import Message
+from bloodapp import outbox
+
+
+def donor_email(donor):
+    """Builds the email informing new donors of their ID
+    Args:
+        donor (obj): This is a donor from the DONOR table
+    Returns:
+        Message"""
+    msg = Message('New Donor ID',
+                   sender='NoReplyBloodBank@my.unt.edu',
+                   recipients=[donor.email])
+    msg.body = f"""Thank you, {donor.first_name} for choosing to donate blood!
+                   Your Donor ID is {donor.id}
+                   We appreciate your blood!"""
+    return msg
+
+def send_donor_email(donor):
+    """Queues an email informing new donors of their ID
+    Args:
+        donor (obj): This is a donor from the DONOR table
+    Returns:
+        None"""
+    outbox.enqueue(donor_email(donor))
@@ -0,0 +1,132 @@
+import datetime
+from bloodapp import db
+from bloodapp.models import Donor
+
+# How long a donor has to wait after giving before they may give again
+WAIT = {
+    "blood": datetime.timedelta(weeks=8),
+    "plasma": datetime.timedelta(weeks=4),
+}
+KINDS = list(WAIT)
+
+
+def from_utc(when):
+    """The eligibility and last donation dates are on this server's clock,
+    like datetime.now(), while Donation.date is in UTC
+    Args:
+        when (date): A time in UTC without a time zone
+    Returns:
+        date: The same time on this server's clock"""
+    return when.replace(tzinfo=datetime.timezone.utc).astimezone().replace(tzinfo=None)
+
+
+def _columns(kind):
+    """The last donation and next eligible columns for blood or plasma"""
+    if kind == 'blood':
+        return Donor.last_blood_donation_date, Donor.next_blood_eligible
+    return Donor.last_plasma_donation_date, Donor.next_plasma_eligible
+
+
+def next_eligible(donor, kind):
+    """Returns:
+        date: When the donor may next give blood or plasma"""
+    return getattr(donor, _columns(kind)[1].key)
+
+
+def is_eligible(donor, kind, now=None):
+    """Checks whether a donor may give blood or plasma
+    Args:
+        donor (obj): This is a donor from the DONOR table
+        kind (str): "blood" or "plasma"
+        now (date): The time to check at, now by default
+    Returns:
+        bool: True if they may donate"""
+    eligible = next_eligible(donor, kind)
+    return eligible is None or eligible <= (now or datetime.datetime.now())
+
+
+def record_donation(donor, kind, location, when=None):
+    """Marks that the donor just gave, so they drop out of the eligible donors
+    until their wait is over. The caller commits
+    Args:
+        donor (obj): This is a donor from the DONOR table
+        kind (str): "blood" or "plasma"
+        location (str): The branch they gave at
+        when (date): When they gave, now by default"""
+    when = when or datetime.datetime.now()
+    last, following = _columns(kind)
+    setattr(donor, last.key, when)
+    setattr(donor, following.key, when + WAIT[kind])
+    donor.location = location
+
+
+def eligible_query(blood_type, kind, location=None, as_of=None):
+    """The donors of a blood type who may give blood or plasma, the ones who
+    have been able to the longest first. This is a single range scan of
+    ix_donor_blood_eligible or ix_donor_plasma_eligible
+    Args:
+        blood_type (str): Like "O-"
+        kind (str): "blood" or "plasma"
+        location (str): Only donors from this branch, or every branch
+        as_of (date): Eligible at this time, now by default
+    Returns:
+        obj: A Donor query, ready to paginate() or stream()"""
+    _, following = _columns(kind)
+    query = Donor.query.filter(Donor.blood_type == blood_type,
+                               following <= (as_of or datetime.datetime.now()))
+    if location:
+        # Ties come out in id order either way, since the index ends in the
+        # row id, but SQLite only sees that without the location filter and
+        # would otherwise sort the result again
+        return query.filter(Donor.location == location).order_by(following, Donor.location)
+    return query.order_by(following, Donor.location, Donor.id)
+
+
+def stream(blood_type, kind, location=None, as_of=None, batch_size=1000, columns=None):
+    """Reads every eligible donor with one query, batch_size rows at a time,
+    so a recall list of any size is never all in memory at once
+    Args:
+        columns (list): Read just these Donor columns instead of whole donors,
+            which is several times faster for exports
+    Yields:
+        list: Up to batch_size donors, or rows of the columns"""
+    query = eligible_query(blood_type, kind, location, as_of)
+    if columns:
+        query = query.with_entities(*columns)
+    batch = []
+    for donor in query.yield_per(batch_size):
+        batch.append(donor)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def backfill(chunk_size=1000):
+    """Fills in next_blood_eligible and next_plasma_eligible for donors added
+    before the columns existed, from their last donation dates. Donors who
+    never gave are eligible straight away
+    Returns:
+        int: The number of donors updated"""
+    table = Donor.__table__
+    updated = 0
+    last_id = 0
+    while True:
+        chunk = db.session.query(Donor.id, Donor.last_blood_donation_date, Donor.last_plasma_donation_date) \
+            .filter(Donor.id > last_id) \
+            .filter((Donor.next_blood_eligible == None) | (Donor.next_plasma_eligible == None)) \
+            .order_by(Donor.id).limit(chunk_size).all()
+        if not chunk:
+            return updated
+        now = datetime.datetime.now()
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('donor_id')),
+            [{"donor_id": row.id,
+              "next_blood_eligible": row.last_blood_donation_date + WAIT['blood']
+              if row.last_blood_donation_date else now,
+              "next_plasma_eligible": row.last_plasma_donation_date + WAIT['plasma']
+              if row.last_plasma_donation_date else now} for row in chunk])
+        db.session.commit()
+        updated += len(chunk)
+        last_id = chunk[-1].id
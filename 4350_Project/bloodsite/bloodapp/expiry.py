@@ -0,0 +1,123 @@
+import datetime
+from sqlalchemy import tuple_
+from bloodapp import db, inventory, ledger
+from bloodapp.models import Donation
+
+# How long a unit keeps on the shelf after it is donated
+SHELF_LIFE = {
+    "blood": datetime.timedelta(days=42),
+    "plasma": datetime.timedelta(days=365),
+}
+
+
+def expires_at(date, blood):
+    """Returns:
+        date: When a unit donated at date goes out of date"""
+    return date + SHELF_LIFE['blood' if blood else 'plasma']
+
+
+def set_expiry(donation):
+    """Dates a new unit and sets when it expires, before it is added
+    Args:
+        donation (obj): This is a donation from the DONATION table"""
+    if donation.date is None:
+        donation.date = datetime.datetime.utcnow()
+    donation.expires = expires_at(donation.date, donation.blood)
+
+
+def usable_units(blood_type, blood, plasma, location=None, now=None):
+    """Builds the query for the units that may still be shipped, closest to
+    expiry first. This reads ix_donation_expiry in order and stops when it
+    has enough, without looking at expired units or other types
+    Args:
+        blood_type (str): The blood type requested
+        blood (bool): if blood is requested
+        plasma (bool): if plasma is requested
+        location (str): Only units at this branch, or every branch
+        now (date): The time to check expiry at, now by default
+    Returns:
+        obj: A query for the (id, location) of each unit"""
+    query = db.session.query(Donation.id, Donation.location) \
+        .filter(Donation.blood_type == blood_type, Donation.blood == blood, Donation.plasma == plasma,
+                Donation.expired == False, Donation.expires > (now or datetime.datetime.utcnow()))
+    if location:
+        # As with eligible donors, leaving the id out of the ORDER BY lets
+        # SQLite use the index order when location is filtered on
+        return query.filter(Donation.location == location).order_by(Donation.expires, Donation.location)
+    return query.order_by(Donation.expires, Donation.location, Donation.id)
+
+
+def backfill(chunk_size=1000):
+    """Sets the expiry of units that do not have one, from the day they were
+    donated. Units added before the column existed are filled in this way
+    Returns:
+        int: The number of units updated"""
+    table = Donation.__table__
+    updated = 0
+    while True:
+        chunk = db.session.query(Donation.id, Donation.date, Donation.blood) \
+            .filter(Donation.expires == None).order_by(Donation.id).limit(chunk_size).all()
+        if not chunk:
+            return updated
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('donation_id')),
+            [{"donation_id": row.id, "expires": expires_at(row.date, row.blood)} for row in chunk])
+        db.session.commit()
+        updated += len(chunk)
+
+
+def _unit_kinds():
+    """Every blood type and kind in the Donation table, found by hopping
+    through ix_donation_expiry one key at a time instead of reading every unit
+    Returns:
+        list: (blood_type, blood, plasma) tuples"""
+    columns = (Donation.blood_type, Donation.blood, Donation.plasma)
+    kinds = []
+    while True:
+        query = db.session.query(*columns)
+        if kinds:
+            query = query.filter(tuple_(*columns) > kinds[-1])
+        row = query.order_by(*columns).first()
+        if row is None:
+            return kinds
+        kinds.append(tuple(row))
+
+
+def sweep(now=None, batch_size=1000):
+    """Marks every unit past its expiry as expired, takes it out of the
+    inventory counts and records it in the ledger, batch_size units per
+    transaction. Each blood type and kind on the shelf is one range scan of
+    ix_donation_expiry
+    Args:
+        now (date): Units expiring before this are swept, now by default
+        batch_size (int): Units marked per transaction
+    Returns:
+        int: The number of units marked expired"""
+    now = now or datetime.datetime.utcnow()
+    backfill(batch_size)
+    swept = 0
+    for blood_type, blood, plasma in _unit_kinds():
+        while True:
+            batch = db.session.query(Donation.id, Donation.location) \
+                .filter(Donation.blood_type == blood_type, Donation.blood == blood, Donation.plasma == plasma,
+                        Donation.expired == False, Donation.expires <= now) \
+                .limit(batch_size).all()
+            if not batch:
+                break
+            per_location = {}
+            for row in batch:
+                per_location[row.location] = per_location.get(row.location, 0) + 1
+            marked = db.session.query(Donation) \
+                .filter(Donation.id.in_([row.id for row in batch]), Donation.expired == False) \
+                .update({Donation.expired: True}, synchronize_session=False)
+            if marked != len(batch):
+                # A withdrawal shipped some of these in the meantime, read them again
+                db.session.rollback()
+                continue
+            for location, units in per_location.items():
+                inventory.adjust(location, blood_type, blood, plasma, -units)
+                ledger.append('expired', location, blood_type, blood, -units)
+            db.session.commit()
+            swept += len(batch)
+    return swept
+
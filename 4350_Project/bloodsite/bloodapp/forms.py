@@ -3,9 +3,19 @@ from flask_login import current_user
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectField, IntegerField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, InputRequired, Optional
 from bloodapp.models import Donor, Staff, Bank
+from bloodapp.choices import bank_choices
+from bloodapp.compatibility import BLOOD_TYPES
 
 
-class EmployeeForm(FlaskForm):
+class BranchForm(FlaskForm):
+    """A form with a location SelectField of the bank branches.
+    The choices are filled in when the form is built, not when this module is imported"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.location.choices = bank_choices()
+
+
+class EmployeeForm(BranchForm):
     """This is the form where an employee can update their account
     Args:
         first_name (str): The first name of the staff
@@ -15,9 +25,6 @@ class EmployeeForm(FlaskForm):
         role (str): Their job title
         location (str): The branch they work in"""
 
-    banks = Bank.query.all()
-    bank_names = [item.location for item in banks]
-
     first_name = StringField('First Name',
                            validators=[InputRequired(), Length(min=2, max=20)])
 
@@ -33,7 +40,7 @@ class EmployeeForm(FlaskForm):
     role = StringField('Role',
                            validators=[Length(min=2, max=25)])
 
-    location = SelectField('location', choices=bank_names, validators=[InputRequired()])
+    location = SelectField('location', validators=[InputRequired()])
 
     submit = SubmitField('Create User')
                
@@ -49,9 +56,7 @@ class LoginForm(FlaskForm):
 
 
 class CreateDonorForm(FlaskForm):
-    bloods = ['O-',	'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+']
-
-    blood_type = SelectField('blood_type', choices=bloods, validators=[InputRequired()])
+    blood_type = SelectField('blood_type', choices=BLOOD_TYPES, validators=[InputRequired()])
     
     first_name = StringField('First Name',
                            validators=[InputRequired(), Length(min=2, max=20)])
@@ -72,11 +77,22 @@ class CreateDonorForm(FlaskForm):
 
 
 
+class ImportDonorForm(CreateDonorForm):
+    """CreateDonorForm for one row of a bulk import. The emails are checked for
+    duplicates a whole chunk at a time by the importer, and the deliverability
+    check is skipped because it is a DNS lookup per row"""
+    class Meta:
+        csrf = False
+
+    email = StringField('Email', validators=[InputRequired(), Email()])
+
+    def validate_email(self, email):
+        pass
+
+
 class UpdateDonorForm(FlaskForm):
     """This form is for the employee to update the donor"""
-    bloods = ['O-',	'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+']
-
-    blood_type = SelectField('blood_type', choices=bloods, validators=[InputRequired()])
+    blood_type = SelectField('blood_type', choices=BLOOD_TYPES, validators=[InputRequired()])
     
     first_name = StringField('First Name',
                            validators=[InputRequired(), Length(min=2, max=20)])
@@ -142,6 +158,19 @@ class DonorForm(FlaskForm):
         elif not self.last_name.data:        
             raise ValidationError("Both names and email must be filled!")
 
+class DonorSearchForm(FlaskForm):
+    """This is the search box on the donor search page. It is sent with GET so
+    result pages can be linked to and refreshed:
+    Args:
+       q (str): Any part of the donor's names or email"""
+    class Meta:
+        csrf = False
+
+    q = StringField('Search', validators=[DataRequired(), Length(max=100)])
+
+    submit = SubmitField('Search')
+
+
 class DonationForm(FlaskForm):
     """This allows for the selection of Donating plasma, blood, or updating the donor account"""
     donate_blood = SubmitField()
@@ -149,31 +178,40 @@ class DonationForm(FlaskForm):
     update_donor = SubmitField()
     
 
-class WithdrawForm(FlaskForm):
+class WithdrawForm(BranchForm):
     """This is the model for the Donor:
     Args:
        blood_type(str): Their blood type
        blood (bool): if the donation is blood
        plasma (bool): if the donation is plasma
-       units (int): The amount of units requested"""
-    bloods = ['O-',	'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+']
+       units (int): The amount of units requested
+       location (str): The branch to ship from, empty for any branch
+       substitutes (bool): if compatible types may make up a shortfall"""
     options = ['Blood', 'Plasma']
-    blood_type = SelectField('Blood Type', choices=bloods, validators=[DataRequired()])
+    blood_type = SelectField('Blood Type', choices=BLOOD_TYPES, validators=[DataRequired()])
     blood_or_plasma = SelectField('Blood or Plasma', choices=options, validators=[DataRequired()])
     units = StringField('units', validators=[DataRequired()])
+    location = SelectField('Ship From', validators=[Optional()])
+    substitutes = BooleanField('Send compatible types if we are short', default=True)
     submit = SubmitField('Confirm')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.location.choices = [('', 'Any branch')] + [(name, name) for name in self.location.choices]
+
     def validate_units(self, units):
         """This pulls in the units inputs as either a number or the word all"""
+        if units.data.lower() == "all":
+            return
         try:
-            if int(units.data):
-                pass
-        except Exception as e:
-            if units.data.lower() != "all":
-                raise ValidationError('Please enter the number of units you wish to have, or simply type "All"')
+            if int(units.data) > 0:
+                return
+        except ValueError:
+            pass
+        raise ValidationError('Please enter the number of units you wish to have, or simply type "All"')
         
 
-class CreateEmployeeForm(FlaskForm):
+class CreateEmployeeForm(BranchForm):
     """This is the form where an employee can create their account
     Args:
         first_name (str): The first name of the staff
@@ -183,8 +221,6 @@ class CreateEmployeeForm(FlaskForm):
         role (str): Their job title
         location (str): The branch they work in"""
     
-    banks = Bank.query.all()
-    bank_names = [item.location for item in banks]
     roles = ["Nurse", "Doctor", "Admin"]
 
     first_name = StringField('First Name',
@@ -203,7 +239,7 @@ class CreateEmployeeForm(FlaskForm):
 
     role = SelectField('Role', choices=roles, validators=[DataRequired()])
 
-    location = SelectField('location', choices=bank_names, validators=[DataRequired()])
+    location = SelectField('location', validators=[DataRequired()])
 
     submit = SubmitField('Create Employee')
 
@@ -250,7 +286,7 @@ class ResetPasswordForm(FlaskForm):
                              validators=[DataRequired(), Length(min=5), EqualTo('password')])
     submit = SubmitField('Reset Password')                    
 
-class UpdateEmployeeForm(FlaskForm):
+class UpdateEmployeeForm(BranchForm):
     """This is the form where an employee can update their account
     Args:
         first_name (str): The first name of the staff
@@ -259,8 +295,6 @@ class UpdateEmployeeForm(FlaskForm):
         email (str): Their email address
         role (str): Their job title
         location (str): The branch they work in"""
-    banks = Bank.query.all()
-    bank_names = [item.location for item in banks]
     roles = ["Nurse", "Doctor", "Admin"]
 
     first_name = StringField('First Name',
@@ -276,7 +310,7 @@ class UpdateEmployeeForm(FlaskForm):
     role = SelectField('Role', choices=roles,
                            validators=[Length(min=2, max=25)])
 
-    location = SelectField('location', choices=bank_names, validators=[DataRequired()])
+    location = SelectField('location', validators=[DataRequired()])
 
     submit = SubmitField('Update Employee')
 
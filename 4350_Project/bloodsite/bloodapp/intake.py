@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+from sqlalchemy.exc import IntegrityError
+from bloodapp import db, eligibility, expiry, inventory
+from bloodapp.models import Donation, Donor, IntakeKey
+
+# The most donations in one request, more than a long day at a drive
+MAX_BATCH = 500
+# How far ahead of our clock a drive's timestamps may be
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+def _parse_time(value):
+    """Reads an ISO 8601 timestamp. One with a time zone is turned into UTC,
+    one without is taken to be UTC already, like Donation.date"""
+    if not isinstance(value, str):
+        raise ValueError('not a string')
+    when = datetime.datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def _parse(item, now):
+    """Checks the shape of one donation sent by a drive
+    Returns:
+        tuple: (key, donor_id, kind, when)
+    Raises:
+        ValueError: Saying what is wrong with it"""
+    if not isinstance(item, dict):
+        raise ValueError('each donation must be an object')
+    key = item.get('key')
+    if not isinstance(key, str) or not 0 < len(key) <= IntakeKey.key.type.length:
+        raise ValueError(f'key must be a string of 1 to {IntakeKey.key.type.length} characters')
+    donor_id = item.get('donor_id')
+    if not isinstance(donor_id, int) or isinstance(donor_id, bool):
+        raise ValueError('donor_id must be a number')
+    kind = item.get('kind')
+    if kind not in eligibility.KINDS:
+        raise ValueError(f'kind must be one of {", ".join(eligibility.KINDS)}')
+    try:
+        when = _parse_time(item['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('timestamp must be an ISO 8601 time like 2021-03-01T14:30:00Z')
+    if when > now + CLOCK_SKEW:
+        raise ValueError('timestamp is in the future')
+    # The unit would go on the shelf already expired and count as stock
+    # until the next sweep takes it off
+    if expiry.expires_at(when, kind == 'blood') <= now:
+        raise ValueError(f'timestamp is older than a {kind} unit keeps')
+    return key, donor_id, kind, when
+
+
+def _fingerprint(donor_id, kind, when):
+    """Tells apart two donations sent under the same key. The time is the
+    parsed one, so "14:30:00Z" and "14:30:00+00:00" are the same donation"""
+    return hashlib.sha1(f'{donor_id}:{kind}:{when.isoformat()}'.encode('utf-8')).hexdigest()
+
+
+def _conflict(key):
+    return {"key": key, "status": 'conflict', "error": 'this key was already sent with a different donation'}
+
+
+def _intake(items, location, staff_id, now):
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index,) + _parse(item, now))
+        except ValueError as e:
+            key = item.get('key') if isinstance(item, dict) else None
+            results[index] = {"key": key, "status": 'invalid', "error": str(e)}
+    keys = {key for _, key, _, _, _ in parsed}
+    stored = {row.key: (row.fingerprint, json.loads(row.result))
+              for row in IntakeKey.query.filter(IntakeKey.staff_id == staff_id, IntakeKey.key.in_(keys))} \
+        if keys else {}
+    donor_ids = {donor_id for _, _, donor_id, _, _ in parsed}
+    donors = {donor.id: donor for donor in Donor.query.filter(Donor.id.in_(donor_ids))} if donor_ids else {}
+
+    new = {}
+    repeats = []
+    accepted = []
+    # Oldest first, so a donor who gave twice at the drive is checked
+    # against the first of the two
+    for index, key, donor_id, kind, when in sorted(parsed, key=lambda row: (row[4], row[0])):
+        fingerprint = _fingerprint(donor_id, kind, when)
+        if key in stored:
+            # Keys from before fingerprints were kept are taken on trust
+            if stored[key][0] not in (None, fingerprint):
+                results[index] = _conflict(key)
+            else:
+                results[index] = dict(stored[key][1], replayed=True)
+            continue
+        if key in new:
+            repeats.append((index, key, fingerprint))
+            continue
+        donor = donors.get(donor_id)
+        if donor is None:
+            results[index] = {"key": key, "status": 'invalid', "error": 'there is no donor with that id'}
+            continue
+        local = eligibility.from_utc(when)
+        if eligibility.is_eligible(donor, kind, local):
+            donation = Donation(blood_type=donor.blood_type, blood=kind == 'blood', plasma=kind == 'plasma',
+                                location=location, date=when)
+            expiry.set_expiry(donation)
+            eligibility.record_donation(donor, kind, location, local)
+            result = {"key": key, "status": 'accepted'}
+            accepted.append((result, donation))
+        else:
+            result = {"key": key, "status": 'ineligible',
+                      "eligible_on": eligibility.next_eligible(donor, kind).isoformat()}
+        results[index] = result
+        new[key] = (fingerprint, result)
+
+    if accepted:
+        donations = [donation for _, donation in accepted]
+        db.session.add_all(donations)
+        db.session.flush()
+        inventory.record_donations(donations)
+        for result, donation in accepted:
+            result["donation_id"] = donation.id
+    if new:
+        db.session.execute(IntakeKey.__table__.insert(), [
+            {"key": key, "staff_id": staff_id, "fingerprint": fingerprint, "received": now,
+             "result": json.dumps(result)}
+            for key, (fingerprint, result) in new.items()])
+    db.session.commit()
+    for index, key, fingerprint in repeats:
+        results[index] = _conflict(key) if fingerprint != new[key][0] else dict(new[key][1], replayed=True)
+    return results
+
+
+def intake(items, location, staff_id=None, now=None):
+    """Records a batch of donations from a mobile drive in one transaction.
+    The donors are read with one IN query and the keys already seen with
+    another, every donation is checked for eligibility at the time it was
+    given (on the server's clock, which the eligibility dates use), and the
+    inventory, rollups and ledger get one write per row they touch rather
+    than one per donation. A donation from further back than its unit's
+    shelf life is invalid. Each donation carries a key made up by the drive,
+    and a key the same employee has sent before gets back the result it got
+    the first time, so a drive can send the whole batch again after a lost
+    reply without anything being counted twice. A key sent again with a
+    different donor, kind or time is a conflict and changes nothing
+    Args:
+        items (list): Dicts of key, donor_id, kind ("blood" or "plasma") and timestamp
+        location (str): The branch the units go to
+        staff_id (int): The employee sending them
+        now (date): The time to check timestamps against, now by default
+    Returns:
+        list: A result for each item, in order, with its key and a status of
+        "accepted" (with donation_id), "ineligible" (with eligible_on),
+        "invalid" or "conflict" (with error), and replayed set when the key
+        was seen before
+    Raises:
+        ValueError: If items is not a list or is too long"""
+    if not isinstance(items, list):
+        raise ValueError('donations must be a list')
+    if len(items) > MAX_BATCH:
+        raise ValueError(f'send at most {MAX_BATCH} donations at a time')
+    now = now or datetime.datetime.utcnow()
+    try:
+        return _intake(items, location, staff_id, now)
+    except IntegrityError:
+        # The same keys were sent again while this batch was being written,
+        # so once the other one commits they all come back as replays
+        db.session.rollback()
+        return _intake(items, location, staff_id, now)
+
+
+def prune(older_than):
+    """Forgets the keys of batches received before a time, after which the
+    drives have long stopped retrying them
+    Args:
+        older_than (date): Keys received before this are removed
+    Returns:
+        int: The number of keys removed"""
+    table = IntakeKey.__table__
+    removed = db.session.execute(table.delete().where(table.c.received < older_than)).rowcount
+    db.session.commit()
+    return removed
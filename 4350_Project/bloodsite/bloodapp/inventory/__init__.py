@@ -0,0 +1,123 @@
+from sqlalchemy import func
+from bloodapp import analytics, db, ledger
+from bloodapp.database import increment
+from bloodapp.models import Donation, Inventory
+
+
+def adjust(location, blood_type, blood, plasma, delta):
+    """Adds delta units to one inventory row, creating it if needed.
+    This only adds to the session, the caller commits with the rest of its work
+    Args:
+        location (str): The branch the units are in
+        blood_type (str): The blood type of the units
+        blood (bool): if the units are blood
+        plasma (bool): if the units are plasma
+        delta (int): The number of units added, negative for a withdraw"""
+    increment(db.session, Inventory.__table__,
+              {"location": location, "blood_type": blood_type, "blood": blood, "plasma": plasma}, {"count": delta})
+
+
+def record_donation(donation):
+    """Counts a new donation into the inventory and the day's rollup, and
+    adds it to the ledger
+    Args:
+        donation (obj): This is a donation from the DONATION table"""
+    adjust(donation.location, donation.blood_type, donation.blood, donation.plasma, 1)
+    analytics.record_donation(donation)
+    if donation.id is None:
+        db.session.flush()
+    ledger.append('donated', donation.location, donation.blood_type, donation.blood, 1,
+                  donation_id=donation.id, at=donation.date)
+
+
+def record_donations(donations):
+    """Counts a batch of new donations in with one upsert for each inventory
+    and rollup row they touch, and adds them to the ledger with one insert.
+    The donations must already be flushed, so they have ids
+    Args:
+        donations (list): Donations from the DONATION table"""
+    counts = {}
+    for donation in donations:
+        key = (donation.location, donation.blood_type, donation.blood, donation.plasma)
+        counts[key] = counts.get(key, 0) + 1
+    for (location, blood_type, blood, plasma), units in sorted(counts.items()):
+        adjust(location, blood_type, blood, plasma, units)
+    analytics.record_donations(donations)
+    ledger.append_many([{"event": 'donated', "location": donation.location, "blood_type": donation.blood_type,
+                         "blood": donation.blood, "units": 1, "donation_id": donation.id, "at": donation.date}
+                        for donation in donations])
+
+
+def record_withdrawal(blood_type, blood, plasma, shipped):
+    """Takes shipped units out of the inventory, counts them in the day's
+    rollup and adds them to the ledger
+    Args:
+        blood_type (str): The blood type that was shipped
+        blood (bool): if the units were blood
+        plasma (bool): if the units were plasma
+        shipped (dict): The number of units shipped from each location"""
+    for location, units in shipped.items():
+        adjust(location, blood_type, blood, plasma, -units)
+        ledger.append('shipped', location, blood_type, blood, -units)
+    analytics.record_withdrawal(blood_type, blood, plasma, shipped)
+
+
+def inventory_table(session=None):
+    """Builds the current supply table for the withdraw page from the inventory
+    Args:
+        session (obj): The session to read with, db.session by default
+    Returns:
+        dict: {location: {entry: {"location", "type", "count"}}}"""
+    all_donations = {}
+    rows = (session or db.session).query(Inventory).filter(Inventory.count > 0) \
+        .order_by(Inventory.location, Inventory.plasma, Inventory.blood_type).all()
+    for item in rows:
+        kind = "Blood" if item.blood else "Plasma"
+        entry = f"{kind} Type {item.blood_type}"
+        all_donations.setdefault(item.location, {})[entry] = {
+            "location": str(item.location),
+            "type": entry,
+            "count": item.count}
+    return all_donations
+
+
+def _counts_from_donations():
+    """Counts the units on the shelf in the Donation table with a single GROUP BY"""
+    rows = db.session.query(Donation.location, Donation.blood_type, Donation.blood,
+                            Donation.plasma, func.count(Donation.id)) \
+        .filter(Donation.expired == False) \
+        .group_by(Donation.location, Donation.blood_type, Donation.blood, Donation.plasma)
+    return {tuple(row[:4]): row[4] for row in rows}
+
+
+def _counts_from_inventory():
+    rows = db.session.query(Inventory.location, Inventory.blood_type, Inventory.blood,
+                            Inventory.plasma, Inventory.count)
+    return {tuple(row[:4]): row[4] for row in rows}
+
+
+def verify():
+    """Compares the inventory against the Donation table
+    Returns:
+        list: (key, inventory count, donation count) for every row that disagrees"""
+    expected = _counts_from_donations()
+    actual = _counts_from_inventory()
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        if expected.get(key, 0) != actual.get(key, 0):
+            mismatches.append((key, actual.get(key, 0), expected.get(key, 0)))
+    return mismatches
+
+
+def rebuild():
+    """Throws away the inventory and recounts it from the Donation table
+    Returns:
+        int: The number of inventory rows written"""
+    counts = _counts_from_donations()
+    db.session.execute(Inventory.__table__.delete())
+    if counts:
+        db.session.execute(Inventory.__table__.insert(), [
+            {"location": key[0], "blood_type": key[1], "blood": key[2], "plasma": key[3], "count": count}
+            for key, count in counts.items()])
+    db.session.commit()
+    return len(counts)
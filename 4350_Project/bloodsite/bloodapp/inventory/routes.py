@@ -0,0 +1,86 @@
+import datetime
+from flask import render_template, url_for, flash, redirect, request, jsonify, json, Blueprint
+from markupsafe import Markup
+from flask_login import current_user, login_required
+from bloodapp.forms import WithdrawForm
+from bloodapp.inventory import inventory_table
+from bloodapp import analytics, db, ledger, withdrawals
+from bloodapp.cache import page_cache
+from bloodapp.reporting import reporting
+
+inventory = Blueprint('inventory', __name__)
+
+
+@inventory.route('/withdraw', methods=["GET", "POST"])
+@login_required
+def withdraw():
+    """This page displays the current contents of all the banks and allows employees to make a withdraw"""
+    form = WithdrawForm()
+    if form.validate_on_submit():
+        blood = form.blood_or_plasma.data == 'Blood'
+        requested = None if form.units.data.lower() == "all" else int(form.units.data)
+        location = form.location.data or None
+        if requested is not None and form.substitutes.data:
+            parts = withdrawals.ship_compatible(form.blood_type.data, blood, not blood, requested,
+                                                staff_id=current_user.id, location=location)
+        else:
+            shipped = withdrawals.ship(form.blood_type.data, blood, not blood, requested,
+                                       staff_id=current_user.id, location=location)
+            parts = [(form.blood_type.data, shipped)] if shipped else []
+        if parts:
+            flash(f'We have shipped {sum(units for _, units in parts)} units', category='Success')
+            substitutes = [f'{units} {blood_type}' for blood_type, units in parts if blood_type != form.blood_type.data]
+            if substitutes:
+                flash(f'Including compatible units in place of {form.blood_type.data}: {", ".join(substitutes)}',
+                      category='Success')
+            return redirect(url_for('inventory.withdraw'))
+        else:
+            flash(f'We currently have no units of that type')
+    table = page_cache.fragment('inventory_table', ('inventory',), lambda: render_template(
+        'inventory_table.html', all_donations=inventory_table(db.reporting_session)), variant=reporting.source())
+    return render_template('withdraw.html', title="withdraw", form=form, inventory_table=Markup(table))
+
+
+@inventory.route('/analytics/donations')
+@login_required
+def DonationAnalytics():
+    """Units donated and withdrawn per day, week or month as JSON for charts.
+    Takes start and end dates (YYYY-MM-DD, the last 30 days by default), bucket,
+    group_by, and optional location, blood_type and kind filters"""
+    args = request.args
+    today = datetime.datetime.utcnow().date()
+    try:
+        end = datetime.date.fromisoformat(args.get('end', today.isoformat()))
+        start = datetime.date.fromisoformat(args.get('start', (end - datetime.timedelta(days=29)).isoformat()))
+        bucket = args.get('bucket', 'day')
+        group_by = args.get('group_by', 'blood_type')
+        if bucket not in analytics.BUCKETS:
+            raise ValueError(f'bucket must be one of {", ".join(analytics.BUCKETS)}')
+        if group_by not in analytics.GROUPS:
+            raise ValueError(f'group_by must be one of {", ".join(analytics.GROUPS)}')
+        analytics.bucket_starts(start, end, bucket)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    report = lambda: json.dumps(analytics.intake(start, end, bucket, group_by, location=args.get('location'),
+                                                 blood_type=args.get('blood_type'), kind=args.get('kind'),
+                                                 session=db.reporting_session))
+    # The default dates move with the day, so the day is part of the key
+    variant = f'{reporting.source()}:{today}?{request.query_string.decode("utf-8", "replace")}'
+    return page_cache.conditional('donation_analytics', ('donation_rollup',), report, variant,
+                                  mimetype='application/json')
+
+
+@inventory.route('/ledger/stock')
+@login_required
+def LedgerStock():
+    """The stock at a point in time as JSON, from the ledger. Takes at
+    (YYYY-MM-DDTHH:MM:SS, or YYYY-MM-DD for the end of that day, now by
+    default) and an optional location"""
+    try:
+        when = ledger.parse_when(request.args['at']) if 'at' in request.args else None
+        counts = ledger.stock_at(when, request.args.get('location'), session=db.reporting_session)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(at=(when or datetime.datetime.utcnow()).isoformat(), stock=[
+        {"location": location, "blood_type": blood_type, "kind": "blood" if blood else "plasma", "units": units}
+        for (location, blood_type, blood), units in sorted(counts.items())])
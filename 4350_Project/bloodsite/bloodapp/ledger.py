@@ -0,0 +1,169 @@
+import datetime
+import json
+from sqlalchemy import func
+from bloodapp import db
+from bloodapp.models import Inventory, InventorySnapshot, LedgerEvent
+
+
+def append(event, location, blood_type, blood, units, donation_id=None, at=None):
+    """Adds one event to the ledger. This only adds to the session, the
+    caller commits it with the stock change it records
+    Args:
+        event (str): "donated", "shipped" or "expired"
+        location (str): The branch
+        blood_type (str): The blood type of the units
+        blood (bool): True for blood, False for plasma
+        units (int): The change in stock, negative when units left
+        donation_id (int): The donation, for "donated" events
+        at (date): When it happened, now by default"""
+    db.session.execute(LedgerEvent.__table__.insert().values(
+        at=at or datetime.datetime.utcnow(), event=event, location=location, blood_type=blood_type,
+        blood=blood, units=units, donation_id=donation_id))
+
+
+def append_many(events):
+    """Adds several events to the ledger with one insert. The caller commits
+    Args:
+        events (list): Dicts with the arguments of append()"""
+    if events:
+        now = datetime.datetime.utcnow()
+        db.session.execute(LedgerEvent.__table__.insert(), [
+            {"donation_id": None, **row, "at": row.get("at") or now} for row in events])
+
+
+def parse_when(text):
+    """Reads a time like 2021-03-01T14:30:00, or a day like 2021-03-01,
+    which means the end of that day
+    Raises:
+        ValueError: If it is neither"""
+    if len(text) == 10:
+        return datetime.datetime.combine(datetime.date.fromisoformat(text), datetime.time.max)
+    return datetime.datetime.fromisoformat(text)
+
+
+def _apply(counts, rows):
+    for location, blood_type, blood, units in rows:
+        key = (location, blood_type, bool(blood))
+        counts[key] = counts.get(key, 0) + units
+    return counts
+
+
+def _snapshot_before(when=None, session=None):
+    """The latest snapshot taken at or before when, or the latest of all"""
+    query = (session or db.session).query(InventorySnapshot)
+    if when is not None:
+        query = query.filter(InventorySnapshot.taken <= when)
+    return query.order_by(InventorySnapshot.taken.desc(), InventorySnapshot.id.desc()).first()
+
+
+def _counts(snapshot, location=None):
+    counts = {}
+    for row_location, blood_type, blood, units in json.loads(snapshot.counts):
+        if location is None or row_location == location:
+            counts[row_location, blood_type, bool(blood)] = units
+    return counts
+
+
+def _tail(last_event_id, until=None, location=None, session=None):
+    """Adds up the events after a snapshot. This is a range of the primary
+    key, so it only reads the events since the snapshot"""
+    query = (session or db.session).query(LedgerEvent.location, LedgerEvent.blood_type, LedgerEvent.blood,
+                             func.sum(LedgerEvent.units)) \
+        .filter(LedgerEvent.id > last_event_id)
+    if until is not None:
+        query = query.filter(LedgerEvent.at <= until)
+    if location is not None:
+        query = query.filter(LedgerEvent.location == location)
+    return query.group_by(LedgerEvent.location, LedgerEvent.blood_type, LedgerEvent.blood).all()
+
+
+def stock_at(when=None, location=None, session=None):
+    """Works out the stock at a point in time from the snapshot before it and
+    the events between the two
+    Args:
+        when (date): The time to look at, now by default
+        location (str): Only this branch, or every branch
+        session (obj): The session to read with, db.session by default
+    Returns:
+        dict: {(location, blood_type, blood): units}, without the empty ones
+    Raises:
+        ValueError: If when is before the ledger starts"""
+    session = session or db.session
+    snapshot = _snapshot_before(when, session)
+    if snapshot is not None:
+        counts, last_event_id = _counts(snapshot, location), snapshot.last_event_id
+    else:
+        first = session.query(InventorySnapshot).order_by(InventorySnapshot.taken, InventorySnapshot.id).first()
+        if first is not None and first.opening:
+            raise ValueError(f'the ledger starts at {first.taken}, when "flask db upgrade" created it')
+        # The database has had a ledger from the start, so it is all there
+        counts, last_event_id = {}, 0
+    counts = _apply(counts, _tail(last_event_id, when, location, session))
+    return {key: units for key, units in counts.items() if units}
+
+
+def _hold_writers():
+    """Waits for the transactions still adding events to commit, and keeps
+    new ones waiting until this transaction commits. On PostgreSQL ids come
+    from a sequence in the order events are added, not the order they
+    commit, so without this an event could commit below a snapshot's
+    last_event_id after the snapshot was taken and never be counted. SQLite
+    only has one writer at a time, so there it is already the case"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute('LOCK TABLE ledger_event IN SHARE MODE')
+
+
+def snapshot():
+    """Saves the current stock as a new snapshot, worked out from the last
+    snapshot and the events since, so stock_at() never has to read more than
+    the events since this one. Run it from cron, daily or so
+    Returns:
+        obj: The new snapshot"""
+    _hold_writers()
+    previous = _snapshot_before()
+    last_event_id = db.session.query(func.max(LedgerEvent.id)).scalar() or 0
+    counts = _counts(previous) if previous is not None else {}
+    start = previous.last_event_id if previous is not None else 0
+    rows = db.session.query(LedgerEvent.location, LedgerEvent.blood_type, LedgerEvent.blood,
+                            func.sum(LedgerEvent.units)) \
+        .filter(LedgerEvent.id > start, LedgerEvent.id <= last_event_id) \
+        .group_by(LedgerEvent.location, LedgerEvent.blood_type, LedgerEvent.blood)
+    _apply(counts, rows)
+    return _save(last_event_id, counts)
+
+
+def _save(last_event_id, counts, opening=False):
+    row = InventorySnapshot(last_event_id=last_event_id, opening=opening, counts=json.dumps(
+        [[location, blood_type, blood, units] for (location, blood_type, blood), units in sorted(counts.items())
+         if units]))
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def open_from_inventory():
+    """Starts the ledger of a database that had stock before it, with a first
+    snapshot of the inventory as it is now
+    Returns:
+        obj: The snapshot"""
+    _hold_writers()
+    last_event_id = db.session.query(func.max(LedgerEvent.id)).scalar() or 0
+    counts = {}
+    for row in Inventory.query.filter(Inventory.count != 0):
+        counts[row.location, row.blood_type, bool(row.blood)] = row.count
+    return _save(last_event_id, counts, opening=True)
+
+
+def verify():
+    """Compares the stock the ledger adds up to against the inventory table
+    Returns:
+        list: (key, inventory count, ledger count) for every row that disagrees"""
+    ledger = stock_at()
+    inventory = {}
+    for row in Inventory.query:
+        inventory[row.location, row.blood_type, bool(row.blood)] = row.count
+    mismatches = []
+    for key in sorted(set(ledger) | set(inventory), key=str):
+        if ledger.get(key, 0) != inventory.get(key, 0):
+            mismatches.append((key, inventory.get(key, 0), ledger.get(key, 0)))
+    return mismatches
@@ -0,0 +1,60 @@
+import hmac
+from flask import render_template, Blueprint, Response, request, current_app, abort
+from flask_login import current_user
+from bloodapp import outbox
+from bloodapp.cache import page_cache
+from bloodapp.metrics import metrics as request_metrics
+from bloodapp.ratelimit import rate_limiter
+from bloodapp.reporting import reporting
+from bloodapp.staffcache import staff_cache
+
+main = Blueprint('main', __name__)
+
+
+@main.route('/')
+@main.route('/home')
+def home():
+    """Home page. It only changes with whether someone is logged in, so
+    browsers that have it get a 304"""
+    variant = 'staff' if current_user.is_authenticated else 'guest'
+    return page_cache.conditional('home', (), lambda: render_template('home.html', title="Home"), variant)
+
+
+@main.route('/metrics')
+def metrics():
+    """Per endpoint request timing and SQL counts in the Prometheus text format,
+    plus the outbox queue, the staff and page caches and the rate limits. Only Admins or a scraper holding
+    METRICS_TOKEN may read it"""
+    token = current_app.config['METRICS_TOKEN']
+    sent = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(sent, f'Bearer {token}')):
+        if not current_user.is_authenticated or current_user.role != 'Admin':
+            abort(403)
+    cache = staff_cache.stats()
+    pages = page_cache.stats()
+    extra = {
+        "bloodsite_outbox_queued": ('gauge', 'Emails waiting to be sent', outbox.queue_depth()),
+        "bloodsite_outbox_failed": ('gauge', 'Emails the worker gave up on', outbox.failed_count()),
+        "bloodsite_staff_cache_hits_total": ('counter', 'Logged in employees loaded from the cache', cache["hits"]),
+        "bloodsite_staff_cache_misses_total": ('counter', 'Logged in employees loaded from the database', cache["misses"]),
+        "bloodsite_staff_cache_size": ('gauge', 'Employees in the cache', cache["size"]),
+        "bloodsite_page_cache_hits_total": ('counter', 'Page fragments served from the cache', pages["hits"]),
+        "bloodsite_page_cache_misses_total": ('counter', 'Page fragments rendered', pages["misses"]),
+        "bloodsite_page_cache_size": ('gauge', 'Page fragments in this process', pages["size"]),
+    }
+    limits = rate_limiter.stats()
+    extra["bloodsite_ratelimit_allowed_total"] = (
+        'counter', 'Login and reset attempts let through, per rule',
+        [({"rule": rule}, count) for rule, count in sorted(limits["allowed"].items())])
+    extra["bloodsite_ratelimit_limited_total"] = (
+        'counter', 'Login and reset attempts turned away, per rule',
+        [({"rule": rule}, count) for rule, count in sorted(limits["limited"].items())])
+    extra["bloodsite_ratelimit_errors_total"] = ('counter', 'Attempts let through unchecked because Redis failed',
+                                                 limits["errors"])
+    extra["bloodsite_ratelimit_buckets"] = ('gauge', 'Rate limit buckets in this process', limits["size"])
+    snapshot = reporting.stats()
+    if snapshot is not None:
+        extra["bloodsite_reporting_snapshot_age_seconds"] = ('gauge', 'Age of the copy reports read', snapshot["age"])
+        extra["bloodsite_reporting_snapshots_total"] = ('counter', 'Reporting snapshots taken by this process',
+                                                        snapshot["refreshes"])
+    return Response(request_metrics.render(extra), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,192 @@
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """Counts observations into fixed buckets the way Prometheus expects
+    Args:
+        buckets (tuple): The upper bound of each bucket, smallest first"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        """Returns:
+            list: The _bucket, _sum and _count lines, with cumulative bucket counts"""
+        lines = []
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {running}')
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}')
+        lines.append(f'{name}_sum{_labels(labels)} {round(self.sum, 6)}')
+        lines.append(f'{name}_count{_labels(labels)} {self.count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = dict(labels, **extra)
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs.items()) + '}'
+
+
+class RequestMetrics:
+    """Times every request and the SQL it runs, and keeps per endpoint
+    histograms of wall time, statement count and time spent in SQL. Requests
+    slower than METRICS_SLOW_REQUEST_MS are logged with their slowest statement"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._slowest = {}
+        self._responses = {}
+        self._listening = False
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._status)
+        app.teardown_request(self._finish)
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+            self._listening = True
+
+    def _start(self):
+        g.request_metrics = {"start": time.perf_counter(), "queries": 0, "sql": 0.0,
+                             "slowest": 0.0, "slowest_statement": None, "status": 500}
+
+    def _status(self, response):
+        if 'request_metrics' in g:
+            g.request_metrics["status"] = response.status_code
+        return response
+
+    def _finish(self, exc):
+        stats = g.pop('request_metrics', None)
+        if stats is None:
+            return
+        wall = time.perf_counter() - stats["start"]
+        endpoint = request.endpoint or 'unmatched'
+        self.observe(endpoint, request.method, stats["status"], wall, stats["queries"], stats["sql"],
+                     stats["slowest"])
+        threshold = current_app.config['METRICS_SLOW_REQUEST_MS']
+        if threshold is not None and wall * 1000 >= threshold:
+            current_app.logger.warning(
+                f'slow request {request.method} {request.path} took {wall * 1000:.1f} ms: '
+                f'{stats["queries"]} queries, {stats["sql"] * 1000:.1f} ms in SQL, slowest '
+                f'{stats["slowest"] * 1000:.1f} ms: {" ".join((stats["slowest_statement"] or "").split())[:300]}')
+
+    def observe(self, endpoint, method, status, wall, queries, sql, slowest):
+        """Adds one finished request to the histograms
+        Args:
+            endpoint (str): The Flask endpoint, like donors.DonorPage
+            method (str): The HTTP method
+            status (int): The response status code
+            wall (float): Seconds from the start of the request to the end
+            queries (int): How many SQL statements ran
+            sql (float): Seconds spent running them
+            slowest (float): Seconds the slowest one took"""
+        key = (endpoint, method)
+        with self._lock:
+            histograms = self._endpoints.get(key)
+            if histograms is None:
+                histograms = self._endpoints[key] = (Histogram(SECONDS_BUCKETS), Histogram(QUERY_BUCKETS),
+                                                     Histogram(SECONDS_BUCKETS))
+            histograms[0].observe(wall)
+            histograms[1].observe(queries)
+            histograms[2].observe(sql)
+            self._slowest[key] = max(self._slowest.get(key, 0.0), slowest)
+            status_key = (endpoint, method, status)
+            self._responses[status_key] = self._responses.get(status_key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._slowest.clear()
+            self._responses.clear()
+
+    def render(self, extra=None):
+        """Writes everything out in the Prometheus text format
+        Args:
+            extra (dict): Other name: (type, help, value) metrics to include, where
+                value may be a list of (labels, value) pairs
+        Returns:
+            str: The /metrics page"""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            slowest = sorted(self._slowest.items())
+            responses = sorted(self._responses.items())
+        lines = []
+        families = [('bloodsite_request_duration_seconds', 'Wall time of each request', 0),
+                    ('bloodsite_request_queries', 'SQL statements run by each request', 1),
+                    ('bloodsite_request_sql_seconds', 'Time each request spent running SQL', 2)]
+        for name, help_text, index in families:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (endpoint, method), histograms in endpoints:
+                lines += histograms[index].lines(name, {"endpoint": endpoint, "method": method})
+        lines += ['# HELP bloodsite_slowest_statement_seconds The slowest single SQL statement seen per endpoint',
+                  '# TYPE bloodsite_slowest_statement_seconds gauge']
+        for (endpoint, method), seconds in slowest:
+            lines.append(f'bloodsite_slowest_statement_seconds{_labels({"endpoint": endpoint, "method": method})} '
+                         f'{round(seconds, 6)}')
+        lines += ['# HELP bloodsite_responses_total Responses sent per endpoint and status',
+                  '# TYPE bloodsite_responses_total counter']
+        for (endpoint, method, status), count in responses:
+            labels = {"endpoint": endpoint, "method": method, "status": status}
+            lines.append(f'bloodsite_responses_total{_labels(labels)} {count}')
+        for name, (kind, help_text, value) in (extra or {}).items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            if isinstance(value, list):
+                lines += [f'{name}{_labels(labels)} {sample}' for labels, sample in value]
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_metrics' in g:
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started or not has_request_context() or 'request_metrics' not in g:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = g.request_metrics
+    stats["queries"] += 1
+    stats["sql"] += elapsed
+    if elapsed >= stats["slowest"]:
+        stats["slowest"] = elapsed
+        stats["slowest_statement"] = statement
+
+
+
+def _handle_error(context):
+    """A failed statement never reaches after_cursor_execute, so drop its start time here"""
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+metrics = RequestMetrics()
@@ -0,0 +1,130 @@
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn
+from bloodapp import db
+from bloodapp.models import Donation, Donor, SchemaVersion
+
+
+def _widen_donor_email():
+    """SQLite never checked the length, so donors were saved with longer
+    emails than the column says, which PostgreSQL would refuse"""
+    if db.engine.dialect.name != 'sqlite':
+        db.session.execute('ALTER TABLE donor ALTER COLUMN email TYPE VARCHAR(120)')
+
+
+def _index_ties_by_id():
+    """The eligibility and expiry indexes end in the id, so PostgreSQL can
+    read ties in id order from them rather than sorting them. SQLite's
+    indexes always ended in it, so there this only rebuilds them"""
+    for table in (Donor.__table__, Donation.__table__):
+        for index in table.indexes:
+            if index.name in ('ix_donor_blood_eligible', 'ix_donor_plasma_eligible', 'ix_donation_expiry'):
+                db.session.execute(f'DROP INDEX IF EXISTS {index.name}')
+                index.create(db.session.connection())
+
+
+def _drop_donation_type_date():
+    """ix_donation_expiry replaced the index withdrawals used to read units
+    oldest first by. Databases from before it still have the old one, which
+    costs every donation and withdrawal a write for nothing"""
+    db.session.execute('DROP INDEX IF EXISTS ix_donation_type_date')
+
+
+def _intake_keys_per_employee():
+    """Batch intake keys used to be unique across every employee. The index
+    that keeps them unique for each one is added with the other missing
+    indexes, so this only drops the old one"""
+    db.session.execute('DROP INDEX IF EXISTS ix_intake_key_key')
+
+
+# Changes that adding the missing tables, columns and indexes cannot make,
+# oldest first. Each one runs once per database and is recorded in
+# schema_version. New ones go on the end, and one that has shipped is never
+# changed. A database created from the models already has all of them
+STEPS = [
+    (1, 'Donor emails up to 120 characters', _widen_donor_email),
+    (2, 'Eligibility and expiry indexes end in the id', _index_ties_by_id),
+    (3, 'Drop the donation type and date index', _drop_donation_type_date),
+    (4, 'Batch intake keys unique for each employee', _intake_keys_per_employee),
+]
+
+
+def version(engine=None):
+    """Returns:
+        int: The last step made to a database, 0 for none, None if it has never been upgraded"""
+    engine = engine or db.engine
+    if SchemaVersion.__tablename__ not in inspect(engine).get_table_names():
+        return None
+    table = SchemaVersion.__table__
+    return engine.execute(db.select([db.func.max(table.c.version)])).scalar() or 0
+
+
+def upgrade():
+    """Brings a database up to date with the models, on SQLite or PostgreSQL.
+    Missing tables are created, missing columns are added to the tables that
+    are there, then any index declared on a model that the database does not
+    have yet is added, then the donor search index on SQLite. New eligibility
+    and expiry columns and a new rollup table are filled in from history, and
+    a new ledger starts from the inventory as it is. Then the numbered STEPS
+    this database has not had are made. Running it again does nothing
+    Returns:
+        list: The names of the tables, columns, indexes and steps that were created"""
+    created = []
+    existing_tables = set(inspect(db.engine).get_table_names())
+    # A new database has nothing to fill in and is built with every step made
+    empty = not existing_tables
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(db.engine)
+            created.append(table.name)
+            continue
+        existing_columns = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+                created.append(f'{table.name}.{column.name}')
+        existing_indexes = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing_indexes:
+                index.create(db.engine)
+                created.append(index.name)
+    if not empty:
+        _backfill(created)
+    if db.engine.dialect.name == 'sqlite':
+        from bloodapp import search
+        try:
+            if search.install():
+                created.append('donor_search')
+        except OperationalError as e:
+            db.session.rollback()
+            current_app.logger.warning(f'donor_search was not created, search will scan the donor table: {e}')
+    done = {row.version for row in SchemaVersion.query}
+    for number, name, step in STEPS:
+        if number in done:
+            continue
+        if not empty:
+            step()
+        db.session.add(SchemaVersion(version=number, name=name))
+        db.session.commit()
+        created.append(f'schema version {number} ({name})')
+    return created
+
+
+def _backfill(created):
+    """Fills in what was just added to a database that already had data"""
+    if 'donor.next_blood_eligible' in created or 'donor.next_plasma_eligible' in created:
+        from bloodapp import eligibility
+        eligibility.backfill()
+    if 'donation.expires' in created:
+        from bloodapp import expiry
+        expiry.backfill()
+    if 'ledger_event' in created:
+        from bloodapp import inventory, ledger
+        if 'inventory' in created:
+            inventory.rebuild()
+        ledger.open_from_inventory()
+    if 'donation_rollup' in created:
+        from bloodapp import analytics
+        analytics.backfill()
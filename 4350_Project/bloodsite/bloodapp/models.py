@@ -1,11 +1,14 @@
 from datetime import datetime
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from bloodapp import db, loginManager, app
+from flask import current_app
+from bloodapp import db, loginManager
 from flask_login import UserMixin
+from sqlalchemy import DDL, event
+from bloodapp.staffcache import staff_cache
 
 @loginManager.user_loader
 def load_user(staff_id):
-    return Staff.query.get(int(staff_id))
+    return staff_cache.load(Staff, int(staff_id))
 
 class Staff(db.Model, UserMixin):
     """This is the model for the Staff:
@@ -24,9 +27,11 @@ class Staff(db.Model, UserMixin):
     role = db.Column(db.String(25))
     location = db.Column(db.String(25), nullable=False)
 
+    __table_args__ = (db.Index('ix_staff_email', 'email', unique=True),)
+
     def get_reset_token(self, expires_sec=1800):
         """Generates a token for an employee"""
-        s = Serializer(app.config['SECRET_KEY'], expires_sec)
+        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
         return s.dumps({'user_id': self.id}).decode('utf-8')
 
     @staticmethod
@@ -34,7 +39,7 @@ class Staff(db.Model, UserMixin):
         """Verifies a token for an employee
         Args:
             token(str): the token"""
-        s = Serializer(app.config['SECRET_KEY'])
+        s = Serializer(current_app.config['SECRET_KEY'])
         try:
             staff_id = s.loads(token)['staff_id']
         except:
@@ -52,6 +57,9 @@ class Donor(db.Model):
        last_name (str): the last name
        last_blood_donation_date (date): the last time they donated blood
        last_plasma_donation_date (date): the last time they donated plasma
+       next_blood_eligible (date): when they may next donate blood
+       next_plasma_eligible (date): when they may next donate plasma
+       location (str): The branch they registered or last donated at
        blood_type(str): Their blood type
        age (int): their age
        email (str): Their email address """
@@ -59,11 +67,23 @@ class Donor(db.Model):
     blood_type = db.Column(db.String(10), nullable=False)
     last_blood_donation_date = db.Column(db.DateTime)
     last_plasma_donation_date = db.Column(db.DateTime)
-    email = db.Column(db.String(30))
+    next_blood_eligible = db.Column(db.DateTime, default=datetime.now)
+    next_plasma_eligible = db.Column(db.DateTime, default=datetime.now)
+    location = db.Column(db.String(25))
+    email = db.Column(db.String(120))
     first_name = db.Column(db.String(20), nullable=False)
     last_name = db.Column(db.String(20), nullable=False)
     age = db.Column(db.Integer, nullable=False)
-    
+
+    # "Who can give O- blood at Denton today" is one range scan of these,
+    # in the order the recall export pages through them. SQLite would end
+    # them in the row id anyway, PostgreSQL needs it named
+    __table_args__ = (db.Index('ix_donor_email_name', 'email', 'first_name', 'last_name'),
+                      # Searches under three letters look up the start of a last name
+                      db.Index('ix_donor_last_name', 'last_name', 'first_name', 'id'),
+                      db.Index('ix_donor_blood_eligible', 'blood_type', 'next_blood_eligible', 'location', 'id'),
+                      db.Index('ix_donor_plasma_eligible', 'blood_type', 'next_plasma_eligible', 'location', 'id'))
+
     def __repr__(self):
         return f"Donor('{self.first_name}', '{self.last_name}', '{self.blood_type}')"
 
@@ -75,13 +95,22 @@ class Donation(db.Model):
        blood (bool): if the donation is blood
        plasma (bool): if the donation is plasma
        date (date): The date
-       location (str): The branch the donation is in """
+       location (str): The branch the donation is in
+       expires (date): When the unit goes out of date
+       expired (bool): if the sweep has taken it off the shelf """
     id = db.Column(db.Integer, primary_key=True)
     blood_type = db.Column(db.String(10), nullable=False)
     blood = db.Column(db.Boolean, nullable=False)
     plasma = db.Column(db.Boolean, nullable=False)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     location = db.Column(db.String(25), nullable=False)
+    expires = db.Column(db.DateTime)
+    expired = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    # Withdrawals read the units of one type closest to expiry first, and
+    # the sweep finds the ones past it, both as one range scan of this
+    __table_args__ = (db.Index('ix_donation_expiry', 'blood_type', 'blood', 'plasma', 'expired', 'expires',
+                               'location', 'id'),)
 
     def __repr__(self):
         return f"Post('{self.blood_type},')"
@@ -90,10 +119,238 @@ class Bank(db.Model):
     """This is the model for Bank
     Args:
         location (str): The location of the bank
-        manager_id (int) (FK): This is the id of the manager of the bank"""
+        manager_id (int) (FK): This is the id of the manager of the bank
+        manager (obj): The manager's row from the STAFF table"""
     id = db.Column(db.Integer, primary_key=True)
     location = db.Column(db.String(25), nullable=False)
     manager_id = db.Column(db.Integer, db.ForeignKey('staff.id'), nullable=False)
+    manager = db.relationship('Staff')
+
+    __table_args__ = (db.Index('ix_bank_location', 'location', unique=True),)
 
     def __repr__(self):
         return f"Bank('{self.location},')"
+
+
+class Inventory(db.Model):
+    """This is the running count of units on the shelf, kept up to date by
+    every donation and withdrawal so the withdraw page never has to count
+    the Donation table
+    Args:
+        location (str): The branch the units are in
+        blood_type (str): The blood type of the units
+        blood (bool): if the units are blood
+        plasma (bool): if the units are plasma
+        count (int): How many units are on hand"""
+    id = db.Column(db.Integer, primary_key=True)
+    location = db.Column(db.String(25), nullable=False)
+    blood_type = db.Column(db.String(10), nullable=False)
+    blood = db.Column(db.Boolean, nullable=False)
+    plasma = db.Column(db.Boolean, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('location', 'blood_type', 'blood', 'plasma'),)
+
+    def __repr__(self):
+        return f"Inventory('{self.location}', '{self.blood_type}', '{self.count}')"
+
+
+class BankTarget(db.Model):
+    """This is how many units of a type a branch wants to keep on hand. The
+    rebalancing planner moves units from branches above their targets to
+    branches below them
+    Args:
+        location (str): The branch
+        blood_type (str): The blood type of the units
+        blood (bool): if the units are blood
+        plasma (bool): if the units are plasma
+        target (int): How many units the branch wants"""
+    id = db.Column(db.Integer, primary_key=True)
+    location = db.Column(db.String(25), nullable=False)
+    blood_type = db.Column(db.String(10), nullable=False)
+    blood = db.Column(db.Boolean, nullable=False)
+    plasma = db.Column(db.Boolean, nullable=False)
+    target = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('location', 'blood_type', 'blood', 'plasma'),)
+
+    def __repr__(self):
+        return f"BankTarget('{self.location}', '{self.blood_type}', '{self.target}')"
+
+
+class DonationRollup(db.Model):
+    """This is one day of intake and withdrawals for one branch and blood
+    type, kept up to date as units come in and go out so reports never have
+    to scan the Donation table
+    Args:
+        day (date): The day, in UTC like Donation.date
+        location (str): The branch
+        blood_type (str): The blood type of the units
+        kind (str): "blood" or "plasma"
+        donated (int): Units donated that day
+        withdrawn (int): Units shipped out that day"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    location = db.Column(db.String(25), nullable=False)
+    blood_type = db.Column(db.String(10), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    donated = db.Column(db.Integer, nullable=False, default=0)
+    withdrawn = db.Column(db.Integer, nullable=False, default=0)
+
+    # Starts with the day so a date range is one index range scan
+    __table_args__ = (db.UniqueConstraint('day', 'location', 'blood_type', 'kind'),)
+
+    def __repr__(self):
+        return f"DonationRollup('{self.day}', '{self.location}', '{self.blood_type}', '{self.kind}')"
+
+
+class Shipment(db.Model):
+    """This is the record of a withdraw that was shipped out
+    Args:
+        blood_type (str): The blood type that was shipped
+        blood (bool): if the shipment is blood
+        plasma (bool): if the shipment is plasma
+        requested (int): The number of units requested, empty when all units were requested. When
+            compatible types filled the request, each of their shipments has the whole request
+        units (int): The number of units actually shipped
+        date (date): The date
+        staff_id (int) (FK): The employee that made the withdraw
+        substitute_for (str): The blood type requested, when these units are a compatible type sent in its place"""
+    id = db.Column(db.Integer, primary_key=True)
+    blood_type = db.Column(db.String(10), nullable=False)
+    blood = db.Column(db.Boolean, nullable=False)
+    plasma = db.Column(db.Boolean, nullable=False)
+    requested = db.Column(db.Integer)
+    units = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    staff_id = db.Column(db.Integer, db.ForeignKey('staff.id'))
+    substitute_for = db.Column(db.String(10))
+
+    def __repr__(self):
+        return f"Shipment('{self.blood_type}', '{self.units}')"
+
+
+class LedgerEvent(db.Model):
+    """This is one change to the stock, kept forever. Rows are only ever
+    inserted, in id order, so the table is the full history even though
+    shipped and expired Donation rows go away
+    Args:
+        at (date): When it happened
+        event (str): "donated", "shipped" or "expired"
+        location (str): The branch
+        blood_type (str): The blood type of the units
+        blood (bool): True for blood, False for plasma
+        units (int): The change in stock, negative when units left
+        donation_id (int): The donation, for "donated" events"""
+    id = db.Column(db.Integer, primary_key=True)
+    at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    event = db.Column(db.String(10), nullable=False)
+    location = db.Column(db.String(25), nullable=False)
+    blood_type = db.Column(db.String(10), nullable=False)
+    blood = db.Column(db.Boolean, nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    donation_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f"LedgerEvent('{self.event}', '{self.location}', '{self.blood_type}', '{self.units}')"
+
+
+# The database refuses to change or remove ledger rows once they are written
+for _action in ('UPDATE', 'DELETE'):
+    event.listen(LedgerEvent.__table__, 'after_create', DDL(
+        f"CREATE TRIGGER ledger_event_no_{_action.lower()} BEFORE {_action} ON ledger_event "
+        f"BEGIN SELECT RAISE(ABORT, 'the ledger is append only'); END").execute_if(dialect='sqlite'))
+event.listen(LedgerEvent.__table__, 'after_create', DDL(
+    "CREATE OR REPLACE FUNCTION ledger_event_append_only() RETURNS trigger AS $$ "
+    "BEGIN RAISE EXCEPTION 'the ledger is append only'; END; $$ LANGUAGE plpgsql; "
+    "CREATE TRIGGER ledger_event_append_only BEFORE UPDATE OR DELETE ON ledger_event "
+    "FOR EACH ROW EXECUTE PROCEDURE ledger_event_append_only()").execute_if(dialect='postgresql'))
+
+
+class InventorySnapshot(db.Model):
+    """This is the stock at every branch as of one ledger event, so the stock
+    at any time can be worked out from the snapshot before it and the events
+    after it instead of the whole ledger
+    Args:
+        last_event_id (int): The last ledger event counted in
+        taken (date): When the snapshot was taken
+        counts (str): JSON list of [location, blood_type, blood, units]
+        opening (bool): if it is the stock a database already had when the ledger started"""
+    id = db.Column(db.Integer, primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False)
+    taken = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    counts = db.Column(db.Text, nullable=False)
+    opening = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (db.Index('ix_inventory_snapshot_taken', 'taken'),)
+
+    def __repr__(self):
+        return f"InventorySnapshot('{self.taken}', '{self.last_event_id}')"
+
+
+class IntakeKey(db.Model):
+    """This is the result of one donation sent to the batch intake, kept under
+    the key the drive gave it, so sending the same donation again gets the
+    same answer instead of a second donation. Keys are only unique for each
+    employee, so two drives picking the same key do not collide
+    Args:
+        key (str): The key the drive made up for the donation
+        staff_id (int) (FK): The employee that sent it
+        fingerprint (str): A hash of the donor, kind and time sent with the key,
+            to tell a resent donation from a different one under the same key
+        received (date): When it first arrived
+        result (str): JSON of what happened to it"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False)
+    staff_id = db.Column(db.Integer, db.ForeignKey('staff.id'))
+    fingerprint = db.Column(db.String(40))
+    received = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    result = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (db.Index('ix_intake_key_staff_key', 'staff_id', 'key', unique=True),
+                      db.Index('ix_intake_key_received', 'received'))
+
+    def __repr__(self):
+        return f"IntakeKey('{self.key}', '{self.received}')"
+
+
+class SchemaVersion(db.Model):
+    """This is one numbered schema change that has been made to this database,
+    see migrations.STEPS
+    Args:
+        version (int): The step's number
+        name (str): What it changed
+        applied (date): When it was made"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"SchemaVersion('{self.version}', '{self.name}')"
+
+
+class OutboxMessage(db.Model):
+    """This is an email waiting to be sent by the outbox worker
+    Args:
+        subject (str): The subject line
+        sender (str): The from address
+        recipients (str): The to addresses, separated by commas
+        body (str): The text of the email
+        attempts (int): How many times sending has failed
+        next_attempt (date): The earliest time the worker will try it again
+        sent (date): When it was sent, empty while it is still queued
+        last_error (str): Why the last attempt failed"""
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(100), nullable=False)
+    sender = db.Column(db.String(50), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent = db.Column(db.DateTime)
+    last_error = db.Column(db.String(200))
+
+    __table_args__ = (db.Index('ix_outbox_pending', 'sent', 'next_attempt'),)
+
+    def __repr__(self):
+        return f"OutboxMessage('{self.subject}', '{self.recipients}')"
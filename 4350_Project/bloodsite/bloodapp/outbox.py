@@ -0,0 +1,126 @@
+import smtplib
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from bloodapp import db, mail
+from bloodapp.models import OutboxMessage
+
+
+def enqueue(msg):
+    """Queues an email for the outbox worker instead of sending it in the request.
+    This only adds to the session, the caller commits with the rest of its work
+    Args:
+        msg (obj): A flask_mail Message"""
+    db.session.add(OutboxMessage(subject=msg.subject, sender=msg.sender,
+                                 recipients=','.join(msg.recipients), body=msg.body))
+
+
+def enqueue_many(msgs):
+    """Queues many emails with a single executemany INSERT.
+    The caller commits with the rest of its work
+    Args:
+        msgs (list): flask_mail Messages"""
+    rows = [{"subject": msg.subject, "sender": msg.sender, "recipients": ','.join(msg.recipients),
+             "body": msg.body, "attempts": 0, "next_attempt": datetime.utcnow()} for msg in msgs]
+    if rows:
+        db.session.execute(OutboxMessage.__table__.insert(), rows)
+
+
+def _pending():
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    return OutboxMessage.query.filter(OutboxMessage.sent == None,
+                                      OutboxMessage.attempts < max_attempts)
+
+
+def queue_depth():
+    """Returns:
+        int: The number of emails still waiting to be sent"""
+    return _pending().count()
+
+
+def failed_count():
+    """Returns:
+        int: The number of emails the worker gave up on"""
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    return OutboxMessage.query.filter(OutboxMessage.sent == None,
+                                      OutboxMessage.attempts >= max_attempts).count()
+
+
+def _retry_later(item, error, now):
+    """Pushes an email back with an exponential backoff"""
+    item.attempts += 1
+    item.last_error = str(error)[:200]
+    delay = current_app.config['OUTBOX_RETRY_SECONDS'] * 2 ** (item.attempts - 1)
+    item.next_attempt = now + timedelta(seconds=delay)
+
+
+def _next_due(now):
+    """Locks the email that has waited longest. On PostgreSQL emails another
+    worker has locked are passed over, the way withdrawals pass over units"""
+    return _pending().filter(OutboxMessage.next_attempt <= now) \
+        .order_by(OutboxMessage.next_attempt, OutboxMessage.id) \
+        .with_for_update(skip_locked=True).first()
+
+
+def drain():
+    """Sends up to OUTBOX_BATCH_SIZE due emails over a single SMTP connection.
+    Each email is locked while it is sent and committed as sent straight
+    after, so two workers never send the same email and a worker that dies
+    part way through a batch only sends the one it was on again. If the
+    server hangs up, the email in hand is sent again over a new connection,
+    once a batch, rather than every email left failing on the dead one
+    Returns:
+        int: The number of emails sent"""
+    now = datetime.utcnow()
+    item = _next_due(now)
+    if item is None:
+        db.session.commit()
+        return 0
+    sent = tried = 0
+    reconnected = False
+    while item is not None:
+        try:
+            with mail.connect() as conn:
+                while item is not None:
+                    msg = Message(item.subject, sender=item.sender,
+                                  recipients=item.recipients.split(','), body=item.body)
+                    try:
+                        conn.send(msg)
+                        item.sent = datetime.utcnow()
+                        sent += 1
+                    except smtplib.SMTPServerDisconnected:
+                        raise
+                    except Exception as e:
+                        _retry_later(item, e, now)
+                    db.session.commit()
+                    tried += 1
+                    item = _next_due(now) if tried < current_app.config['OUTBOX_BATCH_SIZE'] else None
+        except smtplib.SMTPServerDisconnected as e:
+            if reconnected and item is not None:
+                # Dropped twice, the rest of the batch waits for the next drain
+                _retry_later(item, e, now)
+                break
+            reconnected = True
+        except Exception as e:
+            # Connecting failed, so only the email in hand is pushed back
+            if item is not None:
+                _retry_later(item, e, now)
+            break
+    db.session.commit()
+    return sent
+
+
+def work(once=False):
+    """Drains the outbox until stopped, sleeping when nothing is due
+    Args:
+        once (bool): Stop as soon as nothing is due"""
+    while True:
+        sent = drain()
+        if sent:
+            current_app.logger.info(f'Outbox sent {sent} emails, {queue_depth()} waiting')
+            continue
+        if once:
+            return
+        db.session.remove()
+        time.sleep(current_app.config['OUTBOX_POLL_SECONDS'])
@@ -0,0 +1,39 @@
+from flask import current_app
+from bloodapp import db, bcrypt
+from bloodapp.staffcache import staff_cache
+
+
+def hash_password(password):
+    """Hashes a password at the configured BCRYPT_LOG_ROUNDS cost
+    Args:
+        password (str): The plain text password
+    Returns:
+        str: The bcrypt hash"""
+    rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+    return bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+
+def hash_cost(hashed):
+    """Reads the cost out of a bcrypt hash such as $2b$12$...
+    Args:
+        hashed (str): The bcrypt hash
+    Returns:
+        int: The log rounds the hash was made with"""
+    return int(hashed.split('$')[2])
+
+
+def check_password(staff, password):
+    """Checks an employee's password. When it matches and the stored hash was made
+    at a different cost than BCRYPT_LOG_ROUNDS, the hash is remade at the current cost
+    Args:
+        staff (obj): This is an employee from the STAFF table
+        password (str): The password they typed
+    Returns:
+        bool: True if the password is right"""
+    if not bcrypt.check_password_hash(staff.password, password):
+        return False
+    if hash_cost(staff.password) != current_app.config['BCRYPT_LOG_ROUNDS']:
+        staff.password = hash_password(password)
+        db.session.commit()
+        staff_cache.invalidate(staff.id)
+    return True
@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from bloodapp import db
+
+
+class QueryCounter:
+    """Records every SQL statement sent to the database while it is active
+    Args:
+        statements (list): The SQL of each statement, in the order they ran"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Counts the statements run inside the with block
+    Usage:
+        with count_queries() as counter:
+            client.get('/CreateBank')
+        counter.count"""
+    counter = QueryCounter()
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._record)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fails if the with block runs more than limit SQL statements
+    Args:
+        limit (int): The most statements the block may run"""
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        listing = '\n'.join(counter.statements)
+        raise AssertionError(f'{counter.count} queries ran, at most {limit} expected:\n{listing}')
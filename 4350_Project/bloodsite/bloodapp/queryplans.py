@@ -0,0 +1,77 @@
+import datetime
+from bloodapp import db, eligibility, expiry, search
+from bloodapp.models import Donor, Staff, Donation, Bank, Inventory, DonationRollup, IntakeKey
+
+
+def hot_queries():
+    """The lookups the routes and form validators run on every request.
+    Returns:
+        list: (where it runs, query) pairs"""
+    return [
+        ("LoadDonor by id", Donor.query.filter_by(id=1)),
+        ("LoadDonor by name and email",
+            Donor.query.filter_by(first_name="jon", last_name="doe", email="jondoe@yahoo.com")),
+        ("CreateDonorForm.validate_email", Donor.query.filter_by(email="jondoe@yahoo.com")),
+        ("login / reset_request / employee forms", Staff.query.filter_by(email="jimmy@gmail.com")),
+        ("BankForm.validate_location", Bank.query.filter_by(location="Denton")),
+        ("withdraw units closest to expiry",
+            expiry.usable_units("O-", True, False, None, datetime.datetime(2021, 1, 1)).limit(10)),
+        ("withdraw units closest to expiry at Denton",
+            expiry.usable_units("O-", True, False, "Denton", datetime.datetime(2021, 1, 1)).limit(10)),
+        ("expiry sweep",
+            db.session.query(Donation.id, Donation.location)
+            .filter(Donation.blood_type == "O-", Donation.blood == True, Donation.plasma == False,
+                    Donation.expired == False, Donation.expires <= datetime.datetime(2021, 1, 1)).limit(1000)),
+        ("eligible O- blood donors at Denton",
+            eligibility.eligible_query("O-", "blood", "Denton", datetime.datetime(2021, 1, 1)).limit(20)),
+        ("eligible O- plasma donors",
+            eligibility.eligible_query("O-", "plasma", None, datetime.datetime(2021, 1, 1)).limit(20)),
+        ("donation rollups for a month",
+            db.session.query(DonationRollup.day, DonationRollup.blood_type, DonationRollup.donated)
+            .filter(DonationRollup.day >= datetime.date(2021, 1, 1), DonationRollup.day <= datetime.date(2021, 1, 31))),
+        ("inventory adjust",
+            Inventory.query.filter_by(location="Denton", blood_type="O-", blood=True, plasma=False)),
+        ("batch intake keys already seen",
+            IntakeKey.query.filter(IntakeKey.staff_id == 1, IntakeKey.key.in_(["a", "b"]))),
+        ("batch intake donors", Donor.query.filter(Donor.id.in_([1, 2]))),
+        ("SearchDonor under three letters", search.name_starts(["jo", "li"]).limit(20)),
+    ]
+
+
+def explain(query):
+    """Runs EXPLAIN QUERY PLAN for a query on SQLite, or EXPLAIN on PostgreSQL.
+    PostgreSQL happily scans small tables even when there is an index, so
+    scans and sorts are priced out first; one still in the plan means no
+    index can do the job
+    Args:
+        query (obj): A SQLAlchemy query
+    Returns:
+        list: The detail column of every step in the plan, or every line of it on PostgreSQL"""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as connection:
+            connection.execute("SET LOCAL enable_seqscan = off")
+            connection.execute("SET LOCAL enable_sort = off")
+            rows = connection.execute(f"EXPLAIN {compiled}", compiled.params).fetchall()
+        return [row[0].strip() for row in rows]
+    params = [compiled.params[name] for name in compiled.positiontup]
+    rows = db.engine.execute(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def _regressed(step):
+    """A table scan or a sort the index should have saved, in either database's words"""
+    return step.startswith("SCAN") or "TEMP B-TREE" in step \
+        or "Seq Scan" in step or step.lstrip("-> ").startswith(("Sort", "Incremental Sort"))
+
+
+def regressions():
+    """Finds hot queries that the database would answer with a scan or a temporary sort
+    Returns:
+        list: (where it runs, plan) for every query that no longer uses an index"""
+    failed = []
+    for name, query in hot_queries():
+        plan = explain(query)
+        if any(_regressed(step) for step in plan):
+            failed.append((name, plan))
+    return failed
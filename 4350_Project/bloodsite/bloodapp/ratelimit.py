@@ -0,0 +1,171 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+# Takes cost tokens from the bucket at KEYS[1] if it has them. A cost of 0
+# only asks whether it has one. Returns the seconds to wait, as a string
+# since Redis would cut a number down to an integer
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local seconds = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(bucket[1]) or capacity
+local stamp = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - stamp, 0) * capacity / seconds)
+local need = math.max(cost, 1)
+if tokens < need then
+    return tostring((need - tokens) * seconds / capacity)
+end
+if cost > 0 then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'stamp', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(seconds))
+end
+return '0'
+"""
+
+
+class MemoryBackend:
+    """Keeps the buckets in this process. Each worker has its own, so with
+    several workers a client can make up to that many times the attempts.
+    Past size buckets the least recently used is dropped, which is the one
+    most likely to have filled up again anyway
+    Args:
+        size (int): The most buckets to keep
+        clock (function): Returns the time in seconds, time.monotonic by default"""
+
+    def __init__(self, size, clock=time.monotonic):
+        self.size = size
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, seconds, cost):
+        now = self.clock()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * capacity / seconds)
+            need = max(cost, 1)
+            if tokens < need:
+                return (need - tokens) * seconds / capacity
+            if cost:
+                self._buckets[key] = (tokens - cost, now)
+                self._buckets.move_to_end(key)
+                while len(self._buckets) > self.size:
+                    self._buckets.popitem(last=False)
+            return 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBackend:
+    """Keeps the buckets in Redis, or anything that speaks its protocol, so
+    the limits hold across every worker. Each bucket is updated by one Lua
+    script, so two workers cannot both spend its last token. If Redis cannot
+    be reached the attempt is let through rather than locking everyone out
+    Args:
+        url (str): Like redis://localhost:6379/0
+        prefix (str): Put in front of every key"""
+
+    def __init__(self, url, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATELIMIT_BACKEND is "redis" but the redis package is not installed, '
+                               'run "pip install redis" or use the "memory" backend')
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(TAKE_SCRIPT)
+        self._errors = redis.RedisError
+        self._prefix = prefix
+
+    def take(self, key, capacity, seconds, cost):
+        try:
+            return float(self._script(keys=[self._prefix + key], args=[capacity, seconds, cost, time.time()]))
+        except self._errors as e:
+            current_app.logger.warning(f'Rate limit not checked, Redis failed: {e}')
+            return None
+
+    def __len__(self):
+        return 0
+
+
+class NullBackend:
+    """Limits nothing, for tests and for sites behind a proxy that already does"""
+
+    def take(self, key, capacity, seconds, cost):
+        return 0
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    """Token buckets that slow down password guessing and reset email floods.
+    Each rule names a RATELIMIT_<RULE> setting of (attempts, seconds): a
+    bucket holds up to attempts tokens and gets them back evenly over
+    seconds, so a client can make a short burst and then one attempt every
+    seconds / attempts. Every IP address and every email has its own bucket
+    per rule. Routes ask before doing any hashing or mail work, so an
+    attempt that is turned away costs almost nothing"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._allowed = {}
+        self._limited = {}
+        self.errors = 0
+
+    def init_app(self, app):
+        backend = app.config['RATELIMIT_BACKEND']
+        if backend == 'redis':
+            app.extensions['rate_limit'] = RedisBackend(app.config['RATELIMIT_REDIS_URL'],
+                                                        f'{app.config["CACHE_KEY_PREFIX"]}ratelimit:')
+        elif backend == 'memory':
+            app.extensions['rate_limit'] = MemoryBackend(app.config['RATELIMIT_SIZE'])
+        else:
+            app.extensions['rate_limit'] = NullBackend()
+
+    @property
+    def backend(self):
+        return current_app.extensions['rate_limit']
+
+    def _take(self, rule, key, cost):
+        capacity, seconds = current_app.config[f'RATELIMIT_{rule.upper()}']
+        wait = self.backend.take(f'{rule}:{key}', capacity, seconds, cost)
+        with self._lock:
+            if wait is None:
+                self.errors += 1
+            elif wait:
+                self._limited[rule] = self._limited.get(rule, 0) + 1
+            elif cost:
+                self._allowed[rule] = self._allowed.get(rule, 0) + 1
+        return math.ceil(wait) if wait else 0
+
+    def hit(self, rule, key):
+        """Spends one attempt from a bucket
+        Args:
+            rule (str): The rule, like "login_per_ip"
+            key (str): Whose bucket, like the IP address or email
+        Returns:
+            int: 0 if the attempt may go ahead, otherwise the seconds until it could"""
+        return self._take(rule, key, 1)
+
+    def check(self, rule, key):
+        """Like hit() but spends nothing, for buckets only charged when an
+        attempt fails
+        Returns:
+            int: 0 if there is an attempt left, otherwise the seconds until there is"""
+        return self._take(rule, key, 0)
+
+    def stats(self):
+        """Returns:
+            dict: allowed and limited, each {rule: count}, errors, and the buckets in this process"""
+        with self._lock:
+            return {"allowed": dict(self._allowed), "limited": dict(self._limited), "errors": self.errors,
+                    "size": len(self.backend)}
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,86 @@
+import heapq
+from bloodapp import db
+from bloodapp.models import BankTarget, Inventory
+
+
+def _kind(blood):
+    return 'blood' if blood else 'plasma'
+
+
+def plan(counts, targets):
+    """Works out which transfers bring every branch up to its target, using
+    as few transfers as it can. For each blood type and kind the branch
+    furthest below target is filled from the branch furthest above it, over
+    and over, with a heap on each side. Every transfer empties a surplus or
+    fills a shortage, so there are fewer transfers than branches involved.
+    Branches without a target for a type neither give nor receive it
+    Args:
+        counts (dict): {(location, blood_type, blood, plasma): units on hand}
+        targets (dict): {(location, blood_type, blood, plasma): units wanted}
+    Returns:
+        dict: {"transfers": [{"from", "to", "blood_type", "kind", "units"}],
+        "unmet": [{"location", "blood_type", "kind", "units"}]} where unmet is
+        what is still short after every surplus has been used"""
+    groups = {}
+    for key, target in targets.items():
+        location, blood_type, blood, plasma = key
+        difference = counts.get(key, 0) - target
+        if difference == 0:
+            continue
+        surplus, shortage = groups.setdefault((blood_type, blood, plasma), ([], []))
+        if difference > 0:
+            surplus.append((-difference, location))
+        else:
+            shortage.append((difference, location))
+    transfers = []
+    unmet = []
+    for (blood_type, blood, plasma), (surplus, shortage) in sorted(groups.items()):
+        heapq.heapify(surplus)
+        heapq.heapify(shortage)
+        while surplus and shortage:
+            spare, giver = heapq.heappop(surplus)
+            need, taker = heapq.heappop(shortage)
+            units = min(-spare, -need)
+            transfers.append({"from": giver, "to": taker, "blood_type": blood_type,
+                              "kind": _kind(blood), "units": units})
+            if -spare > units:
+                heapq.heappush(surplus, (spare + units, giver))
+            if -need > units:
+                heapq.heappush(shortage, (need + units, taker))
+        for need, taker in sorted(shortage):
+            unmet.append({"location": taker, "blood_type": blood_type, "kind": _kind(blood), "units": -need})
+    return {"transfers": transfers, "unmet": unmet}
+
+
+def plan_transfers(session=None):
+    """Plans the transfers for the current inventory and targets
+    Args:
+        session (obj): The session to read with, db.session by default
+    Returns:
+        dict: The plan, see plan()"""
+    session = session or db.session
+    key = (Inventory.location, Inventory.blood_type, Inventory.blood, Inventory.plasma)
+    counts = {tuple(row[:4]): row[4] for row in session.query(*key, Inventory.count)}
+    key = (BankTarget.location, BankTarget.blood_type, BankTarget.blood, BankTarget.plasma)
+    targets = {tuple(row[:4]): row[4] for row in session.query(*key, BankTarget.target)}
+    return plan(counts, targets)
+
+
+def set_target(location, blood_type, blood, plasma, target):
+    """Sets or clears how many units of a type a branch wants to keep.
+    The caller commits
+    Args:
+        location (str): The branch
+        blood_type (str): The blood type
+        blood (bool): if it is blood
+        plasma (bool): if it is plasma
+        target (int): The units wanted, None to remove the target"""
+    row = BankTarget.query.filter_by(location=location, blood_type=blood_type, blood=blood, plasma=plasma).first()
+    if target is None:
+        if row is not None:
+            db.session.delete(row)
+        return
+    if row is None:
+        row = BankTarget(location=location, blood_type=blood_type, blood=blood, plasma=plasma)
+        db.session.add(row)
+    row.target = target
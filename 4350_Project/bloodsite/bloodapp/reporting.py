@@ -0,0 +1,248 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request, session
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+# Requests that may write. After one, the user's reports stay on the main
+# database until the replica has caught up with it
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where each process only keeps its own threads from copying at once
+    fcntl = None
+
+
+@contextmanager
+def _file_lock(path):
+    """Holds an exclusive lock on path, so processes sharing the snapshot
+    copy one at a time. The lock goes with the process if it dies"""
+    with open(path, 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+class SnapshotReplica:
+    """A copy of the SQLite file made with the online backup API. A report
+    that finds it older than max_staleness seconds starts a new copy on a
+    background thread and reads the main database until the copy is in place
+    Args:
+        source (str): The path of the main database
+        path (str): Where the copy is kept
+        max_staleness (int): The oldest, in seconds, a copy may be and still be read"""
+
+    def __init__(self, source, path, max_staleness):
+        self.source = source
+        self.path = path
+        self.max_staleness = max_staleness
+        self.refreshes = 0
+        # Held while this process copies, so it only runs one copy at a time
+        self._lock = threading.Lock()
+        # A new connection for every session, so each one opens whichever
+        # copy is current. Nothing ever changes a copy once it is in place,
+        # so SQLite can skip locking it
+        self.engine = create_engine('sqlite://', creator=self._connect, poolclass=NullPool)
+
+    def _connect(self):
+        return sqlite3.connect(f'file:{self.path}?immutable=1', uri=True, check_same_thread=False)
+
+    def taken(self):
+        """Returns:
+            float: When the copy was taken, as a timestamp, None if there is none yet"""
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _fresh(self):
+        taken = self.taken()
+        return taken is not None and time.time() - taken <= self.max_staleness
+
+    def _copy(self):
+        """Copies the main database. In WAL mode the copy is a single read
+        transaction, so writers carry on while it runs. It is written beside
+        the old copy and renamed over it, so readers get one or the other and
+        never half of each
+        Returns:
+            float: When the copy was taken"""
+        started = time.time()
+        partial = f'{self.path}.{os.getpid()}-{threading.get_ident()}'
+        try:
+            source = sqlite3.connect(self.source, timeout=30)
+            copy = sqlite3.connect(partial)
+            try:
+                source.backup(copy)
+                copy.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                copy.close()
+                source.close()
+            # Dated when it started, since everything committed by then is in it
+            os.utime(partial, (started, started))
+            os.replace(partial, self.path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        self.refreshes += 1
+        return started
+
+    def refresh(self):
+        """Copies the main database now, once any copy already running in
+        this or another process has finished
+        Returns:
+            float: When the copy was taken"""
+        with self._lock, _file_lock(f'{self.path}.lock'):
+            return self._copy()
+
+    def refresh_in_background(self, logger):
+        """Starts a copy on its own thread, unless this process is already
+        taking one. Other processes take turns on the lock file, and skip
+        the copy if the one before them left it fresh
+        Args:
+            logger (obj): Where to log a copy that fails
+        Returns:
+            bool: True if this call started a copy"""
+        if not self._lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                with _file_lock(f'{self.path}.lock'):
+                    if not self._fresh():
+                        self._copy()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f'Could not refresh the reporting snapshot: {e}')
+            finally:
+                self._lock.release()
+        threading.Thread(target=run, name='reporting-snapshot', daemon=True).start()
+        return True
+
+    def engine_for(self, since):
+        """The engine to read a copy taken after since. A copy that is too
+        old is never read, a new one is started instead
+        Args:
+            since (float): The user's last write, as a timestamp
+        Returns:
+            tuple: (engine, name of this copy), None to read the main database instead"""
+        taken = self.taken()
+        if taken is None or time.time() - taken > self.max_staleness:
+            self.refresh_in_background(current_app.logger)
+            return None
+        return (self.engine, f'snapshot-{taken}') if taken >= since else None
+
+    def stats(self):
+        taken = self.taken()
+        return {"age": round(time.time() - taken, 3) if taken is not None else -1, "refreshes": self.refreshes}
+
+
+class BindReplica:
+    """A second database kept up to date by something else, like a Postgres
+    streaming replica. There is no telling how far behind it is, so time is
+    cut into periods of max_staleness seconds, and anything cached from it
+    is kept apart by period. A page read from it can then be up to twice
+    max_staleness old
+    Args:
+        url (str): Its database URL
+        max_staleness (int): How far, in seconds, it may fall behind"""
+
+    def __init__(self, url, max_staleness):
+        self.max_staleness = max_staleness
+        self.engine = create_engine(url)
+
+    def engine_for(self, since):
+        """Returns:
+            tuple: (engine, name of this period), None while the replica may not have the user's last write"""
+        period = time.time() // self.max_staleness * self.max_staleness
+        # Everything read this period was written to the replica after since
+        if since > period - self.max_staleness:
+            return None
+        return self.engine, f'replica-{int(period)}'
+
+    def stats(self):
+        return None
+
+
+class Reporting:
+    """Sends report queries to a replica of the database, so long reads do
+    not hold up donation intake. Reports read through db.reporting_session,
+    which asks engine() where to go. Everything else, and every write, uses
+    db.session and the main database. A user who has just written reads the
+    main database until the replica is newer than their write"""
+
+    def init_app(self, app):
+        app.extensions['reporting'] = self._replica(app)
+        app.after_request(_note_write)
+
+    @staticmethod
+    def _replica(app):
+        staleness = app.config['REPORTING_MAX_STALENESS']
+        if staleness <= 0:
+            return None
+        if app.config['REPORTING_DATABASE_URI']:
+            return BindReplica(app.config['REPORTING_DATABASE_URI'], staleness)
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        if not url.drivername.startswith('sqlite') or url.database in (None, '', ':memory:'):
+            return None
+        # Relative to the app, as Flask-SQLAlchemy reads it
+        source = os.path.join(app.root_path, url.database)
+        path = app.config['REPORTING_SNAPSHOT_PATH'] or f'{os.path.splitext(source)[0]}-snapshot.db'
+        return SnapshotReplica(source, path, staleness)
+
+    @property
+    def replica(self):
+        return current_app.extensions.get('reporting')
+
+    def _choose(self):
+        """Returns:
+            tuple: (engine, name), with no engine for the main database. It
+            is decided once per request, so a page reads one copy"""
+        replica = self.replica
+        if replica is None:
+            return None, 'primary'
+        if not has_request_context():
+            return replica.engine_for(0) or (None, 'primary')
+        if 'reporting' not in g:
+            g.reporting = replica.engine_for(session.get('last_write', 0)) or (None, 'primary')
+        return g.reporting
+
+    def engine(self):
+        """Returns:
+            obj: The replica engine reports should read right now, None for the main database"""
+        return self._choose()[0]
+
+    def source(self):
+        """Returns:
+            str: "primary" or the name of the replica copy, to keep what is
+            cached from each copy apart. A fragment built from an old copy is
+            never served once there is a newer one"""
+        return self._choose()[1]
+
+    def refresh(self):
+        """Takes a new snapshot now
+        Returns:
+            bool: False if the replica is not a snapshot"""
+        if not isinstance(self.replica, SnapshotReplica):
+            return False
+        self.replica.refresh()
+        return True
+
+    def stats(self):
+        """Returns:
+            dict: The snapshot's age in seconds and how often this process took one, None without a snapshot"""
+        return self.replica.stats() if self.replica is not None else None
+
+
+def _note_write(response):
+    if request.method in WRITE_METHODS:
+        session['last_write'] = time.time()
+    return response
+
+
+reporting = Reporting()
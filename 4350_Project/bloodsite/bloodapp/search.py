@@ -0,0 +1,278 @@
+import itertools
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.exc import OperationalError
+from bloodapp import db
+from bloodapp.models import Donor
+
+# Donor names and emails indexed by every three letter run, so any piece of
+# a name at least three letters long can be looked up without scanning the
+# donor table. The triggers keep it in step with every insert, update and
+# delete, whether it comes from createDonor, UpdateDonor or a bulk import
+INDEX_DDL = [
+    """CREATE VIRTUAL TABLE donor_search USING fts5(
+        first_name, last_name, email, content='donor', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER donor_search_insert AFTER INSERT ON donor BEGIN
+        INSERT INTO donor_search(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END""",
+    """CREATE TRIGGER donor_search_delete AFTER DELETE ON donor BEGIN
+        INSERT INTO donor_search(donor_search, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+    END""",
+    """CREATE TRIGGER donor_search_update AFTER UPDATE OF first_name, last_name, email ON donor BEGIN
+        INSERT INTO donor_search(donor_search, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+        INSERT INTO donor_search(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END""",
+]
+
+PER_PAGE = 20
+# bm25 has to score every match before it can sort, which is far too slow
+# when a search like "smith" matches tens of thousands of donors. Matches are
+# read in donor id order instead, and only ranked when there are few of them
+RANK_LIMIT = 200
+FUZZY_CANDIDATES = 200
+
+
+def has_index():
+    """Returns:
+        bool: True if the database has the donor_search index"""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'donor_search'")).first() is not None
+
+
+def install():
+    """Creates the donor_search index and its triggers if they are missing and
+    fills it from the donor table. Needs SQLite 3.34 or newer for the trigram tokenizer
+    Returns:
+        bool: True if the index was created, False if it was already there"""
+    if has_index():
+        return False
+    for statement in INDEX_DDL:
+        db.session.execute(text(statement))
+    rebuild()
+    return True
+
+
+def rebuild():
+    """Refills donor_search from the donor table"""
+    db.session.execute(text("INSERT INTO donor_search(donor_search) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def _terms(query):
+    return [term for term in query.lower().split() if term]
+
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_prefix(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _pieces(term):
+    """What to look up to find donors a typo away from term: its two
+    overlapping halves, since one typo can only break one of them, and for
+    short words, where a swap breaks every three letter run, each swap of
+    two neighbouring letters"""
+    size = max(3, (len(term) + 1) // 2)
+    pieces = {term[:size], term[-size:]}
+    if len(term) <= 5:
+        pieces.update(term[:i] + term[i + 1] + term[i] + term[i + 2:] for i in range(len(term) - 1))
+    return sorted(pieces)
+
+
+def _starts_with(name):
+    return (f"(donor.first_name LIKE :{name} ESCAPE '\\' OR donor.last_name LIKE :{name} ESCAPE '\\' "
+            f"OR donor.email LIKE :{name} ESCAPE '\\')")
+
+
+def _candidates(match, short_terms, limit, offset=0):
+    """Runs one MATCH against donor_search in donor id order, which lets
+    SQLite stop as soon as it has enough rows
+    Returns:
+        list: (id, first_name, last_name, email, blood_type) rows"""
+    params = {"match": match, "limit": limit, "offset": offset}
+    sql = ("SELECT donor.id, donor.first_name, donor.last_name, donor.email, donor.blood_type "
+           "FROM donor_search JOIN donor ON donor.id = donor_search.rowid WHERE donor_search MATCH :match")
+    for i, term in enumerate(short_terms):
+        params[f'short{i}'] = _like_prefix(term)
+        sql += ' AND ' + _starts_with(f'short{i}')
+    sql += " ORDER BY donor_search.rowid LIMIT :limit OFFSET :offset"
+    return db.session.execute(text(sql), params).fetchall()
+
+
+def _page(rows, page, per_page, total):
+    return Pagination(None, page, per_page, total, rows[(page - 1) * per_page:page * per_page])
+
+
+def prefix_distance(term, word, limit):
+    """The fewest single letter edits, counting a swap of two neighbouring
+    letters as one, that turn term into the start of word, so "jonh" is 1
+    away from "johnson". Gives up once it is past limit
+    Returns:
+        int: The edit distance, or limit + 1 if it is more than limit"""
+    if word.startswith(term):
+        return 0
+    before = None
+    previous = list(range(len(term) + 1))
+    best = previous[-1]
+    for i, letter in enumerate(word[:len(term) + limit], 1):
+        current = [i]
+        lowest = i
+        for j, wanted in enumerate(term, 1):
+            cost = previous[j - 1] if letter == wanted else previous[j - 1] + 1
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if before and j > 1 and letter == term[j - 2] and word[i - 2] == wanted and before[j - 2] + 1 < cost:
+                cost = before[j - 2] + 1
+            current.append(cost)
+            if cost < lowest:
+                lowest = cost
+        before, previous = previous, current
+        if current[-1] < best:
+            best = current[-1]
+        if lowest > limit:
+            break
+    return min(best, limit + 1)
+
+
+def _words(row):
+    """The donor's names and the pieces of their email, with any digits
+    dropped so "garcia123" can be compared with "garica"
+    """
+    email = (row.email or '').replace('@', ' ').replace('.', ' ')
+    return [row.first_name, row.last_name] + [word.rstrip('0123456789') for word in email.split()]
+
+
+def _relevance(terms, words):
+    """Whole word matches first, then words that start with a term"""
+    whole = sum(1 for term in terms if term in words)
+    starts = sum(1 for term in terms if any(word.startswith(term) for word in words))
+    return -whole, -starts
+
+
+def _match_pieces(terms, least):
+    """A MATCH for donors that have at least least (1 or 2) of the pieces of
+    every term"""
+    groups = []
+    for term in terms:
+        pieces = [_phrase(piece) for piece in _pieces(term)]
+        if least > 1 and len(pieces) > 1:
+            pieces = ['(' + ' AND '.join(pair) + ')' for pair in itertools.combinations(pieces, 2)]
+        groups.append('(' + ' OR '.join(pieces) + ')')
+    return ' AND '.join(groups)
+
+
+def _fuzzy(terms, page, per_page):
+    """Finds donors within a typo or two of every term. Candidates come from
+    the index by matching a piece of each term, then are checked and ordered
+    by how many edits they needed. Donors sharing two pieces of every term
+    are taken before those sharing one, so a common piece like "smi" cannot
+    fill the candidates with donors nowhere near the term. Scoring every
+    match with bm25 would rank them too, but takes twice as long"""
+    rows = _candidates(_match_pieces(terms, 2), [], FUZZY_CANDIDATES)
+    if len(rows) < FUZZY_CANDIDATES:
+        seen = {row.id for row in rows}
+        rows += [row for row in _candidates(_match_pieces(terms, 1), [], FUZZY_CANDIDATES + len(rows))
+                 if row.id not in seen][:FUZZY_CANDIDATES - len(rows)]
+    scored = []
+    distances = {}
+    for row in rows:
+        words = _words(row)
+        total = 0
+        for term in terms:
+            allowed = 1 if len(term) <= 5 else 2
+            distance = allowed + 1
+            for word in words:
+                if (term, word) not in distances:
+                    distances[term, word] = prefix_distance(term, word, allowed)
+                distance = min(distance, distances[term, word])
+            if distance > allowed:
+                break
+            total += distance
+        else:
+            scored.append(((total,) + _relevance(terms, words) + (row.id,), row))
+    scored.sort(key=lambda item: item[0])
+    return _page([row for _, row in scored], page, per_page, len(scored))
+
+
+def _starts(column, term):
+    """column LIKE 'term%' written as a range, which an index on the column
+    can answer on either database. Names are saved lower case"""
+    return and_(column >= term, column < term[:-1] + chr(ord(term[-1]) + 1))
+
+
+def name_starts(terms):
+    """Donors for searches like "li" or "jo s" that are too short for the
+    trigram index: the last term starts the last name and any before it
+    start the first name. They are read from the last name index in the
+    order they are listed, so a common start like "jo" is never sorted
+    Returns:
+        obj: A query of Donor"""
+    conditions = [_starts(Donor.first_name, term) for term in terms[:-1]]
+    return Donor.query.filter(_starts(Donor.last_name, terms[-1]), *conditions) \
+        .order_by(Donor.last_name, Donor.first_name, Donor.id)
+
+
+def _fallback(terms, page, per_page):
+    """Plain LIKE search for databases without the donor_search index, like
+    PostgreSQL. The terms are lower case and LIKE only ignores case on SQLite,
+    so the columns are lowered too"""
+    columns = [func.lower(Donor.first_name), func.lower(Donor.last_name), func.lower(Donor.email)]
+    conditions = [or_(*(column.contains(term, autoescape=True) for column in columns)) for term in terms]
+    return Donor.query.filter(and_(*conditions)).order_by(Donor.last_name, Donor.first_name, Donor.id) \
+        .paginate(page=page, per_page=per_page, error_out=False)
+
+
+def search_donors(query, page=1, per_page=PER_PAGE):
+    """Searches donor names and emails. Every word must appear somewhere in a
+    donor's first name, last name or email; words under three letters must
+    start one of them. A search of only short words is read as the start of a
+    first and last name. When nothing matches exactly, donors a typo or two
+    away are returned instead
+    Args:
+        query (str): What the front desk typed, like "maria gar" or "jonh smith"
+        page (int): The page of results, starting at 1
+        per_page (int): Results per page
+    Returns:
+        tuple: A Pagination of donor rows with id, first_name, last_name,
+        email and blood_type, and how they were found: "ranked",
+        "many" when there were too many matches to rank so they are in donor
+        id order, or "fuzzy" for typo matches"""
+    terms = _terms(query)
+    long_terms = [term for term in terms if len(term) >= 3]
+    short_terms = [term for term in terms if len(term) < 3]
+    if not terms:
+        return Pagination(None, page, per_page, 0, []), 'ranked'
+    if not long_terms:
+        return name_starts(short_terms).paginate(page=page, per_page=per_page, error_out=False), 'ranked'
+    try:
+        index = has_index()
+    except OperationalError:
+        index = False
+    if not index:
+        return _fallback(terms, page, per_page), 'ranked'
+
+    match = ' AND '.join(_phrase(term) for term in long_terms)
+    rows = _candidates(match, short_terms, RANK_LIMIT + 1)
+    if not rows:
+        return _fuzzy(long_terms, page, per_page), 'fuzzy'
+    if len(rows) <= RANK_LIMIT:
+        ranked = sorted(rows, key=lambda row: _relevance(terms, _words(row)) + (row.id,))
+        return _page(ranked, page, per_page, len(rows)), 'ranked'
+    offset = (page - 1) * per_page
+    if offset + per_page >= len(rows):
+        rows = _candidates(match, short_terms, per_page + 1, offset)
+        offset = 0
+    # Only one page past this one is known, so the page links stop there
+    rows = rows[offset:offset + per_page + 1]
+    return Pagination(None, page, per_page, (page - 1) * per_page + len(rows), rows[:per_page]), 'many'
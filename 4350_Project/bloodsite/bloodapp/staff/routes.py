@@ -0,0 +1,144 @@
+from flask import render_template, url_for, flash, redirect, request, Blueprint, make_response
+from flask_login import login_user, current_user, logout_user, login_required
+from bloodapp.forms import RequestResetForm, ResetPasswordForm, CreateEmployeeForm, LoginForm, UpdateEmployeeForm
+from bloodapp.models import Staff
+from bloodapp import db
+from bloodapp import passwords
+from bloodapp.ratelimit import rate_limiter
+from bloodapp.staffcache import staff_cache
+from bloodapp.staff.utils import send_reset_email
+
+staff = Blueprint('staff', __name__)
+
+
+def _email(form):
+    """The email typed into a form, as the key of its rate limit bucket"""
+    return (form.email.data or '').strip().lower()
+
+
+def _too_many(wait, template, **context):
+    """Turns an attempt away with a 429 and the form again
+    Args:
+        wait (int): Seconds until the next attempt is allowed
+        template (str): The page the form is on
+    Returns:
+        obj: The response"""
+    flash(f'Too many attempts, please try again in {wait} seconds', 'warning')
+    response = make_response(render_template(template, **context), 429)
+    response.headers['Retry-After'] = str(wait)
+    return response
+
+
+@staff.route('/logout')
+def logout():
+    """Logs out user"""
+    logout_user()
+    return redirect(url_for('staff.login'))
+
+
+@staff.route("/reset_password", methods=["GET", "POST"])
+def reset_request():
+    """An employee requests a password reset token. Too many requests from
+    one address or for one email are turned away with a 429 before any
+    email is queued"""
+    if current_user.is_authenticated:
+        return redirect('/home')
+    form = RequestResetForm()
+    if request.method == 'POST':
+        # Before the form looks the email up, so the limits also slow down
+        # anyone fishing for which emails have accounts
+        wait = rate_limiter.hit('reset_per_ip', request.remote_addr) or \
+            rate_limiter.hit('reset_per_email', _email(form))
+        if wait:
+            return _too_many(wait, 'reset_request.html', title='Reset Password', form=form)
+    if form.validate_on_submit():
+        staff = Staff.query.filter_by(email=form.email.data).first()
+        send_reset_email(staff)
+        db.session.commit()
+        flash('An email has been sent with instructions to reset your password.', 'info')
+        return redirect(url_for('staff.login'))
+    return render_template('reset_request.html', title='Reset Password',
+                           form=form)
+
+@staff.route("/reset_password/<token>", methods=['GET', 'POST'])
+def reset_token(token):
+    """This is where an employee can change their password using the token"""
+    if current_user.is_authenticated:
+        return redirect(url_for('donors.LoadDonor'))
+    staff = Staff.verify_reset_token(token)
+    if staff is None:
+        flash('That is an invalid or expired token', 'warning')
+        return redirect(url_for('staff.reset_request'))
+    form = ResetPasswordForm()
+    if form.validate_on_submit():
+        hashed_password = passwords.hash_password(form.password.data)
+        staff.password = hashed_password
+        db.session.commit()
+        staff_cache.invalidate(staff.id)
+        flash('Your password has been updated! You are now able to log in', 'success')
+        return redirect(url_for('staff.login'))
+    return render_template('reset_token.html', title='Reset Password', form=form)
+
+
+@staff.route('/register', methods=["GET", "POST"])
+def createEmployee():
+    """This is the page where the employee can register"""
+    form = CreateEmployeeForm()
+    if form.validate_on_submit():
+        hashed_password = passwords.hash_password(form.password.data)
+        staff = Staff(first_name=form.first_name.data, last_name=form.last_name.data, password=hashed_password,
+                    email=form.email.data, role=form.role.data, location=form.location.data)
+        db.session.add(staff)
+        db.session.commit()
+        flash(f'Employee Added To Database', category='Success')
+        return redirect(url_for('staff.login'))
+    return render_template('new_employee.html', title="Register", form=form)
+
+@staff.route('/account', methods=["GET", "POST"])
+@login_required
+def UpdateEmployee():
+    """This allows the logged in user to update their account"""
+    staff = current_user
+    form = UpdateEmployeeForm()
+    if form.validate_on_submit():
+        staff.first_name=form.first_name.data.lower()
+        staff.last_name=form.last_name.data.lower()
+        staff.email=form.email.data
+        staff.location=form.location.data
+        db.session.commit()
+        staff_cache.invalidate(staff.id)
+        flash(f'Employee Updated', category='Success')
+    elif request.method == 'GET':
+        form.first_name.data=staff.first_name.capitalize()
+        form.last_name.data=staff.last_name.capitalize()
+        form.email.data=staff.email
+        form.role.choices=[staff.role]
+        form.location.data=staff.location
+    return render_template('update_employee.html', title="Update Employee", form=form)
+
+@staff.route('/login', methods=["GET", "POST"])
+def login():
+    """This takes in the email and password of an employee and logs them in.
+    Too many attempts from one address, or too many failures for one email,
+    are turned away with a 429 before the password is checked"""
+    if current_user.is_authenticated:
+        return redirect(url_for('donors.LoadDonor'))
+    form = LoginForm()
+    if request.method == 'POST':
+        # Checked before bcrypt runs. Only failures spend from the email's
+        # bucket, so someone else guessing cannot lock its owner out for long
+        wait = rate_limiter.hit('login_per_ip', request.remote_addr) or \
+            rate_limiter.check('login_per_email', _email(form))
+        if wait:
+            return _too_many(wait, 'login.html', title="Login", form=form)
+    if form.validate_on_submit():
+        staff = Staff.query.filter_by(email=form.email.data).first()
+        if staff and passwords.check_password(staff, form.password.data):
+            login_user(staff)
+            next_page = request.args.get('next')
+            flash(f'Login successful')
+            return redirect(next_page) if next_page else redirect(url_for('donors.createDonor'))
+        else:
+            rate_limiter.hit('login_per_email', _email(form))
+            flash(f'Login failed, please check email and password')
+    return render_template('login.html', title="Login", form=form)
@@ -0,0 +1,19 @@
+from flask import url_for
+from flask_mail import Message
+from bloodapp import outbox
+
+
+def send_reset_email(staff):
+    """Queues an email with a password reset token for an employee
+    Args:
+        staff (obj): This is a employee from the STAFF table
+    Returns:
+        None"""
+    token = staff.get_reset_token()
+    msg = Message('Password Reset Request',
+                   sender='NoReplyBloodBank@my.unt.edu',
+                   recipients=[staff.email])
+    msg.body = f"""To reset your password, visit the following link:
+{url_for('staff.reset_token', token=token, _external=True)}
+If you did not make this request, then simply record this email and no changes will be made."""
+    outbox.enqueue(msg)
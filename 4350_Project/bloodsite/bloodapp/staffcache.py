@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from bloodapp import db
+
+
+class StaffCache:
+    """A per-process LRU cache of the logged in employees, so the user loader
+    does not query the STAFF table on every request.
+    Only column values are cached. Each hit builds a fresh object and merges it
+    into the request's session without a query, so routes can still change and
+    commit current_user as before"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, model, staff_id):
+        """Returns the employee with this id, from the cache when it is fresh
+        Args:
+            model (class): The Staff model
+            staff_id (int): The employee's id
+        Returns:
+            obj: The employee, attached to the current session, or None"""
+        ttl = current_app.config['STAFF_CACHE_TTL']
+        with self._lock:
+            entry = self._entries.get(staff_id)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                self._entries.move_to_end(staff_id)
+                self.hits += 1
+                values = entry[1]
+            else:
+                self.misses += 1
+                values = None
+        if values is None:
+            staff = model.query.get(staff_id)
+            if staff is not None:
+                self._store(staff_id, {attr.key: getattr(staff, attr.key) for attr in inspect(model).column_attrs})
+            return staff
+        staff = model(**values)
+        make_transient_to_detached(staff)
+        return db.session.merge(staff, load=False)
+
+    def _store(self, staff_id, values):
+        size = current_app.config['STAFF_CACHE_SIZE']
+        with self._lock:
+            self._entries[staff_id] = (time.monotonic(), values)
+            self._entries.move_to_end(staff_id)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, staff_id):
+        """Drops an employee so the next request reads their row again
+        Args:
+            staff_id (int): The employee's id"""
+        with self._lock:
+            self._entries.pop(staff_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns:
+            dict: hits, misses and the number of cached employees"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+staff_cache = StaffCache()
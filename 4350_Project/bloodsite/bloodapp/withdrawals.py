@@ -0,0 +1,117 @@
+from sqlalchemy import func
+from bloodapp import db
+from bloodapp import compatibility, expiry, inventory
+from bloodapp.models import Donation, Inventory, Shipment
+
+# Units deleted per statement, well under SQLite's limit on bound parameters
+DELETE_CHUNK = 500
+
+
+def _take(blood_type, blood, plasma, units, staff_id, location, substitute_for=None, requested=None):
+    """Removes up to units of one type, the ones closest to expiry first, and
+    records the shipment. The ids and branches are chosen with one SELECT,
+    which on PostgreSQL locks the units and passes over ones another
+    withdrawal has locked. They are removed with one DELETE ... WHERE id IN
+    (...) per branch, split every DELETE_CHUNK ids to stay under SQLite's
+    limit on bound parameters, and each branch is counted by what its
+    DELETEs removed. Counting the SELECT's rows next to one DELETE ... WHERE
+    id IN (SELECT ... LIMIT n) would not be safe: the SELECT and the DELETE
+    are separate statements, and on SQLite the transaction only starts at
+    the DELETE, so another withdrawal can ship some of the chosen units in
+    between. The count would include them again, and the DELETE would re-run
+    its subquery and take other units in their place, from any branch. A
+    DELETE only reports how many rows it removed, hence one per branch.
+    The caller commits
+    Args:
+        requested (int): The units the employee asked for, when that is more
+            than this one type is taken for
+    Returns:
+        int: The number of units taken"""
+    # Only the id and location columns are selected so no Donation objects are built
+    chosen = expiry.usable_units(blood_type, blood, plasma, location).with_for_update(skip_locked=True)
+    if units is not None:
+        chosen = chosen.limit(units)
+    by_location = {}
+    for unit_id, unit_location in chosen:
+        by_location.setdefault(unit_location, []).append(unit_id)
+    per_location = {}
+    for unit_location, ids in by_location.items():
+        for start in range(0, len(ids), DELETE_CHUNK):
+            deleted = db.session.query(Donation).filter(Donation.id.in_(ids[start:start + DELETE_CHUNK])) \
+                .delete(synchronize_session=False)
+            if deleted:
+                per_location[unit_location] = per_location.get(unit_location, 0) + deleted
+    shipped = sum(per_location.values())
+    if shipped == 0:
+        return 0
+    inventory.record_withdrawal(blood_type, blood, plasma, per_location)
+    db.session.add(Shipment(blood_type=blood_type, blood=blood, plasma=plasma,
+                            requested=units if requested is None else requested, units=shipped,
+                            staff_id=staff_id, substitute_for=substitute_for))
+    return shipped
+
+
+def ship(blood_type, blood, plasma, units=None, staff_id=None, location=None):
+    """Ships up to units of a type, the ones closest to expiry first, and records
+    the shipment. Expired units are never shipped. The units are removed with
+    a DELETE per branch (more for over DELETE_CHUNK units) and the inventory
+    is updated in the same transaction
+    Args:
+        blood_type (str): The blood type requested
+        blood (bool): if blood is requested
+        plasma (bool): if plasma is requested
+        units (int): The number of units requested, None for all of them
+        staff_id (int): The employee making the withdraw
+        location (str): Only ship from this branch, or from every branch
+    Returns:
+        int: The number of units shipped"""
+    shipped = _take(blood_type, blood, plasma, units, staff_id, location)
+    db.session.commit()
+    return shipped
+
+
+def _stock(blood, plasma, location=None):
+    """Reads the units on hand of every type of blood or plasma with one query
+    of the inventory table
+    Returns:
+        dict: {blood type: units}"""
+    query = db.session.query(Inventory.blood_type, func.sum(Inventory.count)) \
+        .filter(Inventory.blood == blood, Inventory.plasma == plasma, Inventory.count > 0)
+    if location:
+        query = query.filter(Inventory.location == location)
+    return dict(query.group_by(Inventory.blood_type).all())
+
+
+def ship_compatible(blood_type, blood, plasma, units, staff_id=None, location=None):
+    """Ships units of a type, making up any shortfall from the types that can
+    safely stand in for it (see compatibility.py). The split is decided from
+    one read of the inventory, using the requested type first and the
+    universal types last. If a type turns out to have fewer usable units than
+    counted, because some expired since the last sweep, the next type that
+    has stock is asked for the difference, even when the split did not need
+    it. Every part records the whole request as its requested units.
+    Everything is shipped in one transaction
+    Args:
+        blood_type (str): The blood type requested
+        blood (bool): if blood is requested
+        plasma (bool): if plasma is requested
+        units (int): The number of units requested
+        staff_id (int): The employee making the withdraw
+        location (str): Only ship from this branch, or from every branch
+    Returns:
+        list: (blood type, units) shipped, the requested type first"""
+    stock = _stock(blood, plasma, location)
+    planned = dict(compatibility.allocate(blood_type, blood, units, stock))
+    shipped = []
+    short = 0
+    for donor in compatibility.donor_types(blood_type, blood):
+        wanted = planned.get(donor, 0) + short
+        if wanted == 0 or not stock.get(donor):
+            continue
+        taken = _take(donor, blood, plasma, wanted, staff_id, location,
+                      substitute_for=None if donor == blood_type else blood_type, requested=units)
+        if taken:
+            shipped.append((donor, taken))
+        short = wanted - taken
+    db.session.commit()
+    return shipped
@@ -1,4 +1,6 @@
-from bloodapp import app
+from bloodapp import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
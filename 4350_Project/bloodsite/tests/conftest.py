@@ -0,0 +1,168 @@
+"""Fixtures for the test suite. Every test builds its own app with
+create_app(TestingConfig), on a private in-memory SQLite database, so tests
+never share state and run in parallel with pytest -n auto. Tests that use
+the app run a second time on a new PostgreSQL database, from a throwaway
+server made with initdb (found on the PATH or in PG_BIN) or the server at
+TEST_POSTGRES_URL. Those runs are skipped when there is neither"""
+import datetime
+import os
+import shutil
+import socket
+import subprocess
+import uuid
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from bloodapp import create_app, db, expiry, inventory, migrations, passwords
+from bloodapp.choices import invalidate_bank_choices
+from bloodapp.config import TestingConfig
+from bloodapp.models import Bank, Donation, Donor, Staff
+from bloodapp.staffcache import staff_cache
+
+PASSWORD = 'test-password'
+
+
+def _pg_program(name):
+    directory = os.environ.get('PG_BIN')
+    if directory:
+        path = os.path.join(directory, name)
+        return path if os.path.exists(path) else None
+    return shutil.which(name)
+
+
+@pytest.fixture(scope='session')
+def postgres_server(tmp_path_factory):
+    """The URL of a PostgreSQL server the tests may create databases on"""
+    pytest.importorskip('psycopg2')
+    if os.environ.get('TEST_POSTGRES_URL'):
+        yield os.environ['TEST_POSTGRES_URL']
+        return
+    initdb, pg_ctl = _pg_program('initdb'), _pg_program('pg_ctl')
+    if not (initdb and pg_ctl):
+        pytest.skip('PostgreSQL is not installed, put its bin directory on the PATH or in PG_BIN')
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        pytest.skip('PostgreSQL will not run as root, set TEST_POSTGRES_URL to a server instead')
+    base = tmp_path_factory.mktemp('postgres')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    subprocess.run([initdb, '-D', str(base / 'data'), '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--no-sync'],
+                   check=True, capture_output=True)
+    subprocess.run([pg_ctl, '-D', str(base / 'data'), '-l', str(base / 'log'), '-w', 'start', '-o',
+                    f"-p {port} -k {base} -c listen_addresses='' -c fsync=off"], check=True, capture_output=True)
+    yield f'postgresql://postgres@/postgres?host={base}&port={port}'
+    subprocess.run([pg_ctl, '-D', str(base / 'data'), '-m', 'immediate', 'stop'], capture_output=True)
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def database_url(request):
+    """sqlite:// for the first run of a test, a new PostgreSQL database for the second.
+    Tests marked sqlite_only or postgresql_only are run on just that one"""
+    for engine in ('sqlite', 'postgresql'):
+        if request.node.get_closest_marker(f'{engine}_only') and request.param != engine:
+            pytest.skip(f'only runs on {engine}')
+    if request.param == 'sqlite':
+        yield 'sqlite://'
+        return
+    server = create_engine(request.getfixturevalue('postgres_server'), isolation_level='AUTOCOMMIT')
+    name = f'bloodsite_test_{uuid.uuid4().hex[:12]}'
+    server.execute(f"CREATE DATABASE {name} ENCODING 'UTF8' TEMPLATE template0")
+    url = make_url(str(server.url))
+    url.database = name
+    yield str(url)
+    server.execute(f'DROP DATABASE IF EXISTS {name}')
+    server.dispose()
+
+
+@pytest.fixture
+def app(database_url):
+    """The site on a new database, upgraded the way "flask db upgrade" does it"""
+    class DatabaseConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = database_url
+
+    app = create_app(DatabaseConfig)
+    with app.app_context():
+        migrations.upgrade()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    # Both live for the whole process, and the next test's rows have the same ids
+    staff_cache.clear()
+    invalidate_bank_choices()
+
+
+@pytest.fixture
+def add_staff(app):
+    """Adds an employee and returns their id"""
+    def add_staff(email='nurse@bloodbank.test', location='Denton', role='Nurse'):
+        with app.app_context():
+            staff = Staff(first_name='nancy', last_name='nurse', email=email, role=role, location=location,
+                          password=passwords.hash_password(PASSWORD))
+            db.session.add(staff)
+            db.session.commit()
+            return staff.id
+    return add_staff
+
+
+@pytest.fixture
+def add_bank(app):
+    """Adds a bank and returns its id"""
+    def add_bank(location, manager_id):
+        with app.app_context():
+            bank = Bank(location=location, manager_id=manager_id)
+            db.session.add(bank)
+            db.session.commit()
+            invalidate_bank_choices()
+            return bank.id
+    return add_bank
+
+
+@pytest.fixture
+def add_donor(app):
+    """Adds a donor who may give straight away and returns their id"""
+    def add_donor(first_name='maria', last_name='garcia', blood_type='O-', location='Denton', email=None):
+        with app.app_context():
+            donor = Donor(first_name=first_name, last_name=last_name, blood_type=blood_type, location=location,
+                          email=email or f'{first_name}.{last_name}@donor.test', age=30)
+            db.session.add(donor)
+            db.session.commit()
+            return donor.id
+    return add_donor
+
+
+@pytest.fixture
+def add_units(app):
+    """Adds units to the shelf the way DonorPage does, with the inventory,
+    rollups and ledger kept up to date"""
+    def add_units(count, blood_type='O-', location='Denton', blood=True, date=None):
+        with app.app_context():
+            donations = []
+            for _ in range(count):
+                donation = Donation(blood_type=blood_type, blood=blood, plasma=not blood, location=location,
+                                    date=date or datetime.datetime.utcnow())
+                expiry.set_expiry(donation)
+                donations.append(donation)
+            db.session.add_all(donations)
+            db.session.flush()
+            inventory.record_donations(donations)
+            db.session.commit()
+    return add_units
+
+
+@pytest.fixture
+def staff_id(add_staff, add_bank):
+    """An employee at Denton, which is a bank they manage"""
+    staff_id = add_staff()
+    add_bank('Denton', staff_id)
+    return staff_id
+
+
+@pytest.fixture
+def client(app, staff_id):
+    """A test client logged in as the staff_id employee"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(staff_id)
+        session['_fresh'] = True
+    return client
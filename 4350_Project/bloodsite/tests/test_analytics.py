@@ -0,0 +1,66 @@
+import datetime
+from sqlalchemy import func
+from bloodapp import analytics, db, withdrawals
+from bloodapp.models import Donation, DonationRollup, Shipment
+
+
+def _rollups():
+    return {(row.day, row.location, row.blood_type, row.kind): (row.donated, row.withdrawn)
+            for row in DonationRollup.query}
+
+
+def _add(add_units):
+    """Adds units over three days, two branches and both kinds
+    Returns:
+        tuple: The three days, oldest first"""
+    now = datetime.datetime.utcnow()
+    ten_days_ago, three_days_ago = now - datetime.timedelta(days=10), now - datetime.timedelta(days=3)
+    add_units(3, date=ten_days_ago)
+    add_units(2, location='Frisco', date=three_days_ago)
+    add_units(1, blood_type='A+', blood=False, date=three_days_ago)
+    add_units(2, date=now)
+    return ten_days_ago.date(), three_days_ago.date(), now.date()
+
+
+def test_rollups_match_the_donations(app, add_units):
+    _add(add_units)
+    with app.app_context():
+        raw = db.session.query(func.date(Donation.date), Donation.location, Donation.blood_type, Donation.blood,
+                               func.count(Donation.id)) \
+            .group_by(func.date(Donation.date), Donation.location, Donation.blood_type, Donation.blood)
+        expected = {(datetime.date.fromisoformat(str(day)), location, blood_type, 'blood' if blood else 'plasma'):
+                    (count, 0) for day, location, blood_type, blood, count in raw}
+        assert _rollups() == expected
+        # Rebuilt from the donations, the rollups come out the same
+        assert analytics.backfill(force=True) == len(expected)
+        assert _rollups() == expected
+
+
+def test_rollups_count_shipments_by_the_branch_they_left(app, add_units):
+    ten_days_ago, three_days_ago, today = _add(add_units)
+    with app.app_context():
+        # The three oldest Denton units and one from Frisco
+        assert withdrawals.ship('O-', True, False, 4) == 4
+        assert _rollups() == {
+            (ten_days_ago, 'Denton', 'O-', 'blood'): (3, 0),
+            (three_days_ago, 'Frisco', 'O-', 'blood'): (2, 0),
+            (three_days_ago, 'Denton', 'A+', 'plasma'): (1, 0),
+            (today, 'Denton', 'O-', 'blood'): (2, 3),
+            (today, 'Frisco', 'O-', 'blood'): (0, 1),
+        }
+        assert sum(withdrawn for _, withdrawn in _rollups().values()) == \
+            db.session.query(func.sum(Shipment.units)).scalar()
+        report = analytics.intake(ten_days_ago, today, 'week', 'kind')
+    assert [series["name"] for series in report["series"]] == ['blood', 'plasma']
+    assert report["totals"] == {"donated": 8, "withdrawn": 4}
+    assert report["labels"][0] == analytics.bucket_start(ten_days_ago, 'week').isoformat()
+
+
+def test_donation_analytics_page(client, add_units):
+    ten_days_ago, _, today = _add(add_units)
+    client.post('/withdraw', data={"blood_type": 'O-', "blood_or_plasma": 'Blood', "units": '4', "location": ''})
+    report = client.get(f'/analytics/donations?start={ten_days_ago}&end={today}&group_by=location').get_json()
+    assert len(report["labels"]) == 11
+    assert {series["name"]: (sum(series["donated"]), sum(series["withdrawn"])) for series in report["series"]} == \
+        {"Denton": (6, 3), "Frisco": (2, 1)}
+    assert client.get('/analytics/donations?bucket=year').status_code == 400
@@ -0,0 +1,74 @@
+from bloodapp import db
+from bloodapp.choices import bank_choices
+from bloodapp.models import Bank
+from bloodapp.querycount import assert_max_queries, count_queries
+
+
+def test_create_bank(app, client, staff_id):
+    response = client.post('/CreateBank', data={"location": 'Frisco', "manager_id": staff_id})
+    assert response.status_code == 302
+    with app.app_context():
+        assert Bank.query.filter_by(location='Frisco').one().manager_id == staff_id
+    assert b'Frisco' in client.get('/CreateBank').data
+
+
+def test_create_bank_refuses_a_second_bank_at_a_location(app, client, staff_id):
+    response = client.post('/CreateBank', data={"location": 'Denton', "manager_id": staff_id})
+    assert b'A bank already exists at that location' in response.data
+    with app.app_context():
+        assert Bank.query.count() == 1
+
+
+def _add_banks(add_staff, add_bank, locations):
+    for location in locations:
+        add_bank(location, add_staff(email=f'{location.lower()}@bloodbank.test', location=location))
+
+
+def test_bank_page_queries_do_not_grow_with_banks(app, client, add_staff, add_bank):
+    client.get('/CreateBank')
+    # Each new bank makes the cached table stale, so both pages below are built
+    _add_banks(add_staff, add_bank, ['Frisco'])
+    with app.app_context():
+        with count_queries() as two_banks:
+            client.get('/CreateBank')
+    assert two_banks.count > 0
+
+    _add_banks(add_staff, add_bank, ['Irving', 'Plano', 'Dallas', 'Austin'])
+    with app.app_context():
+        with assert_max_queries(two_banks.count):
+            response = client.get('/CreateBank')
+    # A full page of five banks, each with its manager's name
+    assert response.data.count(b'Nancy Nurse') == 5
+
+
+class Clock:
+    """Stands in for the time module, moved on by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_branch_choices_are_read_again_once_the_ttl_passes(app, staff_id, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('bloodapp.choices.time', clock)
+    app.config['BANK_CHOICES_TTL'] = 300
+    with app.app_context():
+        assert bank_choices() == ['Denton']
+        # Added behind the cache's back, as another worker would
+        db.session.add(Bank(location='Frisco', manager_id=staff_id))
+        db.session.commit()
+        clock.now += 299
+        with count_queries() as counter:
+            assert bank_choices() == ['Denton']
+        assert counter.count == 0
+        clock.now += 1
+        assert bank_choices() == ['Denton', 'Frisco']
+
+
+def test_creating_a_bank_drops_the_cached_branch_choices(app, client, staff_id):
+    assert b'Frisco' not in app.test_client().get('/register').data
+    client.post('/CreateBank', data={"location": 'Frisco', "manager_id": staff_id})
+    assert b'<option value="Frisco">Frisco</option>' in app.test_client().get('/register').data
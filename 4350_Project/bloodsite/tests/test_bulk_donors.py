@@ -0,0 +1,57 @@
+import csv
+import json
+import pytest
+from bloodapp import create_app, db, migrations
+from bloodapp.config import TestingConfig
+from bloodapp.models import Donor, OutboxMessage
+
+DONORS = """first_name,last_name,email,age,blood_type
+ann,lee,Ann.Lee@donor.test,30,A+
+Bob,Ray,bob.ray@donor.test,41,O-
+maria,garcia,maria.garcia@donor.test,30,O-
+ann,lee,ann.lee@donor.test,30,A+
+c,,not-an-email,old,Z+
+"""
+
+
+def test_import_counts_the_donors_added_already_registered_and_rejected(app, add_donor, tmp_path):
+    add_donor()
+    path = tmp_path / 'donors.csv'
+    path.write_text(DONORS)
+    # Two rows per chunk, so the repeated email is in a later chunk than the first
+    result = app.test_cli_runner().invoke(args=['donors', 'import', str(path), '--chunk-size', '2'])
+    assert result.exit_code == 0
+    assert '2 donors added, 2 already registered, 1 rejected' in result.output
+    assert 'Row 5: ' in result.output
+    with app.app_context():
+        assert [(donor.first_name, donor.email) for donor in Donor.query.order_by(Donor.id)] == [
+            ('maria', 'maria.garcia@donor.test'), ('ann', 'ann.lee@donor.test'), ('bob', 'bob.ray@donor.test')]
+        assert OutboxMessage.query.count() == 2
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_an_export_imports_into_another_site(app, add_donor, tmp_path, fmt):
+    add_donor()
+    add_donor(first_name='ann', last_name='lee', blood_type='AB+', location='Frisco')
+    path = tmp_path / f'donors.{fmt}'
+    result = app.test_cli_runner().invoke(args=['donors', 'export', str(path)])
+    assert '2 donors exported' in result.output
+
+    other = create_app(TestingConfig)
+    with other.app_context():
+        migrations.upgrade()
+    result = other.test_cli_runner().invoke(args=['donors', 'import', str(path), '--no-email'])
+    assert '2 donors added, 0 already registered, 0 rejected' in result.output
+    again = tmp_path / f'again.{fmt}'
+    other.test_cli_runner().invoke(args=['donors', 'export', str(again)])
+
+    def rows(path):
+        with open(path, newline='') as stream:
+            rows = list(csv.DictReader(stream)) if fmt == 'csv' else [json.loads(line) for line in stream]
+        return [{field: str(row[field]) for field in ('first_name', 'last_name', 'email', 'age', 'blood_type')}
+                for row in rows]
+    assert rows(again) == rows(path)
+    with other.app_context():
+        assert OutboxMessage.query.count() == 0
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,48 @@
+import pytest
+from bloodapp import compatibility
+
+# Every recipient's donors in the order they are used: its own type first,
+# then the types fewest other recipients can take, so O- red cells and AB
+# plasma go last
+RED_CELLS = {
+    "O-": ['O-'],
+    "O+": ['O+', 'O-'],
+    "A-": ['A-', 'O-'],
+    "A+": ['A+', 'O+', 'A-', 'O-'],
+    "B-": ['B-', 'O-'],
+    "B+": ['B+', 'O+', 'B-', 'O-'],
+    "AB-": ['AB-', 'A-', 'B-', 'O-'],
+    "AB+": ['AB+', 'A+', 'B+', 'AB-', 'O+', 'A-', 'B-', 'O-'],
+}
+PLASMA = {
+    "O-": ['O-', 'O+', 'A+', 'B+', 'A-', 'B-', 'AB+', 'AB-'],
+    "O+": ['O+', 'O-', 'A+', 'B+', 'A-', 'B-', 'AB+', 'AB-'],
+    "A-": ['A-', 'A+', 'AB+', 'AB-'],
+    "A+": ['A+', 'A-', 'AB+', 'AB-'],
+    "B-": ['B-', 'B+', 'AB+', 'AB-'],
+    "B+": ['B+', 'B-', 'AB+', 'AB-'],
+    "AB-": ['AB-', 'AB+'],
+    "AB+": ['AB+', 'AB-'],
+}
+
+
+@pytest.mark.parametrize('recipient', compatibility.BLOOD_TYPES)
+def test_red_cell_donors(recipient):
+    assert compatibility.donor_types(recipient, True) == RED_CELLS[recipient]
+
+
+@pytest.mark.parametrize('recipient', compatibility.BLOOD_TYPES)
+def test_plasma_donors(recipient):
+    assert compatibility.donor_types(recipient, False) == PLASMA[recipient]
+
+
+def test_allocate_uses_the_requested_type_first_and_universal_types_last():
+    stock = {"A+": 3, "O+": 2, "A-": 4, "O-": 5, "B+": 9}
+    assert compatibility.allocate('A+', True, 10, stock) == [('A+', 3), ('O+', 2), ('A-', 4), ('O-', 1)]
+    assert compatibility.allocate('A+', True, 2, stock) == [('A+', 2)]
+    assert compatibility.allocate('AB+', True, 2, {"O-": 5, "AB-": 5}) == [('AB-', 2)]
+
+
+def test_allocate_gives_what_there_is_when_it_runs_out():
+    assert compatibility.allocate('O-', True, 4, {"O-": 1, "O+": 9}) == [('O-', 1)]
+    assert compatibility.allocate('A-', False, 4, {"AB-": 2, "AB+": 1, "O-": 9}) == [('AB+', 1), ('AB-', 2)]
@@ -0,0 +1,108 @@
+"""Parallel writers recording donations against one database file with the
+production settings (WAL, busy timeout, a real connection pool), the way
+several waitress threads or gunicorn workers would"""
+import datetime
+import threading
+from sqlalchemy import event
+from bloodapp import create_app, db, expiry, inventory, ledger, migrations, withdrawals
+from bloodapp.config import Config, TestingConfig
+from bloodapp.models import Donation, Donor, Inventory, Staff
+
+WRITERS = 6
+DONATIONS = 10
+
+
+def _file_config(path):
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = Config.SQLALCHEMY_ENGINE_OPTIONS
+    return FileConfig
+
+
+def _setup(app):
+    with app.app_context():
+        migrations.upgrade()
+        for writer in range(WRITERS):
+            db.session.add(Staff(first_name='writer', last_name=str(writer), password='x',
+                                 email=f'writer{writer}@bloodbank.test', role='Nurse', location='Denton'))
+        db.session.execute(Donor.__table__.insert(), [
+            {"first_name": 'donor', "last_name": str(i), "email": f'donor{i}@donor.test', "age": 30,
+             "blood_type": 'O-'} for i in range(WRITERS * DONATIONS)])
+        db.session.commit()
+
+
+def _writer(app, index, errors):
+    """Donates blood for this writer's slice of donors through DonorPage.
+    Every writer adds to the same inventory row"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(index + 1)
+        session['_fresh'] = True
+    for donor_id in range(index * DONATIONS + 1, (index + 1) * DONATIONS + 1):
+        try:
+            response = client.post(f'/DonorPage/{donor_id}', data={"donate_blood": '1'})
+            if b'Blood Donated!' not in response.data:
+                errors.append(f'donor {donor_id}: status {response.status_code}')
+        except Exception as e:
+            errors.append(f'donor {donor_id}: {e}')
+
+
+def test_concurrent_donations_lose_no_inventory_updates(tmp_path):
+    app = create_app(_file_config(tmp_path / 'concurrency.db'))
+    _setup(app)
+    errors = []
+    threads = [threading.Thread(target=_writer, args=(app, index, errors)) for index in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with app.app_context():
+        assert Donation.query.count() == WRITERS * DONATIONS
+        assert Inventory.query.filter_by(location='Denton', blood_type='O-', blood=True).one().count == \
+            WRITERS * DONATIONS
+        assert inventory.verify() == []
+        assert ledger.verify() == []
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_a_withdrawal_only_counts_the_units_it_deleted(tmp_path):
+    # Another withdrawal ships one of the chosen units between this one's
+    # SELECT and its DELETE. Each branch must lose only what was removed
+    app = create_app(_file_config(tmp_path / 'withdrawals.db'))
+    with app.app_context():
+        migrations.upgrade()
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+        donations = [Donation(blood_type='O-', blood=True, plasma=False, location=location, date=date)
+                     for location, date in [('Denton', old), ('Denton', old), ('Frisco', None), ('Frisco', None)]]
+        for donation in donations:
+            expiry.set_expiry(donation)
+        db.session.add_all(donations)
+        db.session.flush()
+        inventory.record_donations(donations)
+        db.session.commit()
+
+        def other_withdrawal():
+            with app.app_context():
+                withdrawals.ship('O-', True, False, 1)
+                db.session.remove()
+
+        raced = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def race(connection, cursor, statement, parameters, context, executemany):
+            if statement.startswith('DELETE FROM donation') and not raced:
+                raced.append(statement)
+                thread = threading.Thread(target=other_withdrawal)
+                thread.start()
+                thread.join()
+
+        assert withdrawals.ship('O-', True, False, 2) == 1
+        counts = dict(db.session.query(Inventory.location, Inventory.count))
+        assert counts == {"Denton": 0, "Frisco": 2}
+        assert inventory.verify() == []
+        assert ledger.verify() == []
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,55 @@
+import pytest
+from bloodapp import search
+from bloodapp.models import Donor, Inventory
+
+
+def test_donate_blood_counts_the_unit_and_starts_the_wait(app, client, add_donor):
+    donor_id = add_donor()
+    response = client.post(f'/DonorPage/{donor_id}', data={"donate_blood": '1'})
+    assert b'Blood Donated!' in response.data
+    with app.app_context():
+        assert Inventory.query.filter_by(location='Denton', blood_type='O-', blood=True).one().count == 1
+        assert Donor.query.get(donor_id).last_blood_donation_date is not None
+
+    response = client.post(f'/DonorPage/{donor_id}', data={"donate_blood": '1'})
+    assert b'not yet eligible' in response.data
+    with app.app_context():
+        assert Inventory.query.filter_by(location='Denton', blood_type='O-', blood=True).one().count == 1
+
+
+def test_load_donor_by_id(client, add_donor):
+    donor_id = add_donor()
+    response = client.post('/LoadDonor', data={"donor_id": donor_id})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/DonorPage/{donor_id}')
+
+
+def test_search_donor(client, add_donor):
+    add_donor(first_name='maria', last_name='garcia')
+    add_donor(first_name='wei', last_name='li')
+    response = client.get('/SearchDonor?q=garc')
+    assert b'garcia' in response.data.lower()
+    assert b'wei' not in response.data.lower()
+
+
+def test_search_with_only_short_words_looks_up_the_start_of_names(app, add_donor):
+    add_donor()
+    add_donor(first_name='gabe', last_name='lopez')
+    with app.app_context():
+        results, found = search.search_donors('ga')
+        assert [row.last_name for row in results.items] == ['garcia']
+        results, found = search.search_donors('m ga')
+        assert [row.first_name for row in results.items] == ['maria']
+        assert search.search_donors('x ga')[0].total == 0
+
+
+@pytest.mark.sqlite_only
+def test_typo_search_takes_close_donors_before_the_candidates_run_out(app, monkeypatch, add_donor):
+    monkeypatch.setattr(search, 'FUZZY_CANDIDATES', 5)
+    for i in range(10):
+        add_donor(first_name='sam', last_name='smiley', email=f'sam{i}@donor.test')
+    smith = add_donor(first_name='sam', last_name='smith', email='sam.s@donor.test')
+    with app.app_context():
+        results, found = search.search_donors('smiht')
+        assert found == 'fuzzy'
+        assert [row.id for row in results.items] == [smith]
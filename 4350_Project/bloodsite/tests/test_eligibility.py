@@ -0,0 +1,75 @@
+import datetime
+import json
+from bloodapp import db, eligibility
+from bloodapp.models import Donor
+
+
+def _gave(app, donor_id, days_ago, kind='blood'):
+    """Records a donation days_ago and returns when the donor may give again"""
+    with app.app_context():
+        donor = Donor.query.get(donor_id)
+        when = datetime.datetime.now() - datetime.timedelta(days=days_ago)
+        eligibility.record_donation(donor, kind, donor.location, when=when)
+        db.session.commit()
+        return eligibility.next_eligible(donor, kind)
+
+
+def _donors(app, add_donor):
+    """Adds O- donors who gave 70, 60 and 55 days ago, one who never gave, and an A+ donor.
+    Returns:
+        dict: Their ids by first name"""
+    ids = {"early": add_donor(first_name='early', location='Frisco'), "gave": add_donor(first_name='gave'),
+           "recent": add_donor(first_name='recent'), "never": add_donor(first_name='never'),
+           "other": add_donor(first_name='other', blood_type='A+')}
+    _gave(app, ids["early"], 70)
+    _gave(app, ids["gave"], 60)
+    _gave(app, ids["recent"], 55)
+    return ids
+
+
+def test_eligible_donors_are_the_ones_whose_wait_is_over(app, add_donor):
+    ids = _donors(app, add_donor)
+    with app.app_context():
+        # Eight weeks after giving blood, the ones able to the longest first
+        assert [donor.id for donor in eligibility.eligible_query('O-', 'blood')] == \
+            [ids["early"], ids["gave"], ids["never"]]
+        assert [donor.id for donor in eligibility.eligible_query('O-', 'blood', location='Denton')] == \
+            [ids["gave"], ids["never"]]
+        # Giving blood does not hold up plasma
+        assert ids["recent"] in [donor.id for donor in eligibility.eligible_query('O-', 'plasma')]
+
+
+def test_a_donor_is_eligible_from_the_moment_their_wait_ends(app, add_donor):
+    ids = _donors(app, add_donor)
+    ends = _gave(app, ids["recent"], 55)
+    just_before = ends - datetime.timedelta(seconds=1)
+    with app.app_context():
+        before = [donor.id for donor in eligibility.eligible_query('O-', 'blood', as_of=just_before)]
+        at = [donor.id for donor in eligibility.eligible_query('O-', 'blood', as_of=ends)]
+        recent = Donor.query.get(ids["recent"])
+        assert not eligibility.is_eligible(recent, 'blood', now=just_before)
+        assert eligibility.is_eligible(recent, 'blood', now=ends)
+    assert ids["recent"] not in before and ids["recent"] in at
+
+
+def test_stream_reads_the_eligible_donors_in_batches(app, add_donor):
+    ids = _donors(app, add_donor)
+    with app.app_context():
+        batches = list(eligibility.stream('O-', 'blood', batch_size=2, columns=[Donor.id]))
+    assert [[row.id for row in batch] for batch in batches] == [[ids["early"], ids["gave"]], [ids["never"]]]
+
+
+def test_eligible_command_exports_the_recall_list(app, add_donor, tmp_path):
+    ids = _donors(app, add_donor)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['donors', 'eligible', 'O-'])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0].startswith('id,first_name,last_name,email')
+    assert [line.split(',')[1] for line in lines[1:4]] == ['early', 'gave', 'never']
+    assert '3 eligible donors' in result.output
+
+    path = tmp_path / 'recall.jsonl'
+    result = runner.invoke(args=['donors', 'eligible', 'O-', '--location', 'Denton', '--output', str(path)])
+    assert '2 eligible donors' in result.output
+    assert [json.loads(line)["id"] for line in path.read_text().splitlines()] == [ids["gave"], ids["never"]]
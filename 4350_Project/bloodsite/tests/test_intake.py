@@ -0,0 +1,115 @@
+import datetime
+import time
+import pytest
+from bloodapp import db, ledger
+from bloodapp.models import Donation, Donor
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat() + 'Z'
+
+
+def _send(client, *donations):
+    return client.post('/donations/batch', json={"donations": list(donations)})
+
+
+def test_batch_accepts_donations_and_replays_keys(app, client, add_donor):
+    donor_id = add_donor()
+    donation = {"key": 'drive-1', "donor_id": donor_id, "kind": 'blood', "timestamp": _now()}
+    first = _send(client, donation).get_json()
+    assert first["accepted"] == 1
+    assert first["results"][0]["status"] == 'accepted'
+
+    again = _send(client, donation).get_json()
+    assert again["accepted"] == 0 and again["replayed"] == 1
+    assert again["results"][0]["donation_id"] == first["results"][0]["donation_id"]
+    with app.app_context():
+        assert Donation.query.count() == 1
+        assert ledger.verify() == []
+
+
+def test_batch_marks_a_timestamp_that_is_not_a_string_invalid(client, add_donor):
+    donor_id = add_donor()
+    response = _send(client, {"key": 'a', "donor_id": donor_id, "kind": 'blood', "timestamp": 1614609000},
+                     {"key": 'b', "donor_id": donor_id, "kind": 'blood', "timestamp": None})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["invalid"] == 2
+    assert [result["status"] for result in body["results"]] == ['invalid', 'invalid']
+
+
+def test_batch_marks_a_donation_past_its_shelf_life_invalid(app, client, add_donor):
+    donor_id = add_donor()
+    with app.app_context():
+        # Registered after the drive, so nothing holds the donation back
+        Donor.query.get(donor_id).next_plasma_eligible = None
+        db.session.commit()
+    old = (datetime.datetime.utcnow() - datetime.timedelta(days=43)).isoformat() + 'Z'
+    body = _send(client, {"key": 'blood', "donor_id": donor_id, "kind": 'blood', "timestamp": old},
+                 {"key": 'plasma', "donor_id": donor_id, "kind": 'plasma', "timestamp": old}).get_json()
+    assert body["results"][0] == {"key": 'blood', "status": 'invalid',
+                                  "error": 'timestamp is older than a blood unit keeps'}
+    # Plasma keeps for a year
+    assert body["results"][1]["status"] == 'accepted'
+    with app.app_context():
+        assert Donation.query.filter_by(blood=True).count() == 0
+        assert ledger.verify() == []
+
+
+def test_batch_refuses_a_key_sent_again_with_a_different_donation(app, client, add_donor):
+    donor_id = add_donor()
+    other_id = add_donor(first_name='wei', last_name='li')
+    assert _send(client, {"key": 'k', "donor_id": donor_id, "kind": 'blood', "timestamp": _now()}) \
+        .get_json()["accepted"] == 1
+
+    body = _send(client, {"key": 'k', "donor_id": other_id, "kind": 'blood', "timestamp": _now()}).get_json()
+    assert body["conflict"] == 1 and body["replayed"] == 0
+    assert body["results"][0]["status"] == 'conflict'
+    body = _send(client, {"key": 'twice', "donor_id": other_id, "kind": 'plasma', "timestamp": _now()},
+                 {"key": 'twice', "donor_id": donor_id, "kind": 'plasma', "timestamp": _now()}).get_json()
+    assert [result["status"] for result in body["results"]] == ['accepted', 'conflict']
+    with app.app_context():
+        assert Donation.query.count() == 2
+
+
+def test_batch_keys_belong_to_the_employee_that_sent_them(app, client, add_staff, add_donor):
+    donor_id = add_donor()
+    other_id = add_donor(first_name='wei', last_name='li')
+    other_client = app.test_client()
+    with other_client.session_transaction() as session:
+        session['_user_id'] = str(add_staff(email='drive@bloodbank.test'))
+        session['_fresh'] = True
+
+    _send(client, {"key": 'uuid-1', "donor_id": donor_id, "kind": 'blood', "timestamp": _now()})
+    body = _send(other_client, {"key": 'uuid-1', "donor_id": other_id, "kind": 'blood', "timestamp": _now()})
+    assert body.get_json()["accepted"] == 1
+    with app.app_context():
+        assert Donation.query.count() == 2
+
+
+@pytest.fixture
+def chicago(monkeypatch):
+    """Runs the test on a server whose clock is behind UTC"""
+    monkeypatch.setenv('TZ', 'America/Chicago')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_batch_checks_eligibility_on_the_server_clock(app, client, add_donor, chicago):
+    donor_id = add_donor()
+    with app.app_context():
+        donor = Donor.query.get(donor_id)
+        # DonorPage would have set this from datetime.now()
+        donor.next_blood_eligible = datetime.datetime.now() + datetime.timedelta(hours=2)
+        db.session.commit()
+
+    body = _send(client, {"key": 'early', "donor_id": donor_id, "kind": 'plasma', "timestamp": _now()},
+                 {"key": 'too-soon', "donor_id": donor_id, "kind": 'blood', "timestamp": _now()}).get_json()
+    assert [result["status"] for result in body["results"]] == ['accepted', 'ineligible']
+    with app.app_context():
+        donor = Donor.query.get(donor_id)
+        assert abs(donor.last_plasma_donation_date - datetime.datetime.now()) < datetime.timedelta(minutes=1)
+        donation = Donation.query.one()
+        assert abs(donation.date - datetime.datetime.utcnow()) < datetime.timedelta(minutes=1)
@@ -0,0 +1,89 @@
+import datetime
+import pytest
+from sqlalchemy.exc import DBAPIError
+from bloodapp import db, inventory, ledger, withdrawals
+from bloodapp.querycount import count_queries
+from bloodapp.models import Donation, Inventory, Shipment
+
+
+def test_withdraw_ships_units_and_updates_the_inventory(app, client, add_units):
+    add_units(3)
+    response = client.post('/withdraw', data={"blood_type": 'O-', "blood_or_plasma": 'Blood', "units": '2',
+                                              "location": ''})
+    assert response.status_code == 302
+    with app.app_context():
+        assert Donation.query.count() == 1
+        assert Inventory.query.filter_by(blood_type='O-', blood=True).one().count == 1
+        assert ledger.verify() == []
+
+
+def test_withdraw_with_nothing_on_the_shelf(client):
+    response = client.post('/withdraw', data={"blood_type": 'AB-', "blood_or_plasma": 'Plasma', "units": 'all',
+                                              "location": ''})
+    assert b'We currently have no units of that type' in response.data
+
+
+def test_ledger_stock(client, add_units):
+    add_units(2, blood_type='A+')
+    stock = client.get('/ledger/stock?location=Denton').get_json()["stock"]
+    assert stock == [{"location": 'Denton', "blood_type": 'A+', "kind": 'blood', "units": 2}]
+
+
+def test_withdraw_deletes_each_branch_in_chunks(app, monkeypatch, add_units):
+    monkeypatch.setattr(withdrawals, 'DELETE_CHUNK', 3)
+    add_units(5)
+    add_units(2, location='Frisco')
+    with app.app_context():
+        with count_queries() as counter:
+            assert withdrawals.ship('O-', True, False) == 7
+        deletes = [statement for statement in counter.statements if statement.startswith('DELETE FROM donation')]
+        # Two for Denton's five units and one for Frisco's two
+        assert len(deletes) == 3
+        assert Donation.query.count() == 0
+        assert db.session.query(Inventory.count).filter(Inventory.count != 0).all() == []
+        assert ledger.verify() == []
+
+
+def test_the_ledger_is_append_only(app, add_units):
+    add_units(1)
+    with app.app_context():
+        for statement in ('UPDATE ledger_event SET units = 5', 'DELETE FROM ledger_event'):
+            with pytest.raises(DBAPIError, match='append only'):
+                db.session.execute(statement)
+            db.session.rollback()
+        assert ledger.verify() == []
+
+
+def _past_expiry():
+    return datetime.datetime.utcnow() - datetime.timedelta(days=50)
+
+
+def test_ship_compatible_asks_the_next_type_for_units_that_expired(app, add_units):
+    add_units(1, 'A+')
+    add_units(2, 'A+', date=_past_expiry())
+    add_units(5, 'O+')
+    with app.app_context():
+        # The inventory still counts three A+ units, so the split asks O+ for
+        # one, and for the two that turn out to be past expiry
+        assert withdrawals.ship_compatible('A+', True, False, 4) == [('A+', 1), ('O+', 3)]
+        assert [(shipment.blood_type, shipment.requested, shipment.units, shipment.substitute_for)
+                for shipment in Shipment.query.order_by(Shipment.id)] == [('A+', 4, 1, None), ('O+', 4, 3, 'A+')]
+        assert inventory.verify() == []
+        assert ledger.verify() == []
+
+
+def test_ship_compatible_carries_a_shortfall_past_the_split(app, add_units):
+    add_units(1, 'A+')
+    add_units(2, 'A+', date=_past_expiry())
+    add_units(5, 'A-')
+    with app.app_context():
+        # A+ was counted as enough on its own, so A- was not in the split
+        assert withdrawals.ship_compatible('A+', True, False, 3) == [('A+', 1), ('A-', 2)]
+
+
+def test_ship_compatible_sends_ab_plasma_to_anyone(app, add_units):
+    add_units(2, 'AB+', blood=False)
+    add_units(2, 'O-', blood=False)
+    with app.app_context():
+        assert withdrawals.ship_compatible('B-', False, True, 3) == [('AB+', 2)]
+        assert withdrawals.ship_compatible('O+', False, True, 3) == [('O-', 2)]
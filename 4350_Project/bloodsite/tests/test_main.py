@@ -0,0 +1,66 @@
+from bloodapp import db
+from bloodapp.metrics import metrics
+
+
+def test_home_serves_guests_and_staff(app, client):
+    assert app.test_client().get('/').status_code == 200
+    assert client.get('/home').status_code == 200
+
+
+def test_home_revalidates_with_etag(client):
+    first = client.get('/')
+    again = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_metrics_needs_an_admin_or_the_token(app, client):
+    assert client.get('/metrics').status_code == 403
+    app.config['METRICS_TOKEN'] = 'scrape'
+    response = app.test_client().get('/metrics', headers={'Authorization': 'Bearer scrape'})
+    assert response.status_code == 200
+    assert 'bloodsite_request_duration_seconds' in response.get_data(as_text=True)
+
+
+def test_metrics_page_lists_each_endpoint(app, client, add_units):
+    add_units(2)
+    app.config['METRICS_TOKEN'] = 'scrape'
+    # The histograms are kept for the whole process, across tests
+    metrics.reset()
+    client.get('/withdraw')
+    client.get('/withdraw')
+    client.get('/no-such-page')
+    body = app.test_client().get('/metrics', headers={'Authorization': 'Bearer scrape'}).get_data(as_text=True)
+    lines = body.splitlines()
+
+    withdraw = 'endpoint="inventory.withdraw",method="GET"'
+    assert '# TYPE bloodsite_request_duration_seconds histogram' in lines
+    assert f'bloodsite_request_duration_seconds_bucket{{{withdraw},le="+Inf"}} 2' in lines
+    assert f'bloodsite_request_duration_seconds_count{{{withdraw}}} 2' in lines
+    assert f'bloodsite_request_queries_count{{{withdraw}}} 2' in lines
+    assert f'bloodsite_responses_total{{{withdraw},status="200"}} 2' in lines
+    assert 'bloodsite_responses_total{endpoint="unmatched",method="GET",status="404"} 1' in lines
+    assert any(line.startswith(f'bloodsite_slowest_statement_seconds{{{withdraw}}} ') for line in lines)
+    assert 'bloodsite_outbox_queued 0' in lines
+    assert '# TYPE bloodsite_staff_cache_hits_total counter' in lines
+    # Buckets count every request at or under their bound, so they never go down
+    buckets = [int(line.rsplit(' ', 1)[1]) for line in lines
+               if line.startswith(f'bloodsite_request_duration_seconds_bucket{{{withdraw}')]
+    assert buckets == sorted(buckets) and len(buckets) == 12
+
+
+def test_etag_changes_with_a_write_the_cache_never_saw(app, client):
+    app.config['CACHE_TTL'] = 0
+    first = client.get('/rebalance')
+    # As if "flask banks set-target" ran in another process
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        try:
+            connection.cursor().execute("INSERT INTO bank_target (location, blood_type, blood, plasma, target) "
+                                        "VALUES ('Denton', 'O-', TRUE, FALSE, 5)")
+            connection.commit()
+        finally:
+            connection.close()
+    again = client.get('/rebalance', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200
+    assert again.headers['ETag'] != first.headers['ETag']
+    assert again.get_json() != first.get_json()
@@ -0,0 +1,58 @@
+from sqlalchemy import inspect
+from benchmarks import seed
+from bloodapp import db, inventory, ledger, migrations, queryplans
+from bloodapp.models import Donation, Donor, SchemaVersion
+
+
+def test_a_new_database_has_every_step(app):
+    with app.app_context():
+        assert migrations.version() == migrations.STEPS[-1][0]
+        assert migrations.upgrade() == []
+
+
+def test_upgrade_drops_the_donation_type_and_date_index(app):
+    with app.app_context():
+        # A database from before ix_donation_expiry replaced it
+        db.session.execute('CREATE INDEX ix_donation_type_date ON donation (blood_type, blood, plasma, date)')
+        SchemaVersion.query.filter_by(version=3).delete()
+        db.session.commit()
+
+        assert migrations.upgrade() == ['schema version 3 (Drop the donation type and date index)']
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('donation')}
+        assert 'ix_donation_type_date' not in indexes
+        assert 'ix_donation_expiry' in indexes
+        assert SchemaVersion.query.filter_by(version=3).count() == 1
+
+
+def test_upgrade_makes_intake_keys_unique_per_employee(app):
+    with app.app_context():
+        db.session.execute('DROP INDEX ix_intake_key_staff_key')
+        db.session.execute('CREATE UNIQUE INDEX ix_intake_key_key ON intake_key (key)')
+        SchemaVersion.query.filter_by(version=4).delete()
+        db.session.commit()
+
+        assert migrations.upgrade() == ['ix_intake_key_staff_key',
+                                        'schema version 4 (Batch intake keys unique for each employee)']
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('intake_key')}
+        assert 'ix_intake_key_key' not in indexes
+
+
+def test_copy_from_moves_a_seeded_site(app, tmp_path):
+    path = tmp_path / 'site.db'
+    seed.seed(str(path), staff=3, banks=3, donors=50, donations=500, chunk_size=100)
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['db', 'copy-from', f'sqlite:///{path}', '--chunk-size', '64'])
+    assert result.exit_code == 0, result.output
+    assert 'donation: 500 rows' in result.output
+    with app.app_context():
+        assert Donor.query.count() == 50
+        assert Donation.query.count() == 500
+        assert inventory.verify() == []
+        assert ledger.verify() == []
+        # The route queries still use an index on this engine
+        assert queryplans.regressions() == []
+
+    result = runner.invoke(args=['db', 'copy-from', f'sqlite:///{path}'])
+    assert result.exit_code == 1
+    assert 'already has rows, copy into a newly upgraded database' in result.output
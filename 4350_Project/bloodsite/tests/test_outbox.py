@@ -0,0 +1,138 @@
+"""The outbox worker sending to a real SMTP server on localhost"""
+import socket
+import flask_mail
+import pytest
+from aiosmtpd.controller import Controller
+from flask_mail import Message
+from bloodapp import create_app, db, migrations, outbox
+from bloodapp.config import TestingConfig
+from bloodapp.models import OutboxMessage
+
+
+class Inbox:
+    """Keeps the recipients of every message the server accepts, and turns
+    away mail for refused@donor.test"""
+
+    def __init__(self):
+        self.received = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if 'refused@donor.test' in envelope.rcpt_tos:
+            return '550 No such mailbox'
+        self.received.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+@pytest.fixture
+def inbox():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    inbox = Inbox()
+    controller = Controller(inbox, hostname='127.0.0.1', port=port)
+    controller.start()
+    inbox.port = port
+    yield inbox
+    controller.stop()
+
+
+@pytest.fixture
+def app(inbox):
+    """The site sending mail to the inbox instead of suppressing it"""
+    class MailConfig(TestingConfig):
+        MAIL_SERVER = '127.0.0.1'
+        MAIL_PORT = inbox.port
+        MAIL_USE_TLS = False
+        MAIL_USERNAME = None
+        MAIL_PASSWORD = None
+        MAIL_SUPPRESS_SEND = False
+
+    app = create_app(MailConfig)
+    with app.app_context():
+        migrations.upgrade()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def _queue(*recipients):
+    outbox.enqueue_many([Message('Your Donor ID', sender='noreply@bloodbank.test', recipients=[recipient],
+                                 body='Welcome') for recipient in recipients])
+    db.session.commit()
+
+
+def test_drain_sends_and_marks_each_email(app, inbox):
+    with app.app_context():
+        _queue('a@donor.test', 'refused@donor.test', 'b@donor.test')
+        assert outbox.drain() == 2
+        assert inbox.received == ['a@donor.test', 'b@donor.test']
+        refused = OutboxMessage.query.filter_by(recipients='refused@donor.test').one()
+        assert refused.sent is None and refused.attempts == 1 and '550' in refused.last_error
+        assert outbox.queue_depth() == 1
+        # The refused email waits out its backoff, the rest are never sent twice
+        assert outbox.drain() == 0
+        assert inbox.received == ['a@donor.test', 'b@donor.test']
+
+
+def test_drain_stops_at_the_batch_size(app, inbox):
+    app.config['OUTBOX_BATCH_SIZE'] = 2
+    with app.app_context():
+        _queue('a@donor.test', 'b@donor.test', 'c@donor.test')
+        assert outbox.drain() == 2
+        assert outbox.drain() == 1
+        assert inbox.received == ['a@donor.test', 'b@donor.test', 'c@donor.test']
+
+
+def test_a_worker_that_dies_mid_batch_keeps_what_it_sent(app, inbox, monkeypatch):
+    send = flask_mail.Connection.send
+
+    def send_then_die(conn, message, envelope_from=None):
+        send(conn, message, envelope_from)
+        if len(inbox.received) == 2:
+            raise SystemExit('killed')
+    monkeypatch.setattr(flask_mail.Connection, 'send', send_then_die)
+    with app.app_context():
+        _queue('a@donor.test', 'b@donor.test', 'c@donor.test', 'd@donor.test')
+        with pytest.raises(SystemExit):
+            outbox.drain()
+        db.session.rollback()
+        monkeypatch.setattr(flask_mail.Connection, 'send', send)
+        assert outbox.drain() == 3
+    # Only the email being sent when the worker died goes out twice
+    assert inbox.received == ['a@donor.test', 'b@donor.test', 'b@donor.test', 'c@donor.test', 'd@donor.test']
+
+
+def _hang_up(monkeypatch, times):
+    """Drops the connection before each of the next few sends after the
+    first, the way smtplib leaves it when the server hangs up"""
+    send = flask_mail.Connection.send
+    sends = []
+
+    def hang_up_then_send(conn, message, envelope_from=None):
+        sends.append(message)
+        if 1 < len(sends) <= times + 1:
+            conn.host.close()
+        send(conn, message, envelope_from)
+    monkeypatch.setattr(flask_mail.Connection, 'send', hang_up_then_send)
+
+
+def test_drain_reconnects_once_when_the_server_hangs_up(app, inbox, monkeypatch):
+    _hang_up(monkeypatch, 1)
+    with app.app_context():
+        _queue('a@donor.test', 'b@donor.test', 'c@donor.test')
+        assert outbox.drain() == 3
+        assert [item.attempts for item in OutboxMessage.query.order_by(OutboxMessage.id)] == [0, 0, 0]
+    assert inbox.received == ['a@donor.test', 'b@donor.test', 'c@donor.test']
+
+
+def test_drain_stops_the_batch_when_the_server_keeps_hanging_up(app, inbox, monkeypatch):
+    _hang_up(monkeypatch, 2)
+    with app.app_context():
+        _queue('a@donor.test', 'b@donor.test', 'c@donor.test')
+        assert outbox.drain() == 1
+        # Only the email in hand is charged, c was never tried
+        assert [(item.recipients, item.attempts) for item in OutboxMessage.query.order_by(OutboxMessage.id)] == \
+            [('a@donor.test', 0), ('b@donor.test', 1), ('c@donor.test', 0)]
+        assert outbox.queue_depth() == 2
+    assert inbox.received == ['a@donor.test']
@@ -0,0 +1,156 @@
+"""The code that only runs on PostgreSQL. These run when the conftest can
+reach a PostgreSQL server, see postgres_server"""
+import datetime
+import threading
+import pytest
+from sqlalchemy import inspect
+from bloodapp import create_app, db, dbcopy, ledger, migrations, withdrawals
+from bloodapp.config import TestingConfig
+from bloodapp.database import increment
+from bloodapp.models import Donor, Inventory, LedgerEvent, SchemaVersion, Staff
+
+pytestmark = pytest.mark.postgresql_only
+
+KEY = {"location": 'Denton', "blood_type": 'O-', "blood": True, "plasma": False}
+
+
+def _add_one(app, written, release, errors):
+    with app.app_context():
+        try:
+            increment(db.session, Inventory.__table__, KEY, {"count": 1})
+            written.set()
+            release.wait(5)
+            db.session.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            written.set()
+            db.session.remove()
+
+
+def test_increment_creates_a_row_once_when_two_writers_race(app):
+    # The second writer's INSERT waits on the first one's row, then adds to
+    # it instead of failing on the unique constraint
+    first_written, second_written, release, errors = threading.Event(), threading.Event(), threading.Event(), []
+    first = threading.Thread(target=_add_one, args=(app, first_written, release, errors))
+    second = threading.Thread(target=_add_one, args=(app, second_written, release, errors))
+    first.start()
+    assert first_written.wait(5)
+    second.start()
+    assert not second_written.wait(0.5)
+    release.set()
+    first.join()
+    second.join()
+
+    assert errors == []
+    with app.app_context():
+        assert Inventory.query.filter_by(**KEY).one().count == 2
+
+
+def test_withdrawals_pass_over_units_another_withdrawal_has_locked(app, add_units):
+    add_units(3)
+    with app.app_context():
+        other = db.engine.connect()
+        transaction = other.begin()
+        try:
+            other.execute('SELECT id FROM donation ORDER BY id LIMIT 2 FOR UPDATE')
+            # Fail rather than hang if the withdrawal waits for those units
+            db.session.execute("SET lock_timeout = '2s'")
+            assert withdrawals.ship('O-', True, False, 3) == 1
+        finally:
+            transaction.rollback()
+            other.close()
+        assert Inventory.query.filter_by(**KEY).one().count == 2
+
+
+def _snapshot(app, taken, errors):
+    with app.app_context():
+        try:
+            taken.append(ledger.snapshot().last_event_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.session.remove()
+
+
+def test_snapshots_wait_for_events_that_have_not_committed(app, add_units):
+    # The open insert takes an id before a later one commits, so a snapshot
+    # taken in between would put it below last_event_id before it is visible
+    add_units(1)
+    taken, errors = [], []
+    with app.app_context():
+        other = db.engine.connect()
+        transaction = other.begin()
+        try:
+            other.execute(LedgerEvent.__table__.insert().values(
+                at=datetime.datetime.utcnow(), event='donated', location='Denton', blood_type='O-', blood=True,
+                units=1))
+            add_units(1)
+            thread = threading.Thread(target=_snapshot, args=(app, taken, errors))
+            thread.start()
+            thread.join(0.5)
+            assert thread.is_alive()
+            transaction.commit()
+        finally:
+            other.close()
+        thread.join(5)
+
+        assert errors == [] and taken == [3]
+        assert ledger.stock_at() == {('Denton', 'O-', True): 3}
+        add_units(1)
+        assert ledger.stock_at() == {('Denton', 'O-', True): 4}
+
+
+def test_copy_database_moves_the_sequences_past_the_copied_ids(app, tmp_path, add_donor):
+    class SourceConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "site.db"}'
+
+    with create_app(SourceConfig).app_context():
+        migrations.upgrade()
+        db.session.add(Staff(first_name='nancy', last_name='nurse', email='nurse@bloodbank.test', role='Nurse',
+                             location='Denton', password='x'))
+        db.session.add_all(Donor(first_name='donor', last_name=str(i), email=f'donor{i}@donor.test', age=30,
+                                 blood_type='O-') for i in range(5))
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+    with app.app_context():
+        copied = dbcopy.copy_database(f'sqlite:///{tmp_path / "site.db"}', chunk_size=2)
+        assert copied["donor"] == 5 and copied["staff"] == 1
+    assert add_donor() == 6
+
+
+def test_copy_database_refuses_rows_that_would_not_fit(app, tmp_path):
+    class SourceConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "site.db"}'
+
+    with create_app(SourceConfig).app_context():
+        migrations.upgrade()
+        db.session.add(Donor(first_name='donor', last_name='long', email='x' * 130, age=30, blood_type='O-'))
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+    with app.app_context():
+        with pytest.raises(ValueError, match='donor.email'):
+            dbcopy.copy_database(f'sqlite:///{tmp_path / "site.db"}')
+        assert Donor.query.count() == 0
+
+
+def test_upgrade_makes_the_steps_a_database_has_not_had(app):
+    with app.app_context():
+        # A database from before the steps: narrow emails, eligibility indexes without the id
+        db.session.execute('ALTER TABLE donor ALTER COLUMN email TYPE VARCHAR(60)')
+        db.session.execute('DROP INDEX ix_donor_blood_eligible')
+        db.session.execute('CREATE INDEX ix_donor_blood_eligible ON donor (blood_type, next_blood_eligible, location)')
+        SchemaVersion.query.filter(SchemaVersion.version.in_([1, 2])).delete(synchronize_session=False)
+        db.session.commit()
+
+        assert migrations.upgrade() == ['schema version 1 (Donor emails up to 120 characters)',
+                                        'schema version 2 (Eligibility and expiry indexes end in the id)']
+        email = [column for column in inspect(db.engine).get_columns('donor') if column['name'] == 'email'][0]
+        assert email['type'].length == 120
+        index = [index for index in inspect(db.engine).get_indexes('donor')
+                 if index['name'] == 'ix_donor_blood_eligible'][0]
+        assert index['column_names'] == ['blood_type', 'next_blood_eligible', 'location', 'id']
@@ -0,0 +1,50 @@
+"""The lookups the routes make on every request, checked against a small seeded
+database the way "flask db check-plans" checks site.db"""
+import datetime
+from benchmarks import seed
+from bloodapp import create_app, db, queryplans
+from bloodapp.config import TestingConfig
+
+
+def _seed(add_staff, add_bank, add_donor, add_units):
+    for i, location in enumerate(['Denton', 'Frisco', 'Irving']):
+        add_bank(location, add_staff(email=f'manager{i}@bloodbank.test', location=location))
+        for blood_type in ['O-', 'A+']:
+            add_donor(first_name=f'donor{i}', last_name=blood_type, blood_type=blood_type, location=location)
+            add_units(3, blood_type=blood_type, location=location)
+            add_units(2, blood_type=blood_type, location=location, blood=False,
+                      date=datetime.datetime.utcnow() - datetime.timedelta(days=400))
+
+
+def test_hot_queries_use_an_index(app, add_staff, add_bank, add_donor, add_units):
+    _seed(add_staff, add_bank, add_donor, add_units)
+    with app.app_context():
+        failed = queryplans.regressions()
+    assert failed == [], '\n'.join(f'{name}: {" / ".join(plan)}' for name, plan in failed)
+
+
+def test_a_missing_index_is_reported(app, add_staff, add_bank, add_donor, add_units):
+    _seed(add_staff, add_bank, add_donor, add_units)
+    with app.app_context():
+        db.session.execute('DROP INDEX ix_staff_email')
+        db.session.execute('DROP INDEX ix_donation_expiry')
+        db.session.commit()
+        failed = dict(queryplans.regressions())
+    assert 'login / reset_request / employee forms' in failed
+    assert 'withdraw units closest to expiry' in failed
+
+
+def test_check_plans_passes_on_a_seeded_database(tmp_path):
+    path = tmp_path / 'seed.db'
+    seed.seed(str(path), staff=5, banks=5, donors=500, donations=3000, chunk_size=1000)
+
+    class SeededConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+
+    app = create_app(SeededConfig)
+    result = app.test_cli_runner().invoke(args=['db', 'check-plans'])
+    assert result.exit_code == 0, result.output
+    assert 'All hot queries use an index' in result.output
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
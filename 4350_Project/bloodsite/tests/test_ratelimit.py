@@ -0,0 +1,125 @@
+"""The login and password reset limits, on the memory backend the site
+uses by default. TestingConfig turns them off for every other test"""
+import pytest
+from bloodapp import passwords
+from bloodapp.models import OutboxMessage
+from bloodapp.ratelimit import MemoryBackend, rate_limiter
+from conftest import PASSWORD
+
+
+class Clock:
+    """Stands in for time.monotonic, moved on by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(app):
+    """Turns the limits on for the app, on a clock the test moves"""
+    clock = Clock()
+    app.extensions['rate_limit'] = MemoryBackend(app.config['RATELIMIT_SIZE'], clock=clock)
+    return clock
+
+
+@pytest.fixture
+def checked(monkeypatch):
+    """The passwords checked with bcrypt"""
+    checked = []
+    real = passwords.check_password
+
+    def check_password(staff, password):
+        checked.append(password)
+        return real(staff, password)
+    monkeypatch.setattr(passwords, 'check_password', check_password)
+    return checked
+
+
+def _login(app, password, email='nurse@bloodbank.test', address='127.0.0.1'):
+    return app.test_client().post('/login', data={"email": email, "password": password},
+                                  environ_base={'REMOTE_ADDR': address})
+
+
+def test_a_bucket_refills_evenly():
+    clock = Clock()
+    bucket = MemoryBackend(10, clock=clock)
+    assert [bucket.take('key', 2, 10, 1) for _ in range(3)] == [0, 0, 5]
+    clock.now += 4
+    assert bucket.take('key', 2, 10, 0) == pytest.approx(1)
+    clock.now += 1
+    assert bucket.take('key', 2, 10, 0) == 0
+    assert bucket.take('key', 2, 10, 1) == 0
+    assert bucket.take('key', 2, 10, 1) == 5
+
+
+def test_the_least_recently_used_bucket_is_dropped():
+    bucket = MemoryBackend(2, clock=Clock())
+    for key in ('a', 'b', 'a', 'c'):
+        bucket.take(key, 2, 60, 1)
+    assert len(bucket) == 2
+    # a was used after b, so b was dropped and starts full again
+    assert bucket.take('a', 2, 60, 1) == 30
+    assert [bucket.take('b', 2, 60, 1) for _ in range(2)] == [0, 0]
+
+
+def test_failed_logins_lock_out_the_email_before_bcrypt_runs(app, add_staff, clock, checked):
+    add_staff()
+    app.config['RATELIMIT_LOGIN_PER_EMAIL'] = (2, 60)
+    assert [_login(app, 'not-it').status_code for _ in range(2)] == [200, 200]
+    response = _login(app, PASSWORD)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+    assert b'Too many attempts, please try again in 30 seconds' in response.data
+    assert checked == ['not-it', 'not-it']
+    # Another address makes no difference, the bucket is the email's
+    assert _login(app, PASSWORD, address='10.0.0.2').status_code == 429
+    clock.now += 30
+    assert _login(app, PASSWORD).status_code == 302
+
+
+def test_logins_that_succeed_spend_nothing_from_the_email(app, add_staff, clock):
+    add_staff()
+    app.config['RATELIMIT_LOGIN_PER_EMAIL'] = (2, 60)
+    assert [_login(app, PASSWORD).status_code for _ in range(4)] == [302] * 4
+
+
+def test_every_login_spends_from_the_address(app, add_staff, clock, checked):
+    add_staff()
+    app.config['RATELIMIT_LOGIN_PER_IP'] = (3, 60)
+    for i in range(3):
+        assert _login(app, 'not-it', email=f'guess{i}@bloodbank.test').status_code == 200
+    assert _login(app, PASSWORD).status_code == 429
+    assert _login(app, PASSWORD, address='10.0.0.2').status_code == 302
+    assert checked == [PASSWORD]
+
+
+def test_reset_requests_are_limited_before_an_email_is_queued(app, add_staff, clock):
+    add_staff()
+    app.config['RATELIMIT_RESET_PER_EMAIL'] = (1, 3600)
+    client = app.test_client()
+    assert client.post('/reset_password', data={"email": 'nurse@bloodbank.test'}).status_code == 302
+    response = client.post('/reset_password', data={"email": 'Nurse@BloodBank.test '})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3600'
+    with app.app_context():
+        assert OutboxMessage.query.count() == 1
+
+
+def test_metrics_count_the_attempts(app, add_staff, clock):
+    add_staff()
+    app.config['RATELIMIT_LOGIN_PER_EMAIL'] = (1, 60)
+    app.config['METRICS_TOKEN'] = 'scrape'
+    # The counters are kept for the whole process, across tests
+    with app.app_context():
+        before = rate_limiter.stats()
+    _login(app, 'not-it')
+    _login(app, 'not-it')
+    body = app.test_client().get('/metrics', headers={'Authorization': 'Bearer scrape'}).get_data(as_text=True)
+    allowed = before["allowed"].get('login_per_email', 0) + 1
+    limited = before["limited"].get('login_per_email', 0) + 1
+    assert f'bloodsite_ratelimit_allowed_total{{rule="login_per_email"}} {allowed}' in body
+    assert f'bloodsite_ratelimit_limited_total{{rule="login_per_email"}} {limited}' in body
+    assert 'bloodsite_ratelimit_buckets 2' in body
@@ -0,0 +1,51 @@
+import json
+from bloodapp import rebalance
+
+
+def test_the_largest_surplus_fills_the_largest_shortage():
+    counts = {("Austin", 'O-', True, False): 10, ("Dallas", 'O-', True, False): 0,
+              ("Irving", 'O-', True, False): 1, ("Plano", 'O-', True, False): 3,
+              ("Austin", 'A+', False, True): 2}
+    targets = {("Austin", 'O-', True, False): 4, ("Dallas", 'O-', True, False): 5,
+               ("Irving", 'O-', True, False): 4, ("Austin", 'A+', False, True): 0,
+               ("Dallas", 'A+', False, True): 1}
+    # Plano has no target, so its three units are not offered
+    assert rebalance.plan(counts, targets) == {
+        "transfers": [
+            {"from": 'Austin', "to": 'Dallas', "blood_type": 'A+', "kind": 'plasma', "units": 1},
+            {"from": 'Austin', "to": 'Dallas', "blood_type": 'O-', "kind": 'blood', "units": 5},
+            {"from": 'Austin', "to": 'Irving', "blood_type": 'O-', "kind": 'blood', "units": 1},
+        ],
+        "unmet": [{"location": 'Irving', "blood_type": 'O-', "kind": 'blood', "units": 2}],
+    }
+
+
+def test_a_surplus_is_split_between_shortages():
+    counts = {("Austin", 'B+', True, False): 9, ("Dallas", 'B+', True, False): 0, ("Irving", 'B+', True, False): 0}
+    targets = {("Austin", 'B+', True, False): 3, ("Dallas", 'B+', True, False): 2, ("Irving", 'B+', True, False): 4}
+    plan = rebalance.plan(counts, targets)
+    assert [(transfer["to"], transfer["units"]) for transfer in plan["transfers"]] == [('Irving', 4), ('Dallas', 2)]
+    assert plan["unmet"] == []
+
+
+def test_branches_at_their_targets_need_nothing():
+    counts = {("Austin", 'O-', True, False): 4}
+    assert rebalance.plan(counts, {("Austin", 'O-', True, False): 4}) == {"transfers": [], "unmet": []}
+
+
+def test_plan_command_uses_the_inventory_and_the_targets(app, client, staff_id, add_bank, add_units):
+    add_bank('Frisco', staff_id)
+    add_units(5)
+    runner = app.test_cli_runner()
+    assert 'Denton blood O-: target 2 units' in runner.invoke(args=['banks', 'set-target', 'Denton', 'O-', '2']).output
+    runner.invoke(args=['banks', 'set-target', 'Frisco', 'O-', '4'])
+    assert 'There is no bank at Austin' in runner.invoke(args=['banks', 'set-target', 'Austin', 'O-', '4']).output
+
+    result = runner.invoke(args=['banks', 'plan'])
+    assert '3 blood O-: Denton -> Frisco' in result.output
+    assert 'Frisco is still 1 blood O- short' in result.output
+    assert json.loads(runner.invoke(args=['banks', 'plan', '--json']).output) == client.get('/rebalance').get_json()
+
+    # Clearing Frisco's target leaves nothing to move
+    runner.invoke(args=['banks', 'set-target', 'Frisco', 'O-'])
+    assert '0 transfers' in runner.invoke(args=['banks', 'plan']).output
@@ -0,0 +1,145 @@
+"""Reports reading a snapshot of a SQLite file, or a replica, and falling
+back to the main database for a user's own writes"""
+import os
+import threading
+import time
+import pytest
+from bloodapp import create_app, db, migrations
+from bloodapp.config import TestingConfig
+from bloodapp.models import Bank
+from bloodapp.reporting import BindReplica, reporting
+
+STALENESS = 60
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The site on a database file, with reports reading a copy of it"""
+    class SnapshotConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "site.db"}'
+        REPORTING_SNAPSHOT_PATH = str(tmp_path / 'snapshot.db')
+        REPORTING_MAX_STALENESS = STALENESS
+
+    app = create_app(SnapshotConfig)
+    with app.app_context():
+        migrations.upgrade()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def replica(app):
+    return app.extensions['reporting']
+
+
+@pytest.fixture
+def copies(replica, monkeypatch):
+    """Holds every copy until copies.release is set, and counts them"""
+    copies = threading.Event()
+    copies.release = threading.Event()
+    copies.count = 0
+    copy = replica._copy
+
+    def held_copy():
+        copies.count += 1
+        copies.set()
+        copies.release.wait(5)
+        return copy()
+    monkeypatch.setattr(replica, '_copy', held_copy)
+    return copies
+
+
+def _units(client):
+    return sum(row["units"] for row in client.get('/ledger/stock').get_json()["stock"])
+
+
+def _wait_for_copy(replica):
+    # The background copy holds the lock until it is done
+    assert replica._lock.acquire(timeout=5)
+    replica._lock.release()
+
+
+def test_reports_read_the_snapshot(app, client, add_units, replica):
+    add_units(3)
+    replica.refresh()
+    add_units(1)
+    assert _units(client) == 3
+    with app.test_request_context('/'):
+        assert reporting.engine() is replica.engine
+        assert reporting.source().startswith('snapshot-')
+        db.reporting_session.add(Bank(location='Frisco', manager_id=1))
+        with pytest.raises(RuntimeError, match='read only'):
+            db.reporting_session.flush()
+
+
+def test_a_user_reads_their_own_writes(app, client, staff_id, add_units, replica):
+    add_units(3)
+    replica.refresh()
+    response = client.post('/withdraw', data={"blood_type": 'O-', "blood_or_plasma": 'Blood', "units": '1',
+                                              "location": ''})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert session['last_write'] >= replica.taken()
+    assert _units(client) == 2
+
+    # Everyone else keeps reading the copy, which is still within the window
+    other = app.test_client()
+    with other.session_transaction() as session:
+        session['_user_id'] = str(staff_id)
+        session['_fresh'] = True
+    assert _units(other) == 3
+
+    replica.refresh()
+    assert _units(client) == 2 and _units(other) == 2
+
+
+def test_a_stale_snapshot_is_copied_again_in_the_background(app, client, add_units, replica, copies):
+    add_units(3)
+    copies.release.set()
+    replica.refresh()
+    copies.release.clear()
+    add_units(1)
+    old = time.time() - STALENESS - 1
+    os.utime(replica.path, (old, old))
+
+    # The copy is too old to read, and the requests do not wait for the new one
+    assert _units(client) == 4
+    assert copies.wait(5)
+    assert _units(client) == 4
+    assert copies.count == 2
+    copies.release.set()
+    _wait_for_copy(replica)
+
+    add_units(1)
+    assert _units(client) == 4
+    assert copies.count == 2
+
+
+def test_a_background_copy_is_skipped_when_another_left_it_fresh(app, replica, copies):
+    copies.release.set()
+    replica.refresh()
+    with app.app_context():
+        assert replica.refresh_in_background(app.logger)
+    _wait_for_copy(replica)
+    assert copies.count == 1
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_a_replica_is_read_once_it_is_past_the_last_write(monkeypatch):
+    clock = Clock(1000.0)
+    monkeypatch.setattr('bloodapp.reporting.time', clock)
+    replica = BindReplica('sqlite://', STALENESS)
+    # The period that started at 960 may not have reached writes after 900
+    assert replica.engine_for(950) is None
+    assert replica.engine_for(900) == (replica.engine, 'replica-960')
+    clock.now = 1020.0
+    assert replica.engine_for(950) == (replica.engine, 'replica-1020')
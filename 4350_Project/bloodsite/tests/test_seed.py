@@ -0,0 +1,20 @@
+from benchmarks import seed
+from bloodapp import create_app, db, inventory, ledger
+from bloodapp.config import TestingConfig
+from bloodapp.models import Donation, Donor
+
+
+def test_seeded_database_adds_up(tmp_path):
+    path = tmp_path / 'seed.db'
+    seed.seed(str(path), staff=3, banks=3, donors=50, donations=500, chunk_size=100)
+
+    class SeededConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+
+    with create_app(SeededConfig).app_context():
+        assert Donor.query.count() == 50
+        assert Donation.query.count() == 500
+        assert inventory.verify() == []
+        assert ledger.verify() == []
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,73 @@
+from bloodapp import db
+from bloodapp.models import Staff
+from bloodapp.passwords import hash_cost
+from bloodapp.querycount import count_queries
+from bloodapp.staffcache import staff_cache
+from conftest import PASSWORD
+
+
+def test_login_with_the_right_password(app, staff_id):
+    response = app.test_client().post('/login', data={"email": 'nurse@bloodbank.test', "password": PASSWORD})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/createDonor')
+
+
+def test_login_with_the_wrong_password(app, staff_id):
+    response = app.test_client().post('/login', data={"email": 'nurse@bloodbank.test', "password": 'not-it'})
+    assert response.status_code == 200
+    assert b'Login failed' in response.data
+
+
+def test_logged_in_pages_redirect_to_login(app):
+    response = app.test_client().get('/withdraw')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+def test_logout(client):
+    client.get('/logout')
+    assert client.get('/withdraw').status_code == 302
+
+
+def _cost(app, staff_id):
+    with app.app_context():
+        return hash_cost(Staff.query.get(staff_id).password)
+
+
+def test_login_rehashes_a_password_made_at_another_cost(app, add_staff):
+    staff_id = add_staff()
+    assert _cost(app, staff_id) == 4
+    app.config['BCRYPT_LOG_ROUNDS'] = 5
+    login = {"email": 'nurse@bloodbank.test', "password": 'not-it'}
+    app.test_client().post('/login', data=login)
+    assert _cost(app, staff_id) == 4
+    assert app.test_client().post('/login', data=dict(login, password=PASSWORD)).status_code == 302
+    assert _cost(app, staff_id) == 5
+    # The new hash still takes the password
+    assert app.test_client().post('/login', data=dict(login, password=PASSWORD)).status_code == 302
+
+
+def test_the_user_loader_reads_an_employee_once(app, client):
+    # The counters are kept for the whole process, across tests
+    with app.app_context():
+        before = staff_cache.stats()
+        client.get('/account')
+        with count_queries() as counter:
+            client.get('/account')
+        after = staff_cache.stats()
+    assert not any('FROM staff WHERE staff.id' in statement for statement in counter.statements)
+    assert (after["misses"] - before["misses"], after["hits"] - before["hits"]) == (1, 1)
+    assert after["size"] == 1
+
+
+def test_update_employee_drops_the_cached_employee(app, client, staff_id):
+    assert b'value="Nancy"' in client.get('/account').data
+    with app.app_context():
+        # Behind the cache's back, so the cached row is still used
+        Staff.query.get(staff_id).first_name = 'nora'
+        db.session.commit()
+    assert b'value="Nancy"' in client.get('/account').data
+    response = client.post('/account', data={"first_name": 'Nell', "last_name": 'Nurse', "role": 'Nurse',
+                                             "email": 'nurse@bloodbank.test', "location": 'Denton'})
+    assert b'Employee Updated' in response.data
+    assert b'value="Nell"' in client.get('/account').data
@@ -0,0 +1,9 @@
+"""Production entry point. Serve the site with a WSGI server instead of run.py:
+
+    waitress-serve --threads=8 wsgi:app
+    gunicorn --workers 4 wsgi:app
+
+The database and its tuning come from the environment, see bloodapp/config.py"""
+from bloodapp import create_app
+
+app = create_app()